@@ -128,6 +128,179 @@ def main_json(config, in_metadata, out_metadata):
 
     return result
 
+def _read_config_arguments(config):
+    with open(config, "r") as confF:
+        config_data = json.load(confF)
+    
+    return {
+        argument['name']: argument.get('value')
+        for argument in config_data.get('arguments', [])
+    }
+
+def main_batch(jobs_file, concurrency=None):
+    """
+    Batch mode
+    ----------
+
+    This function runs many jobs, each one of them described by its
+    config, in_metadata, out_metadata (and optional log_file) paths in
+    the jobs file (a JSON array). Relative paths are resolved against
+    the directory of the jobs file.
+    The workflows and the engine images are prepared only once, and
+    the jobs are run in processes forked from a single threaded forker,
+    at most concurrency at once.
+    """
+    import concurrent.futures
+    import sys
+    from tool.daemon import JobForker, job_description
+    
+    with open(jobs_file, "r") as jobsF:
+        jobs = json.load(jobsF)
+    
+    jobs_dir = os.path.dirname(os.path.abspath(jobs_file))
+    workflows = []
+    for job in jobs:
+        for key in ('config', 'in_metadata', 'out_metadata', 'log_file'):
+            if job.get(key) is not None and not os.path.isabs(job[key]):
+                job[key] = os.path.join(jobs_dir, job[key])
+        
+        workflow = _workflow_of(job['config'])
+        if workflow[0] is not None and workflow[1] is not None and workflow not in workflows:
+            workflows.append(workflow)
+    
+    # The shared setup is paid only once, and it is inherited by the jobs
+    wf_runner = WF_RUNNER()
+    wf_runner.warmUp(workflows)
+    # No thread should be alive when forking
+    wf_runner.prefetch_pool.shutdown(wait=True)
+    
+    if concurrency is None:
+        concurrency = wf_runner.batch_concurrency
+    logger.info("Running {} jobs from {} ({} at once)".format(len(jobs), jobs_file, concurrency))
+    
+    def run_batch_job(job_idx):
+        job = jobs[job_idx]
+        try:
+            retval = forker.run(job_description(job['config'], job['in_metadata'], job['out_metadata'], log_file=job.get('log_file')), [sys.stdout.fileno(), sys.stderr.fileno()])
+            return job_idx, None  if retval == 0  else "retval {}".format(retval)
+        except Exception as error:
+            return job_idx, str(error)
+    
+    failed = []
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # The forker is started before any thread, and the jobs are
+    # handed to it from the threads of the pool
+    with JobForker(main_json) as forker:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="vre-batch") as batch_pool:
+            for job_future in concurrent.futures.as_completed([batch_pool.submit(run_batch_job, job_idx) for job_idx in range(len(jobs))]):
+                job_idx, error = job_future.result()
+                if error is None:
+                    logger.info("Batch job {} finished; see {}".format(job_idx, jobs[job_idx]['out_metadata']))
+                else:
+                    logger.error("Batch job {} failed: {}".format(job_idx, error))
+                    failed.append(job_idx)
+    
+    print("{} jobs finished, {} failed".format(len(jobs) - len(failed), len(failed)))
+    
+    return 1  if len(failed) > 0  else 0
+
+def _workflow_of(config):
+    arguments = _read_config_arguments(config)
+    return (arguments.get('nextflow_repo_uri'), arguments.get('nextflow_repo_tag'), arguments.get('nextflow_repo_reldir'))
+
+def main_daemon(socket_path=None, cpu_budget=None):
+    """
+    Runner daemon
+    -------------
+
+    This function starts a long lived runner, which receives the jobs
+    through a Unix socket (see the [daemon] section of the deployment
+    configuration file). Jobs are admitted while they fit in the CPU
+    budget, each one of them taking nextflow max-cpus, and they are run
+    in processes forked from the single threaded forker of the daemon,
+    inheriting its warmed caches.
+    """
+    import datetime
+    from tool.daemon import RunnerDaemon
+    
+    wf_runner = WF_RUNNER()
+    # No thread should be alive when forking
+    wf_runner.prefetch_pool.shutdown(wait=True)
+    if socket_path is None:
+        socket_path = wf_runner.daemon_socket
+    if socket_path is None:
+        raise Exception("ERROR: No daemon socket was given, neither in the command line nor in the [daemon] section")
+    if cpu_budget is None:
+        cpu_budget = wf_runner.daemon_cpu_budget
+    
+    # Workflows are warmed up again once the image confirmations expire
+    warmed = {}
+    def warm_func(job):
+        workflow = _workflow_of(job['config'])
+        if workflow[0] is None or workflow[1] is None:
+            return
+        now = datetime.datetime.now().timestamp()
+        if (now - warmed.get(workflow, 0)) < wf_runner.image_cache_ttl:
+            return
+        warm_runner = WF_RUNNER()
+        try:
+            warm_runner.warmUp([workflow])
+        finally:
+            warm_runner.prefetch_pool.shutdown(wait=True)
+        warmed[workflow] = now
+    
+    daemon = RunnerDaemon(socket_path, cpu_budget, wf_runner.max_cpus, main_json, warm_func=warm_func)
+    daemon.serve_forever()
+    
+    return 0
+
+def main_cache(cache_command, max_size=None):
+    """
+    Cache management
+    ----------------
+
+    This function lists or prunes the workflows cache declared in the
+    deployment configuration file. Pruning also reaps the scratch
+    directories left by crashed jobs.
+    """
+    from tool.cache_index import format_size, parse_size
+    import datetime
+
+    wf_runner = WF_RUNNER()
+    if cache_command == "prune":
+        evicted = wf_runner.pruneWorkflowCache(parse_size(max_size)  if max_size is not None  else None)
+        print("Evicted {} entries".format(len(evicted)))
+        evicted = wf_runner.replay_cache.prune(parse_size(max_size)  if max_size is not None  else None)
+        print("Evicted {} replay cache entries".format(len(evicted)))
+        if wf_runner.work_cache is not None:
+            evicted = wf_runner.work_cache.prune(parse_size(max_size)  if max_size is not None  else None)
+            print("Evicted {} work cache entries".format(len(evicted)))
+        if wf_runner.memo_store is not None:
+            evicted = wf_runner.memo_store.prune(parse_size(max_size)  if max_size is not None  else None)
+            print("Evicted {} memoized jobs".format(len(evicted)))
+        reaped = wf_runner.reapScratch(force_legacy=True)
+        print("Reaped {} stale job scratch directories".format(len(reaped)))
+
+    entries = wf_runner.scanWorkflowCache()
+    total_size = 0
+    for entry_id, entry in sorted(entries.items(), key=lambda e: e[1].get('last_used', 0), reverse=True):
+        total_size += entry.get('size', 0)
+        print("{}\t{}\t{}\t{}\t{}\t{}".format(
+            datetime.datetime.fromtimestamp(entry.get('last_used', 0)).replace(microsecond=0).isoformat(),
+            entry.get('hits', 0),
+            format_size(entry.get('size', 0)),
+            entry_id,
+            entry.get('uri', '?'),
+            entry.get('tag', ''),
+        ))
+    print("Total size: {} (budget {})".format(
+        format_size(total_size),
+        format_size(wf_runner.wf_cache_max_size)  if wf_runner.wf_cache_max_size  else "unlimited"
+    ))
+
+    return 0
+
 # ------------------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -139,16 +312,59 @@ if __name__ == "__main__":
     PARSER.add_argument("--out_metadata", help="Location of output metadata file")
     PARSER.add_argument("--log_file", help="Location of the log file")
     PARSER.add_argument("--local", action="store_const", const=True, default=False)
+    PARSER.add_argument("--no-daemon", dest="no_daemon", action="store_true", help="Run the job in this process, even when a runner daemon is configured")
+
+    SUBPARSERS = PARSER.add_subparsers(dest="command", help="Maintenance commands (no command runs a job)")
+    CACHE_PARSER = SUBPARSERS.add_parser("cache", help="Inspect or prune the workflows cache")
+    CACHE_PARSER.add_argument("cache_command", choices=["list", "prune"])
+    CACHE_PARSER.add_argument("--max-size", dest="max_size", help="Size budget to prune to (defaults to the configured one)")
+
+    BATCH_PARSER = SUBPARSERS.add_parser("batch", help="Run many jobs sharing the workflow and engine setup")
+    BATCH_PARSER.add_argument("jobs_file", help="JSON array of {config, in_metadata, out_metadata, log_file} jobs")
+    BATCH_PARSER.add_argument("--concurrency", type=int, help="Max number of concurrent jobs (defaults to the configured one)")
+
+    DAEMON_PARSER = SUBPARSERS.add_parser("daemon", help="Start a long lived runner which accepts jobs through a Unix socket")
+    DAEMON_PARSER.add_argument("--socket", help="Unix socket path (defaults to the configured one)")
+    DAEMON_PARSER.add_argument("--cpu-budget", dest="cpu_budget", type=int, help="CPUs shared by the concurrent jobs (defaults to the configured one)")
 
     # Get the matching parameters from the command line
     ARGS = PARSER.parse_args()
 
+    if ARGS.command == "cache":
+        import sys
+        sys.exit(main_cache(ARGS.cache_command, ARGS.max_size))
+
+    if ARGS.command == "batch":
+        import sys
+        if ARGS.log_file:
+            sys.stderr = sys.stdout = open(ARGS.log_file,"a")
+        if ARGS.local:
+            sys._run_from_cmdl = True  # pylint: disable=protected-access
+        sys.exit(main_batch(ARGS.jobs_file, ARGS.concurrency))
+
+    if ARGS.command == "daemon":
+        import sys
+        if ARGS.log_file:
+            sys.stderr = sys.stdout = open(ARGS.log_file,"a")
+        sys.exit(main_daemon(ARGS.socket, ARGS.cpu_budget))
+
     CONFIG = ARGS.config
     IN_METADATA = ARGS.in_metadata
     OUT_METADATA = ARGS.out_metadata
     LOCAL = ARGS.local
     
     import sys
+    
+    # When a runner daemon is available, the job is handed to it
+    if not ARGS.no_daemon:
+        LOCAL_CONFIG, _ = WF_RUNNER.readLocalConfig()
+        if LOCAL_CONFIG.has_option('daemon', 'socket'):
+            from tool.daemon import submit_job
+            try:
+                sys.exit(submit_job(os.path.expanduser(LOCAL_CONFIG.get('daemon', 'socket')), CONFIG, IN_METADATA, OUT_METADATA, log_file=ARGS.log_file, local=LOCAL))
+            except OSError as error:
+                logger.warning("Runner daemon is not available ({}: {}). Running the job in this process".format(type(error).__name__, error))
+    
     if ARGS.log_file:
         sys.stderr = sys.stdout = open(ARGS.log_file,"a")
     
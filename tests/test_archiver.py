@@ -0,0 +1,253 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import configparser
+import gzip
+import io
+import json
+import shutil
+import subprocess
+import tarfile
+import pytest
+
+from tool import archiver
+from tool.archiver import WORKDIR_KEEP_GLOBS, ArchiveSelection, ArchiveSpec, ParallelGzipWriter, archive_extension, archive_selection_from_config, archive_spec_from_config, harvest_dir, omission_reason, pack_dir
+
+def _config(**sections):
+    config = configparser.ConfigParser()
+    config.read_dict(sections)
+    return config
+
+def _make_tree(base_path):
+    (base_path / "sub" / "deeper").mkdir(parents=True)
+    (base_path / "a.txt").write_text("alpha")
+    (base_path / "sub" / "b.json").write_text('{"b": 1}')
+    (base_path / "sub" / "deeper" / "c.bin").write_bytes(bytes(range(256)) * 64)
+    (base_path / "link").symlink_to("a.txt")
+    return {
+        "a.txt": b"alpha",
+        "sub/b.json": b'{"b": 1}',
+        "sub/deeper/c.bin": bytes(range(256)) * 64,
+    }
+
+def _read_archive(archive_path, archive_format):
+    if archive_format == 'zstd':
+        archive_bytes = subprocess.run(["zstd", "-d", "-c", archive_path], stdout=subprocess.PIPE, check=True).stdout
+        tar = tarfile.open(fileobj=io.BytesIO(archive_bytes), mode="r:")
+    else:
+        tar = tarfile.open(archive_path, mode="r:gz")
+
+    contents = {}
+    with tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                contents[member.name] = tar.extractfile(member).read()
+            else:
+                contents[member.name] = member.type
+    return contents
+
+def _available_formats():
+    formats = ['gzip', 'python']
+    for archive_format in ('pigz', 'zstd'):
+        if shutil.which(archive_format) is not None:
+            formats.append(archive_format)
+    return formats
+
+@pytest.mark.archiver
+def test_archive_spec_defaults():
+    """
+    Test case to ensure that the archive setup falls back to the [archives] section.
+
+    .. code-block:: none
+
+       pytest tests/test_archiver.py
+    """
+    spec = archive_spec_from_config(_config(), 'results')
+    assert spec == ArchiveSpec(format='gzip', level=6, threads=0)
+
+    config = _config(**{
+        'archives': {'format': 'pigz', 'threads': '2'},
+        'archives.stats': {'level': '9'},
+    })
+    assert archive_spec_from_config(config, 'stats') == ArchiveSpec(format='pigz', level=9, threads=2)
+    assert archive_spec_from_config(config, 'other') == ArchiveSpec(format='pigz', level=6, threads=2)
+
+    with pytest.raises(Exception):
+        archive_spec_from_config(_config(archives={'format': 'rar'}), 'results')
+
+@pytest.mark.archiver
+def test_zstd_only_for_private_archives(monkeypatch):
+    """
+    Test case to ensure that the archives consumed by OpenVRE are never
+    written with zstd, and that zstd ones get their own extension.
+    """
+    monkeypatch.setattr(archiver.shutil, 'which', lambda cmd: '/usr/bin/' + cmd)
+    config = _config(archives={'format': 'zstd'})
+
+    for kind in ('workflow', 'results', 'stats', 'other'):
+        spec = archive_spec_from_config(config, kind)
+        assert spec.format == 'pigz'
+        assert archive_extension(spec) == '.tar.gz'
+
+    workdir_spec = archive_spec_from_config(config, 'workdir')
+    assert workdir_spec.format == 'zstd'
+    assert archive_extension(workdir_spec) == '.tar.zst'
+
+    # Without zstd, the in-process gzip writer is used
+    monkeypatch.setattr(archiver.shutil, 'which', lambda cmd: None)
+    workdir_spec = archive_spec_from_config(config, 'workdir')
+    assert workdir_spec.format == 'python'
+    assert archive_extension(workdir_spec) == '.tar.gz'
+
+@pytest.mark.archiver
+@pytest.mark.parametrize("archive_format", _available_formats())
+def test_pack_dir_round_trip(tmp_path, archive_format):
+    """
+    Test case to ensure that pack_dir archives the whole tree under basePackdir.
+    """
+    src_dir = tmp_path / "src"
+    expected = _make_tree(src_dir)
+    archive_path = str(tmp_path / ("packed" + archive_extension(ArchiveSpec(archive_format, 1, 2))))
+
+    pack_dir(str(src_dir), archive_path, "base", ArchiveSpec(format=archive_format, level=1, threads=2))
+
+    contents = _read_archive(archive_path, archive_format)
+    for rel_path, file_bytes in expected.items():
+        assert contents["base/" + rel_path] == file_bytes
+    assert contents["base/link"] == tarfile.SYMTYPE
+    assert contents["base/sub"] == tarfile.DIRTYPE
+
+@pytest.mark.archiver
+@pytest.mark.parametrize("archive_format", _available_formats())
+def test_harvest_dir_round_trip(tmp_path, archive_format):
+    """
+    Test case to ensure that harvest_dir archives the whole tree, visiting
+    each non-directory entry once.
+    """
+    src_dir = tmp_path / "src"
+    expected = _make_tree(src_dir)
+    archive_path = str(tmp_path / ("harvested" + archive_extension(ArchiveSpec(archive_format, 1, 2))))
+    visited = []
+
+    omitted = harvest_dir(str(src_dir), archive_path, "base", ArchiveSpec(format=archive_format, level=1, threads=2), visitor=lambda rel_path, abs_path: visited.append(rel_path))
+
+    assert omitted == []
+    assert sorted(visited) == sorted(list(expected.keys()) + ["link"])
+    contents = _read_archive(archive_path, archive_format)
+    for rel_path, file_bytes in expected.items():
+        assert contents["base/" + rel_path] == file_bytes
+    assert contents["base/link"] == tarfile.SYMTYPE
+    assert archiver.OMITTED_MANIFEST not in [name.rpartition('/')[2] for name in contents]
+
+@pytest.mark.archiver
+def test_harvest_dir_skip_and_extra_files(tmp_path):
+    """
+    Test case to ensure that skipped entries are left out, and generated
+    files are added.
+    """
+    src_dir = tmp_path / "src"
+    _make_tree(src_dir)
+    (src_dir / ".git").write_text("gitdir: /elsewhere")
+    (src_dir / "sub" / ".git").mkdir()
+    (src_dir / "sub" / ".git" / "HEAD").write_text("ref")
+    archive_path = str(tmp_path / "harvested.tar.gz")
+
+    harvest_dir(str(src_dir), archive_path, "base", ArchiveSpec(format='python', level=1, threads=1), skip_names=('.git',), extra_files={'id.json': b'{}'})
+
+    contents = _read_archive(archive_path, 'python')
+    assert not any('.git' in name for name in contents)
+    assert contents["base/id.json"] == b'{}'
+    assert contents["base/a.txt"] == b"alpha"
+
+@pytest.mark.archiver
+def test_archive_selection_defaults():
+    """
+    Test case to ensure that only the workdir archive has a selection by
+    default, and that the globs and sizes are parsed.
+    """
+    assert archive_selection_from_config(_config(), 'results') is None
+    assert archive_selection_from_config(_config(), 'workdir', keep=WORKDIR_KEEP_GLOBS) == ArchiveSelection(keep=WORKDIR_KEEP_GLOBS, include=(), exclude=(), max_file_size=1024 * 1024)
+    assert archive_selection_from_config(_config(**{'archives.workdir': {'max_file_size': '0'}}), 'workdir') is None
+
+    config = _config(**{'archives.workdir': {'include': '*.log *.txt', 'exclude': '*.bam', 'max_file_size': '2K'}})
+    selection = archive_selection_from_config(config, 'workdir', parse_size=lambda size: 2048)
+    assert selection.include == ('*.log', '*.txt')
+    assert selection.exclude == ('*.bam',)
+    assert selection.max_file_size == 2048
+
+@pytest.mark.archiver
+def test_keep_globs_are_anchored():
+    """
+    Test case to ensure that the kept Nextflow files are only the ones in
+    their known places, and not task outputs with similar names.
+    """
+    selection = ArchiveSelection(keep=WORKDIR_KEEP_GLOBS, include=(), exclude=('*.bam',), max_file_size=10)
+    huge = 1000
+
+    for kept_path in ('.nextflow.log', '.nextflow.log.1', 'params-file.json', 'vre-wf-setup.config', 'trace.txt', 'work/3c/9a1f0e/.command.err', 'work/3c/9a1f0e/.exitcode'):
+        assert omission_reason(selection, kept_path, huge) is None
+
+    assert omission_reason(selection, 'work/3c/9a1f0e/params.json', huge) == 'too large'
+    assert omission_reason(selection, 'work/3c/9a1f0e/trace_of_reads.txt', huge) == 'too large'
+    assert omission_reason(selection, 'work/3c/9a1f0e/out/run.config', huge) == 'too large'
+    assert omission_reason(selection, 'work/3c/9a1f0e/sub/.exitcode', huge) == 'too large'
+    # The user globs are still matched against the file name
+    assert omission_reason(selection, 'work/3c/9a1f0e/reads.bam', 1) == 'excluded'
+    assert omission_reason(selection, 'work/3c/9a1f0e/small.txt', 1) is None
+
+@pytest.mark.archiver
+def test_harvest_dir_selection(tmp_path):
+    """
+    Test case to ensure that the files left out are listed in the
+    archived manifest.
+    """
+    src_dir = tmp_path / "src"
+    task_dir = src_dir / "work" / "3c" / "9a1f0e"
+    task_dir.mkdir(parents=True)
+    (src_dir / ".nextflow.log").write_bytes(b"l" * 100)
+    (task_dir / ".command.log").write_bytes(b"c" * 100)
+    (task_dir / "params.json").write_bytes(b"p" * 100)
+    (task_dir / "small.txt").write_bytes(b"s")
+    archive_path = str(tmp_path / "workdir.tar.gz")
+    selection = ArchiveSelection(keep=WORKDIR_KEEP_GLOBS, include=(), exclude=(), max_file_size=10)
+
+    omitted = harvest_dir(str(src_dir), archive_path, "base", ArchiveSpec(format='python', level=1, threads=1), selection=selection)
+
+    assert omitted == [{'path': 'work/3c/9a1f0e/params.json', 'size': 100, 'reason': 'too large'}]
+    contents = _read_archive(archive_path, 'python')
+    assert "base/.nextflow.log" in contents
+    assert "base/work/3c/9a1f0e/.command.log" in contents
+    assert "base/work/3c/9a1f0e/small.txt" in contents
+    assert "base/work/3c/9a1f0e/params.json" not in contents
+    assert json.loads(contents["base/" + archiver.OMITTED_MANIFEST])['omitted'] == omitted
+
+@pytest.mark.archiver
+def test_parallel_gzip_writer_members(tmp_path):
+    """
+    Test case to ensure that the blocks compressed in parallel are written
+    in order, as a valid multi-member gzip file.
+    """
+    payload = bytes(range(256)) * 1000
+    archive_path = str(tmp_path / "blocks.gz")
+    with ParallelGzipWriter(archive_path, level=1, threads=4, block_size=4096) as gzH:
+        for offset in range(0, len(payload), 1000):
+            gzH.write(payload[offset:offset + 1000])
+
+    with gzip.open(archive_path, mode="rb") as gzH:
+        assert gzH.read() == payload
@@ -0,0 +1,143 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+from tool.broker import ResourceBroker
+
+@pytest.fixture
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(ResourceBroker, "POLL_INTERVAL", 0.05)
+
+@pytest.mark.broker
+def test_reserve_release(tmp_path, fast_poll):
+    """
+    Test case to ensure that the grants never exceed the host resources,
+    and that released resources can be granted again.
+
+    .. code-block:: none
+
+       pytest tests/test_broker.py
+    """
+    state_dir = str(tmp_path)
+    broker = ResourceBroker(state_dir, 4, total_memory=1000, min_cpus=2, min_memory=100)
+
+    first = broker.reserve(3, memory=800)
+    assert (first.cpus, first.memory) == (3, 800)
+    # The CPU left is under the minimum share
+    with pytest.raises(Exception):
+        broker.reserve(1, timeout=0.2)
+    first.release()
+    assert not os.path.exists(first.reservation_path)
+
+    second = broker.reserve(8)
+    assert (second.cpus, second.memory) == (4, 1000)
+    second.release()
+
+@pytest.mark.broker
+def test_reserve_contention(tmp_path, fast_poll):
+    """
+    Test case to ensure that concurrent jobs, each one with its own
+    broker, never hold more than the host resources.
+    """
+    state_dir = str(tmp_path)
+    total_cpus = 4
+    in_use = [0]
+    peak = [0]
+    granted = []
+    errors = []
+    counter_lock = threading.Lock()
+
+    def job():
+        try:
+            broker = ResourceBroker(state_dir, total_cpus, min_cpus=2)
+            reservation = broker.reserve(2, timeout=30)
+            with counter_lock:
+                in_use[0] += reservation.cpus
+                peak[0] = max(peak[0], in_use[0])
+                granted.append(reservation.cpus)
+            time.sleep(0.1)
+            with counter_lock:
+                in_use[0] -= reservation.cpus
+            reservation.release()
+        except Exception as error:
+            errors.append(error)
+
+    jobs = [threading.Thread(target=job) for _ in range(8)]
+    for job_thread in jobs:
+        job_thread.start()
+    for job_thread in jobs:
+        job_thread.join()
+
+    assert errors == []
+    assert granted == [2] * 8
+    assert peak[0] <= total_cpus
+    assert [entry_name for entry_name in os.listdir(state_dir) if entry_name.startswith("res-")] == []
+
+OWNER_SCRIPT = """
+import sys, time
+from tool.broker import ResourceBroker
+reservation = ResourceBroker(sys.argv[1], 4).reserve(3)
+print(reservation.reservation_path, flush=True)
+time.sleep(60)
+"""
+
+@pytest.mark.broker
+def test_stale_reservation_removed(tmp_path, fast_poll):
+    """
+    Test case to ensure that the reservations whose owner died are
+    removed, and their resources granted again.
+    """
+    state_dir = str(tmp_path)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p  for p in sys.path  if p)
+    owner = subprocess.Popen(
+        [sys.executable, "-c", OWNER_SCRIPT, state_dir],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    try:
+        reservation_path = owner.stdout.readline().strip()
+        assert os.path.exists(reservation_path)
+
+        broker = ResourceBroker(state_dir, 4)
+        alive = broker.reserve(4)
+        assert alive.cpus == 1
+        alive.release()
+        assert os.path.exists(reservation_path)
+    finally:
+        owner.send_signal(signal.SIGKILL)
+        owner.wait()
+        owner.stdout.close()
+
+    # The file outlives its owner
+    assert os.path.exists(reservation_path)
+    reservation = broker.reserve(4)
+    assert reservation.cpus == 4
+    assert not os.path.exists(reservation_path)
+    reservation.release()
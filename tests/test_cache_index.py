@@ -0,0 +1,173 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import threading
+import pytest
+
+from tool.cache_index import CacheIndex, format_size, parse_size, tree_size
+
+def _index_with_entries(tmp_path, sizes):
+    """
+    Index whose entries were used in the order of sizes
+    """
+    index = CacheIndex(str(tmp_path / "index.json"))
+    for last_used, (entry_id, size) in enumerate(sizes):
+        index.update({
+            entry_id: {'created': last_used, 'last_used': last_used, 'hits': 0, 'size': size},
+        })
+    return index
+
+@pytest.mark.cache_index
+def test_parse_size():
+    """
+    Test case to ensure that sizes with and without units are understood.
+
+    .. code-block:: none
+
+       pytest tests/test_cache_index.py
+    """
+    assert parse_size("1024") == 1024
+    assert parse_size("500M") == 500 * 1024 ** 2
+    assert parse_size("1.5G") == int(1.5 * 1024 ** 3)
+    assert parse_size("2KiB") == 2048
+    assert parse_size(None) is None
+    assert parse_size("0") is None
+    with pytest.raises(Exception):
+        parse_size("lots")
+
+@pytest.mark.cache_index
+def test_format_size():
+    """
+    Test case to ensure that sizes are rendered with the largest unit.
+    """
+    assert format_size(512) == "512"
+    assert format_size(1536) == "1.5K"
+    assert format_size(3 * 1024 ** 3) == "3.0G"
+
+@pytest.mark.cache_index
+def test_tree_size(tmp_path):
+    """
+    Test case to ensure that tree_size adds up the files without following symlinks.
+    """
+    (tmp_path / "tree" / "sub").mkdir(parents=True)
+    (tmp_path / "tree" / "a").write_bytes(b"x" * 100)
+    (tmp_path / "tree" / "sub" / "b").write_bytes(b"x" * 50)
+    (tmp_path / "big").write_bytes(b"x" * 10000)
+    (tmp_path / "tree" / "link").symlink_to(tmp_path / "big")
+
+    size = tree_size(str(tmp_path / "tree"))
+    assert size >= 150
+    assert size < 10000
+    assert tree_size(str(tmp_path / "tree" / "a")) == 100
+    assert tree_size(str(tmp_path / "missing")) == 0
+
+@pytest.mark.cache_index
+def test_touch(tmp_path):
+    """
+    Test case to ensure that touch registers the usage of the entries.
+    """
+    index = CacheIndex(str(tmp_path / "index.json"))
+    index.touch("a", size=10, hit=False, uri="u")
+    entry = index.touch("a")
+
+    assert entry['hits'] == 1
+    assert entry['size'] == 10
+    assert entry['uri'] == "u"
+    assert set(CacheIndex(str(tmp_path / "index.json")).entries().keys()) == {"a"}
+
+@pytest.mark.cache_index
+def test_evict_least_recently_used(tmp_path):
+    """
+    Test case to ensure that the least recently used entries are evicted first,
+    only until the cache fits.
+    """
+    index = _index_with_entries(tmp_path, [("old", 40), ("mid", 40), ("new", 40)])
+    index.touch("old", hit=False)
+
+    evicted = index.evict(80, lambda entry_id, entry: True)
+
+    assert evicted == ["mid"]
+    assert set(index.entries().keys()) == {"old", "new"}
+    assert index.evict(None, lambda entry_id, entry: True) == []
+
+@pytest.mark.cache_index
+def test_evict_skips_busy_entries(tmp_path):
+    """
+    Test case to ensure that entries which cannot be evicted are kept,
+    as well as the ones whose eviction failed.
+    """
+    index = _index_with_entries(tmp_path, [("busy", 40), ("broken", 40), ("idle", 40), ("new", 40)])
+
+    def evict_func(entry_id, entry):
+        if entry_id == "broken":
+            raise OSError("unremovable")
+        return entry_id != "busy"
+
+    evicted = index.evict(100, evict_func)
+
+    assert evicted == ["idle", "new"]
+    assert set(index.entries().keys()) == {"busy", "broken"}
+
+@pytest.mark.cache_index
+def test_evict_dependent_entries(tmp_path):
+    """
+    Test case to ensure that entries which become evictable after other
+    evictions (like a mirror after its worktrees) are evicted in a later pass.
+    """
+    index = _index_with_entries(tmp_path, [("mirror", 100), ("worktree", 10)])
+    removed = set()
+
+    def evict_func(entry_id, entry):
+        if entry_id == "mirror" and "worktree" not in removed:
+            return False
+        removed.add(entry_id)
+        return True
+
+    evicted = index.evict(0, evict_func)
+
+    assert evicted == ["worktree", "mirror"]
+    assert index.entries() == {}
+
+@pytest.mark.cache_index
+def test_touch_from_threads(tmp_path):
+    """
+    Test case to ensure that the threads sharing an index do not lose
+    their updates.
+    """
+    index = CacheIndex(str(tmp_path / "index.json"))
+    errors = []
+
+    def toucher(entry_id):
+        try:
+            for _ in range(25):
+                index.touch(entry_id)
+                index.touch("shared")
+        except Exception as error:
+            errors.append(error)
+
+    touchers = [threading.Thread(target=toucher, args=("entry{}".format(i),)) for i in range(8)]
+    for toucher_thread in touchers:
+        toucher_thread.start()
+    for toucher_thread in touchers:
+        toucher_thread.join()
+
+    assert errors == []
+    entries = index.entries()
+    assert entries["shared"]["hits"] == 8 * 25
+    assert all(entries["entry{}".format(i)]["hits"] == 25 for i in range(8))
@@ -0,0 +1,88 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import pytest
+
+from tool.commands import TIMEOUT_RETVAL, run_command, run_commands, run_sequence
+
+def _is_alive(pid):
+    try:
+        with open("/proc/{}/stat".format(pid), mode="r") as sH:
+            # Zombies are already dead
+            return sH.read().rpartition(')')[2].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+@pytest.mark.commands
+def test_output_cap():
+    """
+    Test case to ensure that only the beginning of the outputs is kept,
+    while the whole output is read.
+
+    .. code-block:: none
+
+       pytest tests/test_commands.py
+    """
+    writer = "import sys; sys.stdout.write('o' * 3000000); sys.stderr.write('e' * 10)"
+    result = run_command([sys.executable, "-c", writer], max_output=1000)
+
+    assert result.retval == 0
+    assert not result.timed_out
+    assert result.stdout == 'o' * 1000 + "\n[... 2999000 more bytes]\n"
+    assert result.stderr == 'e' * 10
+
+@pytest.mark.commands
+def test_timeout_kills_process_group(tmp_path):
+    """
+    Test case to ensure that the commands which take too long are killed,
+    together with the processes they started.
+    """
+    pid_file = str(tmp_path / "child.pid")
+    started = time.time()
+    result = run_command(["sh", "-c", "sleep 60 & echo $! > '{}'; wait".format(pid_file)], timeout=1)
+
+    assert time.time() - started < 30
+    assert result.timed_out
+    assert result.retval == TIMEOUT_RETVAL
+    with open(pid_file, mode="r") as pH:
+        child_pid = int(pH.read())
+    for _ in range(50):
+        if not _is_alive(child_pid):
+            break
+        time.sleep(0.1)
+    assert not _is_alive(child_pid)
+
+@pytest.mark.commands
+def test_concurrent_and_sequence(tmp_path):
+    """
+    Test case to ensure that independent commands run at once, and that
+    sequences stop on the first failure.
+    """
+    started = time.time()
+    results = run_commands([(["sleep", "1"], None)] * 4 + [(["pwd"], str(tmp_path))])
+    assert time.time() - started < 3
+    assert [result.retval for result in results] == [0] * 5
+    assert os.path.samefile(results[-1].stdout.strip(), str(tmp_path))
+
+    results = run_sequence([(["true"], None), (["false"], None), (["true"], None)])
+    assert [result.retval for result in results] == [0, 1]
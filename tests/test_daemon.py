@@ -0,0 +1,163 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import concurrent.futures
+import os
+import signal
+import socket
+import stat
+import time
+import pytest
+
+from tool.daemon import FRAME_HEADER, CPUBudget, JobForker, RunnerDaemon, job_description, recv_message, send_message, submit_job
+
+def _job_func(config, in_metadata, out_metadata):
+    if os.path.basename(config) == "fail.json":
+        raise Exception("broken job")
+    with open(out_metadata, mode="w", encoding="utf-8") as oH:
+        oH.write(str(os.getpid()))
+
+@pytest.fixture
+def daemon_socket(tmp_path):
+    """
+    A runner daemon, in its own process
+    """
+    socket_path = str(tmp_path / "daemon.sock")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            RunnerDaemon(socket_path, 2, 1, _job_func).serve_forever()
+        finally:
+            os._exit(0)
+
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+
+    yield socket_path
+
+    os.kill(pid, signal.SIGTERM)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert not os.path.exists(socket_path)
+
+@pytest.mark.daemon
+def test_framed_messages():
+    """
+    Test case to ensure that messages delivered in several chunks are
+    reassembled, with their descriptors.
+
+    .. code-block:: none
+
+       pytest tests/test_daemon.py
+    """
+    payload = b"x" * 100000
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        read_fd, write_fd = os.pipe()
+        frame = FRAME_HEADER.pack(len(payload)) + payload
+        socket.send_fds(sender, [frame[:2]], [write_fd])
+        os.close(write_fd)
+        pid = os.fork()
+        if pid == 0:
+            sender.sendall(frame[2:])
+            os._exit(0)
+
+        msg, fds = recv_message(receiver, len(payload), 1)
+        os.waitpid(pid, 0)
+
+        assert msg == payload
+        assert len(fds) == 1
+        os.write(fds[0], b"ok")
+        os.close(fds[0])
+        assert os.read(read_fd, 2) == b"ok"
+        os.close(read_fd)
+
+        send_message(sender, payload)
+        with pytest.raises(Exception):
+            recv_message(receiver, len(payload) - 1)
+
+        sender.shutdown(socket.SHUT_WR)
+        receiver.recv(len(payload))
+        with pytest.raises(EOFError):
+            recv_message(receiver, len(payload))
+
+@pytest.mark.daemon
+def test_cpu_budget():
+    """
+    Test case to ensure that the CPU budget never lends more than it has.
+    """
+    budget = CPUBudget(4)
+    assert budget.acquire(8) == 4
+    assert budget.available == 0
+    budget.release(4)
+    assert budget.acquire(1) == 1
+    assert budget.available == 3
+
+@pytest.mark.daemon
+def test_daemon_runs_jobs(tmp_path, daemon_socket):
+    """
+    Test case to ensure that the jobs are run in forked processes, which
+    report their exit value, and that only the owner can connect.
+    """
+    assert stat.S_IMODE(os.stat(daemon_socket).st_mode) & 0o077 == 0
+
+    out_metadata = str(tmp_path / "out.json")
+    assert submit_job(daemon_socket, str(tmp_path / "ok.json"), str(tmp_path / "in.json"), out_metadata) == 0
+    with open(out_metadata, mode="r", encoding="utf-8") as oH:
+        assert int(oH.read()) != os.getpid()
+
+    assert submit_job(daemon_socket, str(tmp_path / "fail.json"), str(tmp_path / "in.json"), str(tmp_path / "out2.json")) == 1
+
+@pytest.mark.daemon
+@pytest.mark.parametrize("socket_name", ["missing.sock", "not-a-socket", "x" * 200])
+def test_submit_unavailable_daemon(tmp_path, socket_name):
+    """
+    Test case to ensure that every connection failure is reported as an
+    OSError, so the job can be run without the daemon.
+    """
+    (tmp_path / "not-a-socket").write_text("")
+    with pytest.raises(OSError):
+        submit_job(str(tmp_path / socket_name), str(tmp_path / "ok.json"), str(tmp_path / "in.json"), str(tmp_path / "out.json"))
+
+@pytest.mark.daemon
+def test_job_forker_from_threads(tmp_path):
+    """
+    Test case to ensure that the jobs handed to the forker from several
+    threads are forked from it, and report their exit values.
+    """
+    def run_job(job_name):
+        job = job_description(str(tmp_path / job_name), str(tmp_path / "in.json"), str(tmp_path / (job_name + ".out")))
+        started = []
+        retval = forker.run(job, [1, 2], started=started.append)
+        return job_name, retval, started
+
+    with JobForker(_job_func) as forker:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+            results = list(pool.map(run_job, ["a.json", "b.json", "fail.json"]))
+
+    for job_name, retval, started in results:
+        assert len(started) == 1
+        if job_name == "fail.json":
+            assert retval == 1
+        else:
+            assert retval == 0
+            with open(str(tmp_path / (job_name + ".out")), mode="r", encoding="utf-8") as oH:
+                assert int(oH.read()) == started[0]
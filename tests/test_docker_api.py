@@ -0,0 +1,91 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import http.server
+import json
+import socket
+import socketserver
+import threading
+import time
+import pytest
+
+from tool.docker_api import DockerEngineClient
+
+# Longer than the client timeout
+SLOW_DELAY = 0.5
+
+class SlowEngineHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(SLOW_DELAY)
+        payload = json.dumps({'Id': 'sha256:0123'}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.send_response(200)
+        self.end_headers()
+        for status in ('Pulling', 'Downloading', 'Done'):
+            self.wfile.write(json.dumps({'status': status}).encode('utf-8') + b'\r\n')
+            self.wfile.flush()
+            time.sleep(SLOW_DELAY)
+
+class UnixEngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+@pytest.fixture
+def engine_socket(tmp_path):
+    socket_path = str(tmp_path / "docker.sock")
+    server = UnixEngineServer(socket_path, SlowEngineHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    try:
+        yield socket_path
+    finally:
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+
+@pytest.mark.docker_api
+def test_pull_has_no_timeout(engine_socket):
+    """
+    Test case to ensure that image pulls are not bound by the client
+    timeout, while the other requests are.
+
+    .. code-block:: none
+
+       pytest tests/test_docker_api.py
+    """
+    client = DockerEngineClient(engine_socket, timeout=SLOW_DELAY / 4)
+    client.pullImage('example.org:5000/image:1.0')
+
+    with pytest.raises(socket.timeout):
+        client.inspectImage('image:1.0')
+
+    assert DockerEngineClient(engine_socket, timeout=SLOW_DELAY * 4).inspectImage('image:1.0') == 'sha256:0123'
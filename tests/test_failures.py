@@ -0,0 +1,190 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from tool.failures import FAILURE_DETERMINISTIC, FAILURE_TRANSIENT, FAILURE_UNKNOWN, classify_failure, read_log_tail
+
+# Excerpts from the .nextflow.log of real failed executions
+
+PROCESS_ERROR_LOG = """\
+Jun-03 10:12:41.512 [Task monitor] ERROR nextflow.processor.TaskProcessor - Error executing process > 'validation (1)'
+
+Caused by:
+  Process `validation (1)` terminated with an error exit status (1)
+
+Command executed:
+
+  python /app/validation.py -i participant.txt -com /assess/public_ref -o validated.json
+
+Command exit status:
+  1
+
+Command output:
+  (empty)
+
+Command error:
+  Traceback (most recent call last):
+    File "/app/validation.py", line 41, in <module>
+      with open(args.public_ref_dir + "/ref.txt") as f:
+  FileNotFoundError: [Errno 2] No such file or directory: '/assess/public_ref/ref.txt'
+
+Work dir:
+  /scratch/vre-job/nf-workdir/work/3c/9a1f0e2d4b
+
+Tip: view the complete command output by changing to the process work dir and entering the command `cat .command.out`
+Jun-03 10:12:41.530 [main] DEBUG nextflow.Session - Session aborted -- Cause: Process `validation (1)` terminated with an error exit status (1)
+"""
+
+MISSING_OUTPUT_LOG = """\
+Jun-03 11:02:07.118 [Task monitor] ERROR nextflow.processor.TaskProcessor - Error executing process > 'compute_metrics (1)'
+
+Caused by:
+  Missing output file(s) `metrics.json` expected by process `compute_metrics (1)`
+
+Command executed:
+
+  python /app/compute_metrics.py -i validated.json -o metrics_out.json
+
+Command exit status:
+  0
+
+Work dir:
+  /scratch/vre-job/nf-workdir/work/a1/77cc02e9f1
+"""
+
+WRAPPER_NOT_VISIBLE_LOG = """\
+Jun-03 12:40:55.003 [Task monitor] ERROR nextflow.processor.TaskProcessor - Error executing process > 'validation (1)'
+
+Caused by:
+  Process `validation (1)` terminated with an error exit status (127)
+
+Command executed:
+
+  python /app/validation.py -i participant.txt -o validated.json
+
+Command exit status:
+  127
+
+Command output:
+  (empty)
+
+Command error:
+  /bin/bash: .command.run: No such file or directory
+
+Work dir:
+  /nfs/vre/nf-workdir/work/5e/0b12f4aa30
+"""
+
+UNKNOWN_TERMINATION_LOG = """\
+Jun-03 13:15:20.771 [Task monitor] ERROR nextflow.processor.TaskProcessor - Error executing process > 'aggregation (1)'
+
+Caused by:
+  Process `aggregation (1)` terminated for an unknown reason -- Likely it has been terminated by the external system
+"""
+
+STAGING_LOG = """\
+Jun-03 14:01:09.230 [Actor Thread 4] ERROR nextflow.processor.TaskProcessor - Error executing process > 'validation (1)'
+
+Caused by:
+  java.nio.file.NoSuchFileException: /nfs/vre/project/in/participant.txt
+
+	at sun.nio.fs.UnixException.translateToIOException(UnixException.java:92)
+	at nextflow.processor.TaskProcessor.makeTaskContextStage3(TaskProcessor.groovy:1912)
+"""
+
+COMPILATION_LOG = """\
+Jun-03 09:00:02.311 [main] ERROR nextflow.cli.Launcher - @unknown
+Script compilation error
+- file : /scratch/vre-job/workflow/workflow-v1.0/main.nf
+- cause: Unexpected input: '{' @ line 42, column 24.
+"""
+
+STALE_HANDLE_LOG = """\
+Jun-03 15:44:12.908 [main] ERROR nextflow.cli.Launcher - Cannot read file: /nfs/vre/nf-workdir/.nextflow/history -- Stale file handle
+"""
+
+def _log(tmp_path, contents):
+    log_path = tmp_path / ".nextflow.log"
+    log_path.write_text(contents)
+    return str(log_path)
+
+@pytest.mark.failures
+@pytest.mark.parametrize("log_contents, expected_reason", [
+    (PROCESS_ERROR_LOG, 'process error'),
+    (COMPILATION_LOG, 'workflow script error'),
+], ids=['process_error', 'compilation'])
+def test_workflow_bugs_are_deterministic(tmp_path, log_contents, expected_reason):
+    """
+    Test case to ensure that failures from the workflow itself are not
+    retried, even when the tasks mention missing files.
+
+    .. code-block:: none
+
+       pytest tests/test_failures.py
+    """
+    assert classify_failure(1, _log(tmp_path, log_contents)) == (FAILURE_DETERMINISTIC, expected_reason)
+
+@pytest.mark.failures
+@pytest.mark.parametrize("log_contents", [
+    WRAPPER_NOT_VISIBLE_LOG,
+    UNKNOWN_TERMINATION_LOG,
+    MISSING_OUTPUT_LOG,
+    STAGING_LOG,
+    STALE_HANDLE_LOG,
+], ids=['wrapper_not_visible', 'unknown_termination', 'missing_output', 'staging', 'stale_handle'])
+def test_infrastructure_failures_are_transient(tmp_path, log_contents):
+    """
+    Test case to ensure that files not visible through the bind mounts
+    (or not visible yet, like task outputs on NFS) and filesystem errors
+    are retried.
+    """
+    failure_class, _ = classify_failure(1, _log(tmp_path, log_contents))
+    assert failure_class == FAILURE_TRANSIENT
+
+@pytest.mark.failures
+def test_exit_codes(tmp_path):
+    """
+    Test case to ensure that docker and shell exit codes take precedence
+    over the log.
+    """
+    log_path = _log(tmp_path, PROCESS_ERROR_LOG)
+    assert classify_failure(125, log_path)[0] == FAILURE_TRANSIENT
+    assert classify_failure(127, log_path)[0] == FAILURE_DETERMINISTIC
+    assert classify_failure(130)[0] == FAILURE_DETERMINISTIC
+
+@pytest.mark.failures
+def test_unknown_failures(tmp_path):
+    """
+    Test case to ensure that failures without a known cause are reported
+    with their exit code.
+    """
+    assert classify_failure(1, _log(tmp_path, "Jun-03 10:00:00.000 [main] DEBUG nextflow.cli.Launcher - done\n")) == (FAILURE_UNKNOWN, 'exit code 1')
+    assert classify_failure(2, str(tmp_path / "missing.log")) == (FAILURE_UNKNOWN, 'exit code 2')
+    assert classify_failure(3) == (FAILURE_UNKNOWN, 'exit code 3')
+
+@pytest.mark.failures
+def test_only_the_log_tail_is_read(tmp_path):
+    """
+    Test case to ensure that only the end of long logs is considered.
+    """
+    log_path = _log(tmp_path, PROCESS_ERROR_LOG + "x" * 200 + "\n")
+
+    assert read_log_tail(log_path, tail_size=100) == "x" * 99 + "\n"
+    assert classify_failure(1, log_path)[0] == FAILURE_DETERMINISTIC
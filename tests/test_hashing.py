@@ -0,0 +1,123 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import hashlib
+import os
+import pytest
+
+from tool.hashing import DigestCache, Hasher, file_digest, path_digest
+
+def _write(path, contents):
+    with open(path, mode="wb") as wH:
+        wH.write(contents)
+
+@pytest.mark.hashing
+def test_file_digest(tmp_path):
+    """
+    Test case to ensure that file digests are the SHA-256 of the contents.
+
+    .. code-block:: none
+
+       pytest tests/test_hashing.py
+    """
+    contents = os.urandom(100000) * 50
+    file_path = str(tmp_path / "input.bin")
+    _write(file_path, contents)
+
+    assert file_digest(file_path) == hashlib.sha256(contents).hexdigest()
+    assert path_digest(file_path) == file_digest(file_path)
+
+@pytest.mark.hashing
+def test_tree_digest(tmp_path):
+    """
+    Test case to ensure that tree digests depend on the relative paths
+    and contents, but not on where the tree is.
+    """
+    trees = []
+    for tree_name in ("a", "b"):
+        tree_dir = tmp_path / tree_name
+        os.makedirs(str(tree_dir / "sub"))
+        _write(str(tree_dir / "one.txt"), b"one")
+        _write(str(tree_dir / "sub" / "two.txt"), b"two")
+        trees.append(str(tree_dir))
+
+    assert path_digest(trees[0]) == path_digest(trees[1])
+    digests, _ = Hasher(workers=2).digests(trees)
+    assert digests[trees[0]] == path_digest(trees[0])
+
+    os.rename(str(tmp_path / "b" / "sub" / "two.txt"), str(tmp_path / "b" / "sub" / "three.txt"))
+    assert path_digest(trees[0]) != path_digest(trees[1])
+
+@pytest.mark.hashing
+def test_digest_cache_invalidation(tmp_path):
+    """
+    Test case to ensure that cached digests are only reused while the
+    file keeps its size, modification time and inode.
+    """
+    file_path = str(tmp_path / "input.txt")
+    _write(file_path, b"first")
+    cache = DigestCache(str(tmp_path / "digests.sqlite"))
+    hasher = Hasher(cache=cache)
+    try:
+        digests, bytes_read = hasher.digests([file_path])
+        assert bytes_read == 5
+        assert digests[file_path] == hashlib.sha256(b"first").hexdigest()
+
+        digests, bytes_read = hasher.digests([file_path])
+        assert bytes_read == 0
+        assert digests[file_path] == hashlib.sha256(b"first").hexdigest()
+
+        # Size change
+        _write(file_path, b"second")
+        digests, bytes_read = hasher.digests([file_path])
+        assert bytes_read == 6
+        assert digests[file_path] == hashlib.sha256(b"second").hexdigest()
+
+        # Same size, only the modification time changes
+        st = os.stat(file_path)
+        _write(file_path, b"SECOND")
+        os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        digests, bytes_read = hasher.digests([file_path])
+        assert bytes_read == 6
+        assert digests[file_path] == hashlib.sha256(b"SECOND").hexdigest()
+
+        # Same size and modification time, but a new inode
+        st = os.stat(file_path)
+        new_path = str(tmp_path / "input.new")
+        _write(new_path, b"third!")
+        os.utime(new_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.rename(new_path, file_path)
+        assert os.stat(file_path).st_ino != st.st_ino
+        digests, bytes_read = hasher.digests([file_path])
+        assert bytes_read == 6
+        assert digests[file_path] == hashlib.sha256(b"third!").hexdigest()
+
+        assert cache.treeSize(str(tmp_path)) == 6
+    finally:
+        cache.close()
+
+@pytest.mark.hashing
+def test_digest_cache_unavailable(tmp_path):
+    """
+    Test case to ensure that a digest cache which cannot be opened fails
+    at construction, instead of in the middle of the hashing.
+    """
+    with pytest.raises(Exception):
+        DigestCache(str(tmp_path))
@@ -0,0 +1,124 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+import pytest
+
+from tool.locks import FileLock, atomic_write
+
+@pytest.mark.locks
+def test_exclusive_lock_excludes(tmp_path):
+    """
+    Test case to ensure that an exclusive lock is held by only one owner.
+
+    .. code-block:: none
+
+       pytest tests/test_locks.py
+    """
+    lock_path = str(tmp_path / "entry.lock")
+    holder = FileLock(lock_path)
+    contender = FileLock(lock_path)
+
+    assert holder.acquire() is True
+    assert contender.acquire(blocking=False) is False
+    assert contender.locked is False
+    assert contender.acquire(shared=True, blocking=False) is False
+
+    holder.release()
+    assert holder.locked is False
+    assert contender.acquire(blocking=False) is True
+    contender.release()
+
+@pytest.mark.locks
+def test_shared_locks_coexist(tmp_path):
+    """
+    Test case to ensure that shared locks only exclude the exclusive ones.
+    """
+    lock_path = str(tmp_path / "entry.lock")
+    readers = [FileLock(lock_path), FileLock(lock_path)]
+    writer = FileLock(lock_path)
+
+    for reader in readers:
+        assert reader.acquire(shared=True, blocking=False) is True
+    assert writer.acquire(blocking=False) is False
+
+    for reader in readers:
+        reader.release()
+    assert writer.acquire(blocking=False) is True
+    writer.release()
+
+@pytest.mark.locks
+def test_lock_conversion(tmp_path):
+    """
+    Test case to ensure that a shared lock can be upgraded and downgraded,
+    and that a failed upgrade is reported as a released lock, as flock
+    drops it.
+    """
+    lock_path = str(tmp_path / "entry.lock")
+    owner = FileLock(lock_path)
+    other_reader = FileLock(lock_path)
+    contender = FileLock(lock_path)
+
+    assert owner.acquire(shared=True) is True
+    assert other_reader.acquire(shared=True) is True
+
+    # The other reader prevents the upgrade
+    assert owner.acquire(shared=False, blocking=False) is False
+    assert owner.locked is False
+    other_reader.release()
+    assert contender.acquire(blocking=False) is True
+    contender.release()
+
+    assert owner.acquire(shared=True) is True
+    assert owner.acquire(shared=False, blocking=False) is True
+    assert owner.shared is False
+
+    assert owner.acquire(shared=True) is True
+    assert other_reader.acquire(shared=True, blocking=False) is True
+    other_reader.release()
+    owner.release()
+
+@pytest.mark.locks
+def test_lock_released_on_exit(tmp_path):
+    """
+    Test case to ensure that the lock of a dead process is released.
+    """
+    lock_path = str(tmp_path / "entry.lock")
+    pid = os.fork()
+    if pid == 0:
+        FileLock(lock_path).acquire()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    with FileLock(lock_path) as lock:
+        assert lock.locked is True
+
+@pytest.mark.locks
+def test_atomic_write(tmp_path):
+    """
+    Test case to ensure that atomic_write replaces the contents, without
+    leaving temporary files behind.
+    """
+    dest_path = str(tmp_path / "stamp.json")
+    atomic_write(dest_path, "first")
+    atomic_write(dest_path, "second")
+
+    with open(dest_path, mode="r", encoding="utf-8") as rH:
+        assert rH.read() == "second"
+    assert os.listdir(str(tmp_path)) == ["stamp.json"]
@@ -0,0 +1,95 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+import tarfile
+import pytest
+
+from tool.archiver import ArchiveSpec, pack_dir
+from tool.memo import MemoStore
+from tool.placement import FilePlacer
+
+def _job_outputs(tmp_path, job_name, base_dir):
+    """
+    The metrics and the results archive of a job, under base_dir
+    """
+    job_dir = tmp_path / job_name
+    (job_dir / "results").mkdir(parents=True)
+    (job_dir / "results" / "P1.json").write_text('{"metric": 1}')
+    (job_dir / "P1.json").write_text('{"metric": 1}')
+    tar_view_path = str(job_dir / (base_dir + ".tar.gz"))
+    pack_dir(str(job_dir / "results"), tar_view_path, base_dir, ArchiveSpec(format='python', level=1, threads=1))
+    return {
+        'metrics': str(job_dir / "P1.json"),
+        'tar_view': tar_view_path,
+    }
+
+@pytest.mark.memo
+def test_memoized_outputs_are_not_shared(tmp_path):
+    """
+    Test case to ensure that neither the stored outputs nor the published
+    ones share their inodes with the files of the jobs.
+
+    .. code-block:: none
+
+       pytest tests/test_memo.py
+    """
+    store = MemoStore(str(tmp_path / "memo"), FilePlacer())
+    role_paths = _job_outputs(tmp_path, "first", "P1_20260101T000000")
+    store.store("key", role_paths, bases={'tar_view': "P1_20260101T000000"})
+
+    entry = store.lookup("key")
+    assert entry is not None
+    published_metrics = str(tmp_path / "published.json")
+    try:
+        entry.publish({'metrics': published_metrics}, str(tmp_path))
+    finally:
+        entry.release()
+
+    stored_metrics = os.path.join(entry.path, entry.OUTPUTS_DIRNAME, 'metrics')
+    assert os.stat(stored_metrics).st_nlink == 1
+    assert not os.path.samefile(stored_metrics, role_paths['metrics'])
+    assert not os.path.samefile(stored_metrics, published_metrics)
+
+    # Changes made by a job do not reach the store
+    with open(published_metrics, mode="w", encoding="utf-8") as mH:
+        mH.write("changed")
+    with open(stored_metrics, mode="r", encoding="utf-8") as mH:
+        assert mH.read() == '{"metric": 1}'
+
+@pytest.mark.memo
+def test_published_archives_are_rebased(tmp_path):
+    """
+    Test case to ensure that the archives are published under the base
+    directory of the job they are published to.
+    """
+    store = MemoStore(str(tmp_path / "memo"), FilePlacer())
+    store.store("key", _job_outputs(tmp_path, "first", "P1_20260101T000000"), bases={'tar_view': "P1_20260101T000000"})
+
+    entry = store.lookup("key")
+    tar_view_path = str(tmp_path / "P1_20260202T000000.tar.gz")
+    try:
+        entry.publish({'tar_view': tar_view_path}, str(tmp_path), rebases={'tar_view': ("P1_20260202T000000", ArchiveSpec(format='python', level=1, threads=1))})
+    finally:
+        entry.release()
+
+    with tarfile.open(tar_view_path, mode="r:gz") as tar:
+        names = tar.getnames()
+        assert sorted(names) == ["P1_20260202T000000", "P1_20260202T000000/P1.json"]
+        assert tar.extractfile("P1_20260202T000000/P1.json").read() == b'{"metric": 1}'
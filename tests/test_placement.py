@@ -0,0 +1,128 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import errno
+import os
+import pytest
+
+from tool import placement
+from tool.placement import FilePlacer
+
+def _source(tmp_path, contents=b"report"):
+    src_path = tmp_path / "src.png"
+    src_path.write_bytes(contents)
+    return str(src_path)
+
+def _failing(failed_errno, calls):
+    def place_func(src, dest):
+        calls.append(dest)
+        # Like the real ones, which leave a partial destination
+        open(dest, mode="wb").close()
+        raise OSError(failed_errno, os.strerror(failed_errno))
+    return place_func
+
+@pytest.mark.placement
+def test_place_link(tmp_path):
+    """
+    Test case to ensure that files in the same filesystem are hardlinked,
+    overwriting the destination.
+
+    .. code-block:: none
+
+       pytest tests/test_placement.py
+    """
+    src_path = _source(tmp_path)
+    dest_path = str(tmp_path / "dest.png")
+    with open(dest_path, mode="w") as dH:
+        dH.write("stale")
+
+    assert FilePlacer().place(src_path, dest_path) == 'link'
+    assert os.path.samefile(src_path, dest_path)
+
+@pytest.mark.placement
+@pytest.mark.parametrize("strategy", ['copy_file_range', 'copy'])
+def test_place_copies(tmp_path, strategy):
+    """
+    Test case to ensure that the copying strategies reproduce the contents.
+    """
+    contents = os.urandom(3 * 1024 * 1024 + 17)
+    src_path = _source(tmp_path, contents)
+    dest_path = str(tmp_path / "dest.png")
+
+    try:
+        used_strategy = FilePlacer([strategy]).place(src_path, dest_path)
+    except OSError:
+        pytest.skip("{} is not supported here".format(strategy))
+
+    assert used_strategy in (strategy, 'copy')
+    assert not os.path.samefile(src_path, dest_path)
+    with open(dest_path, mode="rb") as dH:
+        assert dH.read() == contents
+
+@pytest.mark.placement
+def test_unknown_strategy():
+    """
+    Test case to ensure that unknown strategies are rejected.
+    """
+    with pytest.raises(Exception):
+        FilePlacer(['link', 'teleport'])
+
+@pytest.mark.placement
+def test_unsupported_strategy_is_remembered(tmp_path, monkeypatch):
+    """
+    Test case to ensure that a strategy unsupported between two filesystems
+    falls back to the next one, and it is not tried again.
+    """
+    link_calls = []
+    monkeypatch.setitem(placement.PLACEMENT_FUNCS, 'link', _failing(errno.EXDEV, link_calls))
+    placer = FilePlacer(['link', 'copy'])
+    src_path = _source(tmp_path)
+
+    assert placer.place(src_path, str(tmp_path / "first.png")) == 'copy'
+    assert placer.place(src_path, str(tmp_path / "second.png")) == 'copy'
+
+    assert len(link_calls) == 1
+    with open(str(tmp_path / "first.png"), mode="rb") as dH:
+        assert dH.read() == b"report"
+
+@pytest.mark.placement
+def test_file_specific_failure_is_retried(tmp_path, monkeypatch):
+    """
+    Test case to ensure that failures depending on the file (like permissions)
+    do not disable the strategy.
+    """
+    link_calls = []
+    monkeypatch.setitem(placement.PLACEMENT_FUNCS, 'link', _failing(errno.EPERM, link_calls))
+    placer = FilePlacer(['link', 'reflink'])
+    monkeypatch.setitem(placement.PLACEMENT_FUNCS, 'reflink', _failing(errno.EOPNOTSUPP, []))
+    src_path = _source(tmp_path)
+
+    # Even when not requested, the byte copy is the last resort
+    assert placer.place(src_path, str(tmp_path / "first.png")) == 'copy'
+    assert placer.place(src_path, str(tmp_path / "second.png")) == 'copy'
+
+    assert len(link_calls) == 2
+
+@pytest.mark.placement
+def test_copy_failure_is_raised(tmp_path):
+    """
+    Test case to ensure that the failure of the last resort is reported.
+    """
+    with pytest.raises(OSError):
+        FilePlacer(['copy']).place(str(tmp_path / "missing.png"), str(tmp_path / "dest.png"))
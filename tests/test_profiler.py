@@ -0,0 +1,71 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import json
+import subprocess
+import time
+import pytest
+
+from tool.commands import run_command
+from tool.profiler import PhaseProfiler
+
+@pytest.mark.profiler
+def test_phase_timings_and_subprocesses(tmp_path):
+    """
+    Test case to ensure that the phases record their timings, bytes and
+    the subprocesses launched while they were open.
+
+    .. code-block:: none
+
+       pytest tests/test_profiler.py
+    """
+    profiler = PhaseProfiler()
+
+    with profiler.span('fork', bytes=10):
+        subprocess.run(["true"], check=True)
+        # Also through the asyncio command runner
+        assert run_command(["true"]).retval == 0
+    with profiler.span('sleep') as span:
+        time.sleep(0.2)
+        span['bytes'] = 5
+    profiler.wrap('sleep', time.sleep)(0.1)
+    with pytest.raises(ValueError):
+        with profiler.span('fail'):
+            raise ValueError("broken")
+
+    summary = profiler.summary()
+    phases = summary['phases']
+    assert phases['fork']['subprocesses'] == 2
+    assert phases['fork']['bytes'] == 10
+    assert phases['sleep']['count'] == 2
+    assert phases['sleep']['subprocesses'] == 0
+    assert phases['sleep']['bytes'] == 5
+    assert 0.3 <= phases['sleep']['elapsed'] < summary['elapsed']
+    assert summary['subprocesses'] == 2
+
+    spans = summary['spans']
+    assert [span['name'] for span in spans] == ['fork', 'sleep', 'sleep', 'fail']
+    assert spans[-1]['error'] == 'ValueError'
+    assert all(earlier['start'] + earlier['elapsed'] <= later['start'] for earlier, later in zip(spans, spans[1:]))
+
+    profile_path = str(tmp_path / "profile.json")
+    profiler.write(profile_path)
+    with open(profile_path, mode="r", encoding="utf-8") as pH:
+        assert json.load(pH)['phases']['fork']['subprocesses'] == 2
@@ -0,0 +1,148 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+
+import tool.scratch
+from tool.scratch import JobScratch, reap_scratch
+
+def _make_stale(path, age=3600):
+    past = time.time() - age
+    os.utime(path, (past, past))
+
+def _legacy_dir(scratch_root, name="vre-legacy-job"):
+    legacy_path = os.path.join(scratch_root, name)
+    os.makedirs(os.path.join(legacy_path, "work"))
+    _make_stale(legacy_path)
+    return legacy_path
+
+@pytest.mark.scratch
+def test_reap_dead_jobs_only(tmp_path):
+    """
+    Test case to ensure that only the scratch directories of dead jobs
+    are reaped.
+
+    .. code-block:: none
+
+       pytest tests/test_scratch.py
+    """
+    scratch_root = str(tmp_path)
+    alive = JobScratch(scratch_root)
+    dead = JobScratch(scratch_root)
+    fresh = JobScratch(scratch_root)
+    try:
+        # A crashed job leaves its directory, but not its lock
+        tool.scratch._ACTIVE_SCRATCHES.discard(dead)
+        dead.lock.release()
+        fresh.lock.release()
+        _make_stale(alive.path)
+        _make_stale(dead.path)
+
+        assert reap_scratch(scratch_root) == [dead.path]
+        assert not os.path.exists(dead.path)
+        assert os.path.isdir(alive.path)
+        # Within the grace period
+        assert os.path.isdir(fresh.path)
+    finally:
+        alive.cleanup()
+        tool.scratch._ACTIVE_SCRATCHES.discard(fresh)
+
+@pytest.mark.scratch
+def test_reap_legacy_unused(tmp_path):
+    """
+    Test case to ensure that legacy scratch directories are only reaped
+    when they are old enough and no process is using them.
+    """
+    scratch_root = str(tmp_path)
+    legacy_path = _legacy_dir(scratch_root)
+
+    assert reap_scratch(scratch_root) == []
+    assert reap_scratch(scratch_root, legacy_max_age=7200) == []
+
+    # A process working there
+    proc = subprocess.Popen(["sleep", "60"], cwd=os.path.join(legacy_path, "work"))
+    try:
+        assert reap_scratch(scratch_root, legacy_max_age=60) == []
+        assert reap_scratch(scratch_root, legacy_max_age=60, force_legacy=True) == []
+        assert os.path.isdir(legacy_path)
+    finally:
+        proc.kill()
+        proc.wait()
+
+    assert reap_scratch(scratch_root, legacy_max_age=60) == [legacy_path]
+    assert not os.path.exists(legacy_path)
+
+@pytest.mark.scratch
+def test_reap_legacy_without_procfs(tmp_path, monkeypatch):
+    """
+    Test case to ensure that, when the processes cannot be inspected,
+    legacy scratch directories are only reaped on demand.
+    """
+    monkeypatch.setattr(tool.scratch, "PROC_DIR", str(tmp_path / "no-proc"))
+    scratch_root = str(tmp_path / "scratch")
+    legacy_path = _legacy_dir(scratch_root)
+
+    assert reap_scratch(scratch_root, legacy_max_age=60) == []
+    assert reap_scratch(scratch_root, legacy_max_age=60, force_legacy=True) == [legacy_path]
+
+CHILD_SCRIPT = """
+import sys, time
+from tool.scratch import JobScratch
+scratch = JobScratch(sys.argv[1])
+print(scratch.path, flush=True)
+time.sleep(60)
+"""
+
+@pytest.mark.scratch
+@pytest.mark.parametrize("signum", [signal.SIGTERM, signal.SIGINT])
+def test_signal_cleanup(tmp_path, signum):
+    """
+    Test case to ensure that the job scratch directories are removed when
+    the process is terminated, and the signal is still honoured.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p  for p in sys.path  if p)
+    proc = subprocess.Popen(
+        [sys.executable, "-c", CHILD_SCRIPT, str(tmp_path)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    try:
+        job_path = proc.stdout.readline().strip()
+        assert os.path.isdir(job_path)
+        proc.send_signal(signum)
+        retval = proc.wait(timeout=30)
+    finally:
+        proc.kill()
+        proc.stdout.close()
+
+    assert not os.path.exists(job_path)
+    if signum == signal.SIGTERM:
+        assert retval == -signal.SIGTERM
+    else:
+        # The default SIGINT handler raises KeyboardInterrupt
+        assert retval != 0
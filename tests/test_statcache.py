@@ -0,0 +1,96 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from __future__ import print_function
+
+import os
+import pytest
+
+import tool.statcache
+from tool.statcache import StatCache, is_remote_path, remote_mounts
+
+MOUNTS = "\n".join([
+    "/dev/sda1 / ext4 rw,relatime 0 0",
+    "server:/export /mnt/shared nfs4 rw,relatime 0 0",
+    "server:/data\\040sets /mnt/data\\040sets\\134x nfs rw 0 0",
+    "//host/share /mnt/café cifs rw 0 0",
+    "tmpfs /mnt/shared/tmp tmpfs rw 0 0",
+    "",
+])
+
+@pytest.fixture
+def no_remote_mounts(monkeypatch):
+    monkeypatch.setattr(tool.statcache, "_REMOTE_MOUNTS", None)
+
+@pytest.mark.statcache
+def test_remote_mounts(tmp_path, no_remote_mounts):
+    """
+    Test case to ensure that the remote mount points are found, and their
+    escaped characters restored.
+
+    .. code-block:: none
+
+       pytest tests/test_statcache.py
+    """
+    mounts_path = tmp_path / "mounts"
+    mounts_path.write_text(MOUNTS, encoding="utf-8")
+
+    assert remote_mounts(str(mounts_path)) == ["/mnt/data sets\\x", "/mnt/shared", "/mnt/café"]
+    assert is_remote_path("/mnt/shared/inputs/a.txt")
+    assert is_remote_path("/mnt/data sets\\x")
+    assert not is_remote_path("/mnt/sharedother")
+    assert not is_remote_path("/home/user")
+
+@pytest.mark.statcache
+def test_stat_cache(tmp_path, no_remote_mounts, monkeypatch):
+    """
+    Test case to ensure that each path is only stat'ed once until it is
+    invalidated, also when it is prefetched in parallel.
+    """
+    monkeypatch.setattr(tool.statcache, "_REMOTE_MOUNTS", [str(tmp_path)])
+    file_paths = []
+    for i in range(8):
+        file_path = tmp_path / "input{}.txt".format(i)
+        file_path.write_text("x" * i)
+        file_paths.append(str(file_path))
+    missing_path = str(tmp_path / "missing.txt")
+
+    stat_calls = []
+    real_stat = os.stat
+    def counting_stat(path, *args, **kwargs):
+        stat_calls.append(path)
+        return real_stat(path, *args, **kwargs)
+    monkeypatch.setattr(tool.statcache.os, "stat", counting_stat)
+
+    stat_cache = StatCache(max_workers=4)
+    stat_cache.prefetch(file_paths + [missing_path, str(tmp_path)])
+    assert sorted(stat_calls) == sorted(file_paths + [missing_path, str(tmp_path)])
+
+    assert stat_cache.isfile(file_paths[3])
+    assert stat_cache.stat(file_paths[3]).st_size == 3
+    assert stat_cache.isdir(str(tmp_path))
+    assert not stat_cache.exists(missing_path)
+    assert stat_cache.stat(missing_path) is None
+    assert len(stat_calls) == 10
+
+    # Stale until invalidated
+    os.unlink(file_paths[0])
+    assert stat_cache.exists(file_paths[0])
+    stat_cache.invalidate(file_paths[0])
+    assert not stat_cache.exists(file_paths[0])
+    assert len(stat_calls) == 11
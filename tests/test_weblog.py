@@ -0,0 +1,89 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import http.client
+import json
+import urllib.parse
+import pytest
+
+from tool.weblog import MAX_EVENT_SIZE, WeblogServer
+
+TASK_EVENT = {
+    'runName': 'happy_turing',
+    'event': 'process_completed',
+    'trace': {'task_id': 1, 'name': 'validation (1)', 'status': 'COMPLETED', 'submit': 1000, 'start': 1500, 'realtime': 200},
+}
+
+def _post(server, path, body, headers=None):
+    conn = http.client.HTTPConnection(server.httpd.server_address[0], server.port, timeout=10)
+    try:
+        conn.putrequest('POST', path)
+        if headers is None:
+            headers = {'Content-Length': str(len(body))}
+        for header, value in headers.items():
+            conn.putheader(header, value)
+        conn.endheaders(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+def _metrics(metrics_path):
+    with open(metrics_path, mode="r", encoding="utf-8") as mH:
+        return [json.loads(line) for line in mH]
+
+@pytest.mark.weblog
+def test_task_metrics_are_recorded(tmp_path):
+    """
+    Test case to ensure that the finished tasks reported to the weblog
+    endpoint are recorded.
+
+    .. code-block:: none
+
+       pytest tests/test_weblog.py
+    """
+    metrics_path = str(tmp_path / "metrics.jsonl")
+    with WeblogServer(metrics_path, '127.0.0.1') as server:
+        url = urllib.parse.urlsplit(server.url())
+        assert url.hostname == '127.0.0.1'
+        assert _post(server, url.path, json.dumps(TASK_EVENT).encode('utf-8')) == 200
+
+    metrics = _metrics(metrics_path)
+    assert len(metrics) == 1
+    assert metrics[0]['name'] == 'validation (1)'
+    assert metrics[0]['queue_ms'] == 500
+
+@pytest.mark.weblog
+def test_unexpected_requests_are_rejected(tmp_path):
+    """
+    Test case to ensure that requests without the token, or with missing
+    or oversized bodies, are rejected without recording anything.
+    """
+    metrics_path = str(tmp_path / "metrics.jsonl")
+    payload = json.dumps(TASK_EVENT).encode('utf-8')
+    with WeblogServer(metrics_path, '127.0.0.1') as server:
+        token_path = urllib.parse.urlsplit(server.url()).path
+
+        assert _post(server, '/wrong-token', payload) == 404
+        # The declared body is never sent, so it would hang if it were read
+        assert _post(server, '/wrong-token', b'', {'Content-Length': str(MAX_EVENT_SIZE)}) == 404
+        assert _post(server, token_path, b'', {'Content-Length': str(MAX_EVENT_SIZE + 1)}) == 413
+        assert _post(server, token_path, b'', {'Content-Length': 'lots'}) == 411
+        assert _post(server, token_path, b'', {}) == 411
+
+    assert _metrics(metrics_path) == []
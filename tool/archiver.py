@@ -0,0 +1,414 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import collections
+import concurrent.futures
+import fnmatch
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+
+from utils import logger
+
+# ------------------------------------------------------------------------------
+
+# gzip: GNU tar with single threaded gzip (the historical behaviour)
+# pigz: GNU tar with multi-threaded pigz (gzip compatible)
+# zstd: GNU tar with multi-threaded zstd (NOT gzip compatible)
+# python: in-process tarfile writer with parallel gzip compression
+ARCHIVE_FORMATS = ('gzip', 'pigz', 'zstd', 'python')
+
+# The different archives generated by the runner
+ARCHIVE_KINDS = ('workflow', 'workdir', 'results', 'stats', 'other')
+
+# The archives consumed by OpenVRE, or re-read through tarfile on
+# replays, which must be gzip compatible
+GZIP_ARCHIVE_KINDS = ('workflow', 'results', 'stats', 'other')
+
+ARCHIVE_EXTENSIONS = {
+    'zstd': '.tar.zst',
+}
+DEFAULT_ARCHIVE_EXTENSION = '.tar.gz'
+
+DEFAULT_ARCHIVE_FORMAT = 'gzip'
+DEFAULT_ARCHIVE_LEVEL = {
+    'gzip': 6,
+    'pigz': 6,
+    'zstd': 3,
+    'python': 6,
+}
+
+ArchiveSpec = collections.namedtuple('ArchiveSpec', ['format', 'level', 'threads'])
+
+# Which files are archived. The ones matching the keep globs are always
+# archived. Otherwise, they must match the include globs (when there
+# are) but not the exclude ones, and be at most max_file_size bytes
+ArchiveSelection = collections.namedtuple('ArchiveSelection', ['keep', 'include', 'exclude', 'max_file_size'])
+
+# The Nextflow workdir files which tell what happened: logs, the task
+# scripts and their outcome, the traces and the params and setup files.
+# They are anchored to the launch directory, so task outputs with
+# similar names are not kept regardless of their size
+WORKDIR_KEEP_GLOBS = (
+    '.nextflow.log*',
+    '*trace*',
+    'params*',
+    '*.config',
+    'work/*/*/.command.*',
+    'work/*/*/.exitcode',
+)
+
+DEFAULT_MAX_FILE_SIZE = {
+    'workdir': 1024 * 1024,
+}
+
+# The archived index of the files which were left out
+OMITTED_MANIFEST = 'omitted-files.json'
+
+def _archive_option(config, kind, option):
+    sections = ('archives.' + kind, 'archives')  if kind  else ('archives',)
+    for section in sections:
+        if config.has_option(section, option):
+            return config.get(section, option)
+    return None
+
+def archive_spec_from_config(config, kind):
+    """
+    The archive setup for each kind of archive is read from its
+    [archives.<kind>] section, falling back to the [archives] one.
+    The None kind only reads the [archives] section
+    """
+    def get_option(option):
+        return _archive_option(config, kind, option)
+
+    archive_format = get_option('format') or DEFAULT_ARCHIVE_FORMAT
+    if archive_format not in ARCHIVE_FORMATS:
+        raise Exception("ERROR: Unknown archive format '{}' for {} archives. Valid ones are {}".format(archive_format, kind, ', '.join(ARCHIVE_FORMATS)))
+
+    if archive_format == 'zstd':
+        if kind is None or kind in GZIP_ARCHIVE_KINDS:
+            logger.warning("{} archives must be gzip compatible. Using 'pigz' instead of 'zstd'".format(kind or 'Default'))
+            archive_format = 'pigz'
+        elif shutil.which('zstd') is None:
+            # The in-process fallback only writes gzip
+            logger.warning("Compressor for 'zstd' archives is not available. Using the in-process one for {} archives".format(kind))
+            archive_format = 'python'
+
+    level = get_option('level')
+    threads = get_option('threads')
+
+    return ArchiveSpec(
+        format=archive_format,
+        level=int(level)  if level  else DEFAULT_ARCHIVE_LEVEL[archive_format],
+        threads=int(threads)  if threads  else 0,
+    )
+
+def archive_extension(spec):
+    """
+    File name extension of the archives written following the spec
+    """
+    return ARCHIVE_EXTENSIONS.get(spec.format, DEFAULT_ARCHIVE_EXTENSION)
+
+def archive_selection_from_config(config, kind, keep=(), parse_size=int):
+    """
+    The file selection for a kind of archive, from its include, exclude
+    and max_file_size options (read like the archive setup). It returns
+    None when every file is archived
+    """
+    include = _archive_option(config, kind, 'include')
+    exclude = _archive_option(config, kind, 'exclude')
+    max_file_size = _archive_option(config, kind, 'max_file_size')
+    max_file_size = parse_size(max_file_size)  if max_file_size is not None  else DEFAULT_MAX_FILE_SIZE.get(kind)
+
+    selection = ArchiveSelection(
+        keep=tuple(keep),
+        include=tuple(include.split())  if include  else (),
+        exclude=tuple(exclude.split())  if exclude  else (),
+        max_file_size=max_file_size or None,
+    )
+    if not selection.include and not selection.exclude and selection.max_file_size is None:
+        return None
+
+    return selection
+
+def _matches(globs, rel_path):
+    entry_name = os.path.basename(rel_path)
+    return any(fnmatch.fnmatch(entry_name, glob) or fnmatch.fnmatch(rel_path, glob) for glob in globs)
+
+def _matches_anchored(globs, rel_path):
+    """
+    The globs are matched against the whole relative path, one component
+    at a time, so wildcards never cross directories
+    """
+    path_parts = rel_path.split(os.sep)
+    for glob in globs:
+        glob_parts = glob.split('/')
+        if len(glob_parts) == len(path_parts) and all(fnmatch.fnmatch(path_part, glob_part) for path_part, glob_part in zip(path_parts, glob_parts)):
+            return True
+    return False
+
+def omission_reason(selection, rel_path, size):
+    """
+    Why a file is left out of the archive, or None when it is archived.
+    The keep globs are anchored, while the include and exclude ones are
+    also matched against the file name
+    """
+    if _matches_anchored(selection.keep, rel_path):
+        return None
+    if _matches(selection.exclude, rel_path):
+        return 'excluded'
+    if selection.include and not _matches(selection.include, rel_path):
+        return 'not included'
+    if selection.max_file_size is not None and size > selection.max_file_size:
+        return 'too large'
+    return None
+
+def _resolve_threads(threads):
+    return threads  if threads > 0  else (os.cpu_count() or 1)
+
+def _compressor_command(spec):
+    """
+    It returns the compressor command line used by tar, or None
+    when it is not available
+    """
+    if spec.format == 'gzip':
+        compressor = shutil.which('gzip')
+        return [compressor, '-{}'.format(spec.level)]  if compressor  else None
+
+    if spec.format == 'pigz':
+        compressor = shutil.which('pigz')
+        return [compressor, '-{}'.format(spec.level), '-p', str(_resolve_threads(spec.threads))]  if compressor  else None
+
+    if spec.format == 'zstd':
+        compressor = shutil.which('zstd')
+        return [compressor, '-{}'.format(spec.level), '-T{}'.format(_resolve_threads(spec.threads)), '-q']  if compressor  else None
+
+    return None
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Writable stream which compresses fixed size blocks in parallel,
+    each one of them as an independent gzip member. The concatenation
+    of gzip members is a valid gzip file (RFC 1952), readable by gzip,
+    GNU tar, zlib and Python.
+    """
+
+    def __init__(self, dest_path, level=6, threads=0, block_size=4*1024*1024):
+        super().__init__()
+        self.dest_fh = open(dest_path, mode="wb")
+        self.level = level
+        self.block_size = block_size
+        self.threads = _resolve_threads(threads)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="vre-gzip")
+        self.pending = collections.deque()
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def _drain(self, max_pending):
+        # Compressed blocks are written in order
+        while len(self.pending) > max_pending:
+            self.dest_fh.write(self.pending.popleft().result())
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.level))
+        # Bounded memory usage
+        self._drain(self.threads * 2)
+
+    def write(self, b):
+        self.buf += b
+        while len(self.buf) >= self.block_size:
+            self._submit(bytes(self.buf[:self.block_size]))
+            del self.buf[:self.block_size]
+
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self.buf) > 0:
+                self._submit(bytes(self.buf))
+                self.buf = bytearray()
+            self._drain(0)
+        finally:
+            self.pool.shutdown()
+            self.dest_fh.close()
+            super().close()
+
+class CompressorSink(io.RawIOBase):
+    """
+    Writable stream which feeds an external compressor process
+    """
+
+    def __init__(self, dest_path, compressor_cmd):
+        super().__init__()
+        self.dest_path = dest_path
+        self.dest_fh = open(dest_path, mode="wb")
+        self.compressor_cmd = compressor_cmd
+        self.proc = subprocess.Popen(compressor_cmd + ['-c'], stdin=subprocess.PIPE, stdout=self.dest_fh, stderr=subprocess.PIPE)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.proc.stdin.write(b)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.proc.stdin.close()
+            stderr_v = self.proc.stderr.read()
+            retval = self.proc.wait()
+        finally:
+            self.dest_fh.close()
+            super().close()
+
+        if retval != 0:
+            raise Exception("ERROR: Compressor {} failed while writing {} (retval {})\n======\nSTDERR\n======\n{}".format(self.compressor_cmd[0], self.dest_path, retval, stderr_v.decode('utf-8', 'replace')))
+
+def _resolve_compressor(spec):
+    compressor_cmd = None
+    if spec.format != 'python':
+        compressor_cmd = _compressor_command(spec)
+        if compressor_cmd is None:
+            logger.warning("Compressor for '{}' archives is not available. Using the in-process one".format(spec.format))
+
+    return compressor_cmd
+
+def open_archive_sink(destTarFile, spec):
+    """
+    It returns a writable stream where a tar stream can be written,
+    which is compressed following the archive setup
+    """
+    compressor_cmd = _resolve_compressor(spec)
+    if compressor_cmd is None:
+        return ParallelGzipWriter(destTarFile, level=spec.level, threads=spec.threads)
+
+    return CompressorSink(destTarFile, compressor_cmd)
+
+def _add_generated_file(tar, arcname, contents):
+    member_info = tarfile.TarInfo(arcname)
+    member_info.size = len(contents)
+    member_info.mtime = int(time.time())
+    tar.addfile(member_info, io.BytesIO(contents))
+
+def harvest_dir(resultsDir, destTarFile, basePackdir, spec, visitor=None, selection=None, skip_names=(), extra_files=None):
+    """
+    Archives the contents of resultsDir in destTarFile, under basePackdir,
+    reading the tree only once. The visitor (if any) is called with the
+    relative and absolute paths of each non-directory entry, as soon as
+    it is archived, so matching files can be placed elsewhere in the
+    same pass. When there is a selection, the files left out are listed
+    in an archived manifest, which is also returned. The entries named
+    like skip_names are silently left out, and extra_files maps the
+    relative paths of generated files to their contents.
+    """
+    omitted = []
+    with open_archive_sink(destTarFile, spec) as sinkH:
+        with tarfile.open(fileobj=sinkH, mode='w|', bufsize=1024*1024) as tar:
+            tar.add(resultsDir, arcname=basePackdir, recursive=False)
+            for root, dirs, files in os.walk(resultsDir):
+                # Same order as the one used by tarfile
+                dirs.sort()
+                files.sort()
+                if skip_names:
+                    dirs[:] = [entry_name for entry_name in dirs if entry_name not in skip_names]
+                    files = [entry_name for entry_name in files if entry_name not in skip_names]
+                rel_root = os.path.relpath(root, resultsDir)
+                if rel_root == os.curdir:
+                    rel_root = ''
+                for entry_name in dirs:
+                    tar.add(os.path.join(root, entry_name), arcname=os.path.join(basePackdir, rel_root, entry_name), recursive=False)
+                for entry_name in files:
+                    abs_path = os.path.join(root, entry_name)
+                    rel_path = os.path.join(rel_root, entry_name)
+                    if selection is not None:
+                        try:
+                            size = os.lstat(abs_path).st_size
+                        except OSError:
+                            continue
+                        reason = omission_reason(selection, rel_path, size)
+                        if reason is not None:
+                            omitted.append({'path': rel_path, 'size': size, 'reason': reason})
+                            continue
+                    tar.add(abs_path, arcname=os.path.join(basePackdir, rel_path), recursive=False)
+                    if visitor is not None:
+                        visitor(rel_path, abs_path)
+
+            if selection is not None:
+                manifest = json.dumps({
+                    'omitted_files': len(omitted),
+                    'omitted_bytes': sum(entry['size'] for entry in omitted),
+                    'omitted': omitted,
+                }, indent=1).encode('utf-8')
+                _add_generated_file(tar, os.path.join(basePackdir, OMITTED_MANIFEST), manifest)
+
+            if extra_files:
+                for rel_path, contents in extra_files.items():
+                    _add_generated_file(tar, os.path.join(basePackdir, rel_path), contents)
+
+    return omitted
+
+def rebase_archive(srcTarFile, destTarFile, oldBasePackdir, newBasePackdir, spec):
+    """
+    Copies the archive srcTarFile to destTarFile, moving the entries
+    under oldBasePackdir to newBasePackdir
+    """
+    def rebased(name):
+        if name == oldBasePackdir or name.startswith(oldBasePackdir + '/'):
+            return newBasePackdir + name[len(oldBasePackdir):]
+        return name
+
+    with tarfile.open(srcTarFile, mode='r:*') as src_tar:
+        with open_archive_sink(destTarFile, spec) as sinkH:
+            with tarfile.open(fileobj=sinkH, mode='w|', bufsize=1024*1024) as tar:
+                for member in src_tar:
+                    member.name = rebased(member.name)
+                    if member.islnk():
+                        member.linkname = rebased(member.linkname)
+                    tar.addfile(member, src_tar.extractfile(member)  if member.isfile()  else None)
+
+def pack_dir(resultsDir, destTarFile, basePackdir, spec):
+    """
+    Archives the contents of resultsDir in destTarFile, under basePackdir
+    """
+    compressor_cmd = _resolve_compressor(spec)
+    if compressor_cmd is None:
+        with ParallelGzipWriter(destTarFile, level=spec.level, threads=spec.threads) as gzH:
+            with tarfile.open(fileobj=gzH, mode='w|', bufsize=1024*1024) as tar:
+                tar.add(resultsDir, arcname=basePackdir, recursive=True)
+    else:
+        # The compressor receives the parameters through -I
+        tar_proc = subprocess.run([
+            "tar", "--transform", "s#{0}#{1}#".format(resultsDir.lstrip('/'), basePackdir),
+            "-c", "-I", " ".join(compressor_cmd),
+            "-f", destTarFile, resultsDir
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        # Exit status 1 means some files changed while they were read
+        if tar_proc.returncode > 1:
+            raise Exception("ERROR: Unable to pack {} into {} (retval {})\n======\nSTDERR\n======\n{}".format(resultsDir, destTarFile, tar_proc.returncode, tar_proc.stderr.decode('utf-8', 'replace')))
@@ -0,0 +1,161 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import os
+import time
+import uuid
+
+from utils import logger
+
+from tool.locks import FileLock
+from tool.cache_index import format_size
+
+# ------------------------------------------------------------------------------
+
+RESERVATION_PREFIX = 'res-'
+RESERVATION_SUFFIX = '.json'
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+class Reservation(object):
+    """
+    A granted share of the host resources. It is alive while its file
+    is locked, so the share of a dead job is given back automatically
+    """
+
+    def __init__(self, reservation_path, cpus, memory):
+        self.reservation_path = reservation_path
+        self.cpus = cpus
+        self.memory = memory
+        self.lock = FileLock(reservation_path)
+
+    def release(self):
+        if self.lock.locked:
+            try:
+                os.unlink(self.reservation_path)
+            except FileNotFoundError:
+                pass
+            self.lock.release()
+
+class ResourceBroker(object):
+    """
+    Host level ledger of the CPUs and memory granted to the concurrent
+    jobs, shared by all the runner processes through a state directory.
+    Each reservation is a file locked by its owner, and the decisions
+    are taken under the ledger lock.
+    """
+
+    POLL_INTERVAL = 2
+
+    def __init__(self, state_dir, total_cpus, total_memory=None, min_cpus=1, min_memory=0):
+        self.state_dir = state_dir
+        self.total_cpus = total_cpus
+        self.total_memory = total_memory
+        self.min_cpus = min(min_cpus, total_cpus)
+        self.min_memory = min_memory
+        self.ledger_lock = FileLock(os.path.join(state_dir, 'ledger.lock'))
+
+    def _usage(self):
+        """
+        CPUs and memory of the alive reservations. The ones from dead
+        jobs are removed. It must be called holding the ledger lock
+        """
+        used_cpus = 0
+        used_memory = 0
+        for entry_name in os.listdir(self.state_dir):
+            if not (entry_name.startswith(RESERVATION_PREFIX) and entry_name.endswith(RESERVATION_SUFFIX)):
+                continue
+
+            reservation_path = os.path.join(self.state_dir, entry_name)
+            probe = FileLock(reservation_path)
+            if probe.acquire(blocking=False):
+                # Nobody holds it
+                try:
+                    os.unlink(reservation_path)
+                    logger.debug("Removed stale resource reservation {}".format(entry_name))
+                except FileNotFoundError:
+                    pass
+                probe.release()
+                continue
+
+            try:
+                with open(reservation_path, mode="r", encoding="utf-8") as rH:
+                    reservation = json.load(rH)
+            except (OSError, ValueError):
+                # Unreadable, so it is counted as the minimum share
+                reservation = {'cpus': self.min_cpus, 'memory': self.min_memory}
+            used_cpus += reservation.get('cpus', 0)
+            used_memory += reservation.get('memory', 0) or 0
+
+        return used_cpus, used_memory
+
+    def _tryReserve(self, cpus, memory):
+        with self.ledger_lock:
+            used_cpus, used_memory = self._usage()
+            free_cpus = self.total_cpus - used_cpus
+            free_memory = self.total_memory - used_memory  if self.total_memory is not None  else None
+            if free_cpus < self.min_cpus:
+                return None
+            if free_memory is not None and free_memory < self.min_memory:
+                return None
+
+            granted_cpus = min(cpus, free_cpus)
+            granted_memory = memory
+            if free_memory is not None:
+                granted_memory = free_memory  if memory is None  else min(memory, free_memory)
+
+            reservation_path = os.path.join(self.state_dir, "{}{}-{}{}".format(RESERVATION_PREFIX, os.getpid(), uuid.uuid4().hex, RESERVATION_SUFFIX))
+            reservation = Reservation(reservation_path, granted_cpus, granted_memory)
+            reservation.lock.acquire()
+            # The lock file is the reservation
+            reservation.lock.lock_fh.write(json.dumps({
+                'pid': os.getpid(),
+                'cpus': granted_cpus,
+                'memory': granted_memory,
+                'created': time.time(),
+            }))
+            reservation.lock.lock_fh.flush()
+
+            return reservation
+
+    def reserve(self, cpus, memory=None, timeout=None):
+        """
+        It waits until a share of at least min_cpus (and min_memory)
+        is available, and it returns the reservation, which gets up to
+        the requested resources
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        deadline = time.monotonic() + timeout  if timeout is not None  else None
+        waiting = False
+        while True:
+            reservation = self._tryReserve(cpus, memory)
+            if reservation is not None:
+                logger.info("Granted {} cpus and {} memory".format(reservation.cpus, format_size(reservation.memory)  if reservation.memory is not None  else 'unbounded'))
+                return reservation
+
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Exception("ERROR: No host resources were granted in {} seconds".format(timeout))
+            if not waiting:
+                logger.info("Waiting for host resources ({} cpus requested)".format(cpus))
+                waiting = True
+            time.sleep(self.POLL_INTERVAL)
@@ -0,0 +1,182 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import os
+import re
+import time
+
+from utils import logger
+
+from tool.locks import FileLock, atomic_write
+
+# ------------------------------------------------------------------------------
+
+SIZE_UNITS = {
+    '': 1,
+    'K': 1024,
+    'M': 1024 ** 2,
+    'G': 1024 ** 3,
+    'T': 1024 ** 4,
+}
+
+def parse_size(size_str):
+    """
+    Parses sizes like 1024, 500M or 20G. None, empty and zero mean no limit
+    """
+    if size_str is None:
+        return None
+
+    matched = re.match(r"^\s*([0-9]+(?:\.[0-9]+)?)\s*([KMGT]?)i?B?\s*$", str(size_str), re.IGNORECASE)
+    if matched is None:
+        raise Exception("ERROR: Unable to parse size '{}'".format(size_str))
+
+    size = int(float(matched.group(1)) * SIZE_UNITS[matched.group(2).upper()])
+    return size  if size > 0  else None
+
+def format_size(size):
+    for unit in ('', 'K', 'M', 'G'):
+        if size < 1024:
+            return "{0:.1f}{1}".format(size, unit)  if unit  else "{0}".format(size)
+        size /= 1024.0
+
+    return "{0:.1f}T".format(size)
+
+def tree_size(path):
+    """
+    Disk usage of a file or a directory, without following symlinks
+    """
+    total = 0
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            for name in files + dirs:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+    elif os.path.lexists(path):
+        total = os.lstat(path).st_size
+
+    return total
+
+class CacheIndex(object):
+    """
+    Persistent index of the entries of an on-disk cache, which tracks
+    their size, creation, last usage and number of hits. It is shared
+    among concurrent processes through a lock file.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock_path = index_path + '.lock'
+
+    def _lock(self):
+        # A new descriptor per acquisition, as flock does not exclude
+        # the threads sharing the same one
+        return FileLock(self.lock_path)
+
+    def _read(self):
+        try:
+            with open(self.index_path, mode="r", encoding="utf-8") as iH:
+                return json.load(iH)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Cache index {} is corrupted. Starting from scratch".format(self.index_path))
+            return {}
+
+    def _write(self, entries):
+        atomic_write(self.index_path, json.dumps(entries, indent=1, sort_keys=True))
+
+    def entries(self):
+        with self._lock():
+            return self._read()
+
+    def touch(self, entry_id, size=None, hit=True, **info):
+        """
+        Registers the usage of an entry, creating it when needed
+        """
+        now = time.time()
+        with self._lock():
+            entries = self._read()
+            entry = entries.setdefault(entry_id, {
+                'created': now,
+                'hits': 0,
+                'size': 0,
+            })
+            entry['last_used'] = now
+            if hit:
+                entry['hits'] += 1
+            if size is not None:
+                entry['size'] = size
+            entry.update(info)
+            self._write(entries)
+
+        return entry
+
+    def update(self, entries_update, removed_ids=()):
+        """
+        Merges entries discovered by other means, and forgets the removed ones
+        """
+        with self._lock():
+            entries = self._read()
+            for entry_id in removed_ids:
+                entries.pop(entry_id, None)
+            for entry_id, entry in entries_update.items():
+                entries.setdefault(entry_id, {}).update(entry)
+            self._write(entries)
+
+    def evict(self, max_size, evict_func):
+        """
+        Evicts the least recently used entries until the cache fits
+        in max_size bytes. evict_func receives the entry id and its
+        description, and it returns False when the entry could not be
+        evicted (for instance, because it is being used).
+        It returns the list of evicted entry ids.
+        """
+        evicted = []
+        if max_size is None:
+            return evicted
+
+        with self._lock():
+            entries = self._read()
+            total_size = sum(entry.get('size', 0) for entry in entries.values())
+            # Evicting an entry can make evictable another one which
+            # depends on it, so new passes are done while there is progress
+            progressed = True
+            while progressed and total_size > max_size:
+                progressed = False
+                for entry_id, entry in sorted(entries.items(), key=lambda e: e[1].get('last_used', 0)):
+                    if total_size <= max_size:
+                        break
+                    try:
+                        if not evict_func(entry_id, entry):
+                            continue
+                    except Exception as error:
+                        logger.warning("Unable to evict cache entry {}: {}".format(entry_id, error))
+                        continue
+
+                    total_size -= entry.get('size', 0)
+                    del entries[entry_id]
+                    evicted.append(entry_id)
+                    progressed = True
+
+            if len(evicted) > 0:
+                self._write(entries)
+
+        return evicted
@@ -0,0 +1,125 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import asyncio
+import collections
+import os
+import signal
+import subprocess
+
+# ------------------------------------------------------------------------------
+
+# Only the beginning of the output of each command is kept. The
+# rest is read (so the command is never blocked) and discarded
+DEFAULT_MAX_OUTPUT = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# Exit value of the commands which were killed because of the timeout
+TIMEOUT_RETVAL = -9
+
+CommandResult = collections.namedtuple('CommandResult', ['args', 'retval', 'stdout', 'stderr', 'timed_out'])
+
+async def _read_bounded(stream, max_output):
+    chunks = []
+    kept = 0
+    dropped = 0
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            break
+        if kept < max_output:
+            chunk_kept = chunk[:max_output - kept]
+            chunks.append(chunk_kept)
+            kept += len(chunk_kept)
+            dropped += len(chunk) - len(chunk_kept)
+        else:
+            dropped += len(chunk)
+
+    output = b''.join(chunks).decode('utf-8', 'replace')
+    if dropped > 0:
+        output += "\n[... {} more bytes]\n".format(dropped)
+    return output
+
+async def _run_command(args, cwd=None, timeout=None, max_output=DEFAULT_MAX_OUTPUT):
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        # Its own process group, so the helpers it spawns (like the git
+        # remote helpers) are also killed on timeout
+        start_new_session=True,
+    )
+    outputs = asyncio.gather(
+        _read_bounded(proc.stdout, max_output),
+        _read_bounded(proc.stderr, max_output),
+        proc.wait(),
+    )
+    timed_out = False
+    try:
+        stdout_v, stderr_v, retval = await asyncio.wait_for(outputs, timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+        stdout_v = ''
+        stderr_v = "Killed after {} seconds".format(timeout)
+        retval = TIMEOUT_RETVAL
+
+    return CommandResult(args=args, retval=retval, stdout=stdout_v, stderr=stderr_v, timed_out=timed_out)
+
+async def _run_sequence(commands, timeout, max_output):
+    results = []
+    for args, cwd in commands:
+        result = await _run_command(args, cwd=cwd, timeout=timeout, max_output=max_output)
+        results.append(result)
+        if result.retval != 0:
+            break
+    return results
+
+async def _run_concurrently(commands, timeout, max_output):
+    return await asyncio.gather(*[
+        _run_command(args, cwd=cwd, timeout=timeout, max_output=max_output)
+        for args, cwd in commands
+    ])
+
+def run_command(args, cwd=None, timeout=None, max_output=DEFAULT_MAX_OUTPUT):
+    """
+    Runs a command, capturing its output in memory. It returns a
+    CommandResult, whose outputs are already decoded
+    """
+    return asyncio.run(_run_command(args, cwd=cwd, timeout=timeout, max_output=max_output))
+
+def run_commands(commands, timeout=None, max_output=DEFAULT_MAX_OUTPUT):
+    """
+    Runs independent commands (pairs of parameters and working
+    directory) at once. It returns their results, in the same order
+    """
+    return asyncio.run(_run_concurrently(commands, timeout, max_output))
+
+def run_sequence(commands, timeout=None, max_output=DEFAULT_MAX_OUTPUT):
+    """
+    Runs commands (pairs of parameters and working directory) one after
+    the other, stopping on the first failure. It returns the results
+    of the commands which were run
+    """
+    return asyncio.run(_run_sequence(commands, timeout, max_output))
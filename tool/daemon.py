@@ -0,0 +1,476 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import collections
+import json
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+from utils import logger
+
+# ------------------------------------------------------------------------------
+
+# A job request is a single message, which carries the stdout and
+# stderr descriptors of the client
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# Messages are prefixed by their length, as stream sockets can deliver
+# them in several chunks
+FRAME_HEADER = struct.Struct('!I')
+
+def send_message(sock, payload, fds=()):
+    """
+    Sends a framed message, with the descriptors attached to its first bytes
+    """
+    frame = FRAME_HEADER.pack(len(payload)) + payload
+    sent = socket.send_fds(sock, [frame], list(fds))
+    if sent < len(frame):
+        sock.sendall(frame[sent:])
+
+def _recv_exactly(sock, size, maxfds, fds):
+    chunks = []
+    while size > 0:
+        chunk, chunk_fds, _, _ = socket.recv_fds(sock, size, maxfds)
+        fds.extend(chunk_fds)
+        if len(chunk) == 0:
+            raise EOFError("The peer closed the connection in the middle of a message")
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b''.join(chunks)
+
+def recv_message(sock, max_size, maxfds=0):
+    """
+    Receives a framed message, and the descriptors attached to it. It
+    raises EOFError when the peer closes the connection
+    """
+    fds = []
+    try:
+        size, = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size, maxfds, fds))
+        if size > max_size:
+            raise Exception("ERROR: Message of {} bytes is larger than the limit ({})".format(size, max_size))
+        payload = _recv_exactly(sock, size, maxfds, fds)
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+    return payload, fds
+
+class CPUBudget(object):
+    """
+    Admission control of the jobs, which are started in arrival order
+    as long as there are enough CPUs left in the budget
+    """
+
+    def __init__(self, total_cpus):
+        self.total_cpus = total_cpus
+        self.available = total_cpus
+        self.cond = threading.Condition()
+        self.waiting = collections.deque()
+
+    def acquire(self, cpus):
+        cpus = min(cpus, self.total_cpus)
+        ticket = object()
+        with self.cond:
+            self.waiting.append(ticket)
+            while self.waiting[0] is not ticket or self.available < cpus:
+                self.cond.wait()
+            self.waiting.popleft()
+            self.available -= cpus
+            self.cond.notify_all()
+
+        return cpus
+
+    def release(self, cpus):
+        with self.cond:
+            self.available += cpus
+            self.cond.notify_all()
+
+    @property
+    def queued(self):
+        with self.cond:
+            return len(self.waiting)
+
+def _run_job(job_func, job, fds):
+    """
+    Body of the forked process which runs a job, with the output
+    descriptors, working directory and environment of the client
+    """
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.dup2(fds[0], sys.stdout.fileno())
+    os.dup2(fds[1], sys.stderr.fileno())
+    os.chdir(job['cwd'])
+    os.environ.clear()
+    os.environ.update(job.get('env', {}))
+    if job.get('local'):
+        sys._run_from_cmdl = True  # pylint: disable=protected-access
+    if job.get('log_file'):
+        sys.stderr = sys.stdout = open(job['log_file'], "a")
+
+    retval = 0
+    try:
+        job_func(job['config'], job['in_metadata'], job['out_metadata'])
+    except BaseException:
+        logger.exception("Job from {} failed".format(job['config']))
+        retval = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    os._exit(retval)
+
+def _send_line(sock, **info):
+    try:
+        sock.sendall((json.dumps(info) + "\n").encode('utf-8'))
+    except OSError:
+        # The daemon is gone, but the job goes on
+        pass
+
+def _fork_job(job_func, warm_func, msg, fds, inherited_fds):
+    """
+    It warms up and forks a job, returning its pid and reply socket, or
+    None when it could not be started (the reason is sent through the
+    reply socket)
+    """
+    job_fds = fds[:2]
+    reply = socket.socket(fileno=fds[2])
+    try:
+        job = json.loads(msg.decode('utf-8'))
+        if warm_func is not None:
+            try:
+                warm_func(job)
+            except Exception as error:
+                logger.warning("Unable to warm up job {}: {}".format(job.get('config'), error))
+
+        # The warm up must not leave threads behind, as any lock held by
+        # them would be inherited locked by the job
+        if threading.active_count() > 1:
+            alive = ", ".join(thread.name for thread in threading.enumerate() if thread is not threading.current_thread())
+            _send_line(reply, error="Threads left alive in the forker: " + alive)
+            reply.close()
+            return None
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for fd in inherited_fds:
+                    os.close(fd)
+                reply.close()
+                _run_job(job_func, job, job_fds)
+            finally:
+                os._exit(1)
+    except BaseException:
+        reply.close()
+        raise
+    finally:
+        for fd in job_fds:
+            os.close(fd)
+
+    _send_line(reply, pid=pid)
+    return pid, reply
+
+def _forker_loop(control, daemon_control, job_func, warm_func):
+    """
+    Body of the forker process. It is forked from the daemon before any
+    thread is started, and it stays single threaded, so the jobs forked
+    from it cannot inherit locks held by other threads. Each request
+    carries the output descriptors of the client and a reply socket,
+    which receives the job pid and later its exit value
+    """
+    # Otherwise, the end of the daemon would never be noticed
+    daemon_control.close()
+
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_w, warn_on_full_buffer=False)
+
+    replies = {}
+    accepting = True
+    while accepting or len(replies) > 0:
+        readable = [wakeup_r] + ([control]  if accepting  else [])
+        ready, _, _ = select.select(readable, [], [])
+        if wakeup_r in ready:
+            os.read(wakeup_r, 4096)
+        if control in ready:
+            try:
+                msg, fds = recv_message(control, MAX_REQUEST_SIZE, 3)
+            except EOFError:
+                # The daemon is gone, so only the running jobs are waited for
+                accepting = False
+            else:
+                if len(fds) != 3:
+                    logger.error("Forker request without its descriptors")
+                    for fd in fds:
+                        os.close(fd)
+                else:
+                    try:
+                        forked = _fork_job(job_func, warm_func, msg, fds, [control.fileno(), wakeup_r, wakeup_w] + [reply.fileno() for reply in replies.values()])
+                    except Exception as error:
+                        logger.error("Unable to fork a job: {}".format(error))
+                        forked = None
+                    if forked is not None:
+                        pid, reply = forked
+                        replies[pid] = reply
+
+        # The finished jobs are reaped
+        while len(replies) > 0:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            reply = replies.pop(pid, None)
+            if reply is not None:
+                _send_line(reply, retval=os.waitstatus_to_exitcode(status))
+                reply.close()
+
+class _JobHandler(socketserver.BaseRequestHandler):
+    def _send_event(self, event, **info):
+        info['event'] = event
+        try:
+            self.request.sendall((json.dumps(info) + "\n").encode('utf-8'))
+        except OSError:
+            # The client is gone, but the job goes on
+            pass
+
+    def handle(self):
+        try:
+            msg, fds = recv_message(self.request, MAX_REQUEST_SIZE, 2)
+        except Exception as error:
+            self._send_event('finished', retval=1, error="Unable to receive the job: {}".format(error))
+            return
+        try:
+            if len(fds) != 2:
+                self._send_event('finished', retval=1, error="The client did not send its output descriptors")
+                return
+            job = json.loads(msg.decode('utf-8'))
+            self.server.daemon.serve(job, fds, self._send_event)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class JobForker(object):
+    """
+    Single threaded process which forks the jobs, so they inherit the
+    parsed setup and the warmed caches, but never a lock held by another
+    thread. It must be started while the caller has no other thread,
+    and then any thread can run jobs through it. job_func receives the
+    config, in_metadata and out_metadata paths, and warm_func (if any)
+    the job description, in the forker process, before it is forked.
+    """
+
+    def __init__(self, job_func, warm_func=None):
+        self.job_func = job_func
+        self.warm_func = warm_func
+        self.mp_context = multiprocessing.get_context('fork')
+        self.process = None
+        self.control = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if threading.active_count() > 1:
+            raise Exception("ERROR: The job forker cannot be started while other threads are alive")
+
+        self.control, forker_end = socket.socketpair()
+        self.process = self.mp_context.Process(target=_forker_loop, args=(forker_end, self.control, self.job_func, self.warm_func), name="vre-forker")
+        self.process.start()
+        forker_end.close()
+        return self
+
+    def close(self):
+        """
+        The forker waits for the running jobs before leaving
+        """
+        if self.process is not None:
+            self.control.close()
+            self.process.join()
+            self.process = None
+
+    def _spawn(self, job, fds):
+        """
+        It hands the job to the forker, returning the socket where its
+        pid and exit value are reported
+        """
+        reply, forker_reply = socket.socketpair()
+        try:
+            with self.lock:
+                send_message(self.control, json.dumps(job).encode('utf-8'), list(fds) + [forker_reply.fileno()])
+        except BaseException:
+            reply.close()
+            raise
+        finally:
+            forker_reply.close()
+
+        return reply
+
+    def run(self, job, fds, started=None):
+        """
+        Runs the job (a description like the one built by submit_job)
+        with the given stdout and stderr descriptors, and waits for it.
+        started (if any) receives the pid of the job. It returns the
+        job exit value, and it raises an exception when the job could
+        not be run
+        """
+        retval = None
+        with self._spawn(job, fds) as reply, reply.makefile(mode="r", encoding="utf-8") as events:
+            for line in events:
+                event = json.loads(line)
+                if 'pid' in event:
+                    if started is not None:
+                        started(event['pid'])
+                elif 'retval' in event:
+                    retval = event['retval']
+                elif 'error' in event:
+                    raise Exception("ERROR: Unable to start job {}: {}".format(job.get('config'), event['error']))
+
+        if retval is None:
+            raise Exception("ERROR: The forker process is gone")
+
+        return retval
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class RunnerDaemon(object):
+    """
+    Long lived runner, which accepts jobs through a Unix socket. Once
+    the CPU budget allows it, each job is run through a JobForker, so it
+    inherits the parsed setup and the warmed caches. job_func and
+    warm_func are the ones of the JobForker.
+    """
+
+    def __init__(self, socket_path, cpu_budget, job_cpus, job_func, warm_func=None):
+        self.socket_path = socket_path
+        self.budget = CPUBudget(cpu_budget)
+        self.job_cpus = job_cpus
+        self.forker = JobForker(job_func, warm_func=warm_func)
+        self.server = None
+
+    def serve(self, job, fds, send_event):
+        send_event('queued', queued=self.budget.queued)
+        cpus = self.budget.acquire(self.job_cpus)
+
+        def started(pid):
+            logger.info("Job {} started (pid {}, {} cpus)".format(job.get('config'), pid, cpus))
+            send_event('started', pid=pid, cpus=cpus)
+
+        error = None
+        try:
+            retval = self.forker.run(job, fds, started=started)
+        except Exception as run_error:
+            error = str(run_error)
+        finally:
+            self.budget.release(cpus)
+
+        if error is not None:
+            logger.error("Job {} failed: {}".format(job.get('config'), error))
+            send_event('finished', retval=1, error=error)
+        else:
+            logger.info("Job {} finished (retval {})".format(job.get('config'), retval))
+            send_event('finished', retval=retval)
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            # A live daemon would answer
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.socket_path)
+                raise Exception("ERROR: Another daemon is listening on {}".format(self.socket_path))
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+
+        self.forker.start()
+        # Only the owner can connect, from the very creation of the socket
+        previous_umask = os.umask(0o077)
+        try:
+            self.server = _UnixServer(self.socket_path, _JobHandler)
+        except BaseException:
+            self.forker.close()
+            raise
+        finally:
+            os.umask(previous_umask)
+        self.server.daemon = self
+        logger.info("Runner daemon listening on {} (budget of {} cpus, {} per job)".format(self.socket_path, self.budget.total_cpus, self.job_cpus))
+        # So the socket is removed on termination
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.forker.close()
+
+def job_description(config, in_metadata, out_metadata, log_file=None, local=False):
+    """
+    The description of a job, which is run in the working directory
+    and with the environment of the caller
+    """
+    return {
+        'config': os.path.abspath(config),
+        'in_metadata': os.path.abspath(in_metadata),
+        'out_metadata': os.path.abspath(out_metadata),
+        'log_file': os.path.abspath(log_file)  if log_file  else None,
+        'local': local,
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+    }
+
+def submit_job(socket_path, config, in_metadata, out_metadata, log_file=None, local=False):
+    """
+    Sends a job to the daemon, and waits for it. The job output goes to
+    the stdout and stderr of the caller. It returns the job exit value.
+    Connection errors (OSError) are raised, so the caller can run the job
+    by itself. Once the job has been handed over, they are not, as the job
+    could be already running in the daemon.
+    """
+    job = job_description(config, in_metadata, out_metadata, log_file=log_file, local=local)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        send_message(sock, json.dumps(job).encode('utf-8'), [sys.stdout.fileno(), sys.stderr.fileno()])
+        try:
+            with sock.makefile(mode="r", encoding="utf-8") as events:
+                for line in events:
+                    event = json.loads(line)
+                    if event['event'] == 'finished':
+                        return event.get('retval', 1)
+                    logger.debug("Daemon job event: {}".format(line.strip()))
+        except OSError as error:
+            raise Exception("ERROR: Lost the connection to the runner daemon while the job was running: {}".format(error))
+
+    raise Exception("ERROR: The runner daemon closed the connection before the job finished")
@@ -0,0 +1,129 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import http.client
+import json
+import socket
+import urllib.parse
+
+# ------------------------------------------------------------------------------
+
+# Requests use the client timeout unless another one (None means no
+# timeout at all) is given
+_DEFAULT_TIMEOUT = object()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection through a Unix domain socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+class DockerEngineClient(object):
+    """
+    Minimal client of the Docker Engine API, so the most common image
+    queries do not need forking the docker command line
+    """
+
+    DEFAULT_SOCKET = '/var/run/docker.sock'
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, method, path, timeout=_DEFAULT_TIMEOUT):
+        conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout  if timeout is _DEFAULT_TIMEOUT  else timeout)
+        conn.request(method, path)
+        return conn, conn.getresponse()
+
+    def inspectImage(self, docker_tag):
+        """
+        It returns the image id, or None when the image is not locally available
+        """
+        conn, response = self._request('GET', '/images/{}/json'.format(urllib.parse.quote(docker_tag, safe='')))
+        try:
+            payload = response.read()
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                raise Exception("ERROR: Docker Engine API failed while inspecting image {} (status {}): {}".format(docker_tag, response.status, payload.decode('utf-8', 'replace')))
+
+            return json.loads(payload.decode('utf-8'))['Id']
+        finally:
+            conn.close()
+
+    def networkGateway(self, network='bridge'):
+        """
+        It returns the IPv4 gateway of a docker network (the address of
+        the host inside it), or None when it has none
+        """
+        conn, response = self._request('GET', '/networks/{}'.format(urllib.parse.quote(network, safe='')))
+        try:
+            payload = response.read()
+            if response.status != 200:
+                raise Exception("ERROR: Docker Engine API failed while inspecting network {} (status {}): {}".format(network, response.status, payload.decode('utf-8', 'replace')))
+
+            ipam_configs = (json.loads(payload.decode('utf-8')).get('IPAM') or {}).get('Config') or []
+            for ipam_config in ipam_configs:
+                gateway = ipam_config.get('Gateway')
+                if gateway and ':' not in gateway:
+                    return gateway
+            return None
+        finally:
+            conn.close()
+
+    def pullImage(self, docker_tag):
+        """
+        Pulls an image, waiting for the progress stream to finish
+        """
+        # The tag is the suffix after the last colon, unless it is
+        # the port of a registry
+        image_name, _, image_tag = docker_tag.rpartition(':')
+        if image_name == '' or '/' in image_tag:
+            image_name = docker_tag
+            image_tag = 'latest'
+
+        query = urllib.parse.urlencode({'fromImage': image_name, 'tag': image_tag})
+        # Pulls can take a long time
+        conn, response = self._request('POST', '/images/create?' + query, timeout=None)
+        try:
+            if response.status != 200:
+                raise Exception("ERROR: Docker Engine API failed while pulling image {} (status {}): {}".format(docker_tag, response.status, response.read().decode('utf-8', 'replace')))
+
+            # Errors are reported in the middle of the progress stream
+            for line in response:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    progress = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if 'error' in progress:
+                    raise Exception("ERROR: Docker Engine API failed while pulling image {}: {}".format(docker_tag, progress['error']))
+        finally:
+            conn.close()
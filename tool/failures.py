@@ -0,0 +1,103 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import re
+
+# ------------------------------------------------------------------------------
+
+# Failures which can vanish by themselves, so it is worth retrying
+FAILURE_TRANSIENT = 'transient'
+# Failures which are going to happen again on each retry
+FAILURE_DETERMINISTIC = 'deterministic'
+# Failures which could not be classified
+FAILURE_UNKNOWN = 'unknown'
+
+# Exit codes of 'docker run' and the shell
+EXIT_CODE_CLASSES = {
+    # The docker daemon failed (image, mount or network setup)
+    125: (FAILURE_TRANSIENT, 'docker daemon error'),
+    # The command inside the container could not be invoked or found
+    126: (FAILURE_DETERMINISTIC, 'command not executable'),
+    127: (FAILURE_DETERMINISTIC, 'command not found'),
+    # Interrupted by the user
+    130: (FAILURE_DETERMINISTIC, 'interrupted'),
+}
+
+# Nextflow log patterns. A task wrapper which cannot be found means the
+# launch directory was not visible through the bind mounts (it happens
+# on NFS), and Nextflow reports it as a process error, so these ones
+# are checked first. Task outputs which are not visible yet on NFS or
+# remote filesystems are also reported as missing
+# https://forums.docker.com/t/any-known-problems-with-symlinks-on-bind-mounts/32138
+LAUNCH_DIR_PATTERNS = [
+    (re.compile(r"\.command\.(?:run|sh|begin)'?: No such file or directory"), 'task wrapper not visible (bind mount or NFS race)'),
+    (re.compile(r"Process `[^`]+` terminated for an unknown reason"), 'task exit status not visible (bind mount or NFS race)'),
+    (re.compile(r"Missing output file\(s\)"), 'task outputs not visible (NFS or remote filesystem race)'),
+]
+
+# Then, the failures coming from the workflow itself, which are going
+# to happen again (even when they mention missing files)
+DETERMINISTIC_PATTERNS = [
+    (re.compile(r"Script compilation error|No such variable|Unknown method invocation|Unknown config attribute|Invalid method invocation"), 'workflow script error'),
+    (re.compile(r"Not a valid params file|Cannot parse params file|Unknown parameter"), 'invalid parameters'),
+    (re.compile(r"Process `[^`]+` terminated with an error exit status"), 'process error'),
+    (re.compile(r"Unknown (?:process|workflow) `|Missing workflow definition|Cannot find a component with name"), 'workflow definition error'),
+    (re.compile(r"Unknown profile|Unknown configuration profile"), 'unknown profile'),
+]
+
+# Last, the infrastructure failures. Only Nextflow itself (not the
+# tasks) reports missing files as NoSuchFileException, while staging
+TRANSIENT_PATTERNS = [
+    (re.compile(r"NoSuchFileException|Can't stage file|Cannot stage file"), 'file not visible while staging (bind mount or NFS race)'),
+    (re.compile(r"Stale file handle|Input/output error|Resource temporarily unavailable"), 'filesystem error'),
+    (re.compile(r"Too many open files"), 'resources exhausted'),
+    (re.compile(r"Error response from daemon|Cannot connect to the Docker daemon|TLS handshake timeout|toomanyrequests"), 'docker daemon error'),
+    (re.compile(r"Connection (?:refused|reset|timed out)|SocketTimeoutException|UnknownHostException"), 'network error'),
+    (re.compile(r"Unable to acquire lock|LockObtainFailedException"), 'lock contention'),
+]
+
+# Only the end of the log tells why the execution failed
+LOG_TAIL_SIZE = 64 * 1024
+
+def read_log_tail(log_path, tail_size=LOG_TAIL_SIZE):
+    try:
+        with open(log_path, mode="rb") as lH:
+            lH.seek(0, os.SEEK_END)
+            log_size = lH.tell()
+            lH.seek(max(0, log_size - tail_size))
+            return lH.read().decode('utf-8', 'replace')
+    except OSError:
+        return ''
+
+def classify_failure(retval, log_path=None):
+    """
+    Classifies a failed execution from its exit code and the tail of
+    its Nextflow log. It returns a tuple with the failure class and a
+    short reason.
+    """
+    if retval in EXIT_CODE_CLASSES:
+        return EXIT_CODE_CLASSES[retval]
+
+    log_tail = read_log_tail(log_path)  if log_path  else ''
+    for patterns, failure_class in ((LAUNCH_DIR_PATTERNS, FAILURE_TRANSIENT), (DETERMINISTIC_PATTERNS, FAILURE_DETERMINISTIC), (TRANSIENT_PATTERNS, FAILURE_TRANSIENT)):
+        for pattern, reason in patterns:
+            if pattern.search(log_tail) is not None:
+                return failure_class, reason
+
+    return FAILURE_UNKNOWN, 'exit code {}'.format(retval)
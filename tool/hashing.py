@@ -0,0 +1,256 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import logger
+
+# ------------------------------------------------------------------------------
+
+DIGEST_ALGORITHM = 'sha256'
+CHUNK_SIZE = 4 * 1024 * 1024
+
+def file_digest(file_path):
+    with open(file_path, mode="rb", buffering=0) as fH:
+        if hasattr(hashlib, 'file_digest'):
+            # Large buffer reads, without intermediate copies
+            return hashlib.file_digest(fH, DIGEST_ALGORITHM).hexdigest()
+
+        h = hashlib.new(DIGEST_ALGORITHM)
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            size = fH.readinto(buf)
+            if not size:
+                break
+            h.update(view[:size])
+
+    return h.hexdigest()
+
+def _tree_entries(path):
+    """
+    The entries of a directory tree, in a stable order, as tuples of
+    kind ('F' for files, 'L' for symlinks), relative and absolute path
+    """
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        rel_root = os.path.relpath(root, path)
+        for entry_name in sorted(files + [dir_name for dir_name in dirs if os.path.islink(os.path.join(root, dir_name))]):
+            entry_path = os.path.join(root, entry_name)
+            rel_path = os.path.normpath(os.path.join(rel_root, entry_name))
+            entries.append(('L'  if os.path.islink(entry_path)  else 'F', rel_path, entry_path))
+
+    return entries
+
+def _tree_digest(entries, file_digests):
+    """
+    Digest of a directory tree, from the relative paths, symlink
+    targets and file digests of its entries
+    """
+    h = hashlib.new(DIGEST_ALGORITHM)
+    for kind, rel_path, entry_path in entries:
+        if kind == 'L':
+            h.update("L {} {}\n".format(rel_path, os.readlink(entry_path)).encode('utf-8'))
+        else:
+            h.update("F {} {}\n".format(rel_path, file_digests[entry_path]).encode('utf-8'))
+
+    return h.hexdigest()
+
+def path_digest(path):
+    """
+    Digest of the contents of a file, or of a whole directory tree (the
+    relative paths, symlink targets and file digests, in a stable order)
+    """
+    if not os.path.isdir(path):
+        return file_digest(path)
+
+    entries = _tree_entries(path)
+    return _tree_digest(entries, {
+        entry_path: file_digest(entry_path)
+        for kind, _, entry_path in entries
+        if kind == 'F'
+    })
+
+def key_digest(**components):
+    """
+    Digest of a set of JSON serializable values, used as a cache key
+    """
+    return hashlib.new(DIGEST_ALGORITHM, json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+class DigestCache(object):
+    """
+    Persistent cache of file digests, shared by the concurrent jobs
+    through an SQLite database. A digest is valid while the path keeps
+    its size, modification time and inode. The entries which have not
+    been used for max_age seconds are forgotten.
+    """
+
+    DEFAULT_MAX_AGE = 30 * 86400
+
+    def __init__(self, db_path, max_age=DEFAULT_MAX_AGE):
+        self.db_path = db_path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        try:
+            with self.lock:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS digests (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+        except:
+            self.conn.close()
+            raise
+        self.pruned = False
+
+    def get(self, path, st):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT digest FROM digests WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ? AND algorithm = ?",
+                (path, st.st_size, st.st_mtime_ns, st.st_ino, DIGEST_ALGORITHM)
+            ).fetchone()
+
+        return row[0]  if row  else None
+
+    def treeSize(self, dir_path):
+        """
+        Total size of the files under dir_path whose digests are
+        cached, or None when none of them is
+        """
+        dir_prefix = dir_path.rstrip('/') + '/'
+        with self.lock:
+            row = self.conn.execute(
+                # The prefix range is answered through the primary key
+                "SELECT COUNT(*), SUM(size) FROM digests WHERE path >= ? AND path < ? AND algorithm = ?",
+                (dir_prefix, dir_prefix[:-1] + '0', DIGEST_ALGORITHM)
+            ).fetchone()
+
+        return row[1]  if row[0] > 0  else None
+
+    def update(self, records, used_paths=()):
+        """
+        Stores the new digests, given as (path, stat, digest) tuples, and
+        refreshes the usage time of the already known paths
+        """
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO digests (path, size, mtime_ns, inode, algorithm, digest, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (path, st.st_size, st.st_mtime_ns, st.st_ino, DIGEST_ALGORITHM, digest, now)
+                        for path, st, digest in records
+                    ]
+                )
+                self.conn.executemany(
+                    "UPDATE digests SET last_used = ? WHERE path = ?",
+                    [(now, path) for path in used_paths]
+                )
+                if not self.pruned and self.max_age:
+                    self.conn.execute("DELETE FROM digests WHERE last_used < ?", (now - self.max_age,))
+                    self.pruned = True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class Hasher(object):
+    """
+    Computes the digests of files and directory trees, hashing all their
+    files concurrently with a thread pool (hashlib releases the GIL). The
+    digests of unchanged files are taken from the digest cache (if any).
+    """
+
+    def __init__(self, cache=None, workers=0):
+        self.cache = cache
+        self.workers = workers  if workers > 0  else min(8, os.cpu_count() or 1)
+
+    def _fileDigest(self, file_path):
+        """
+        It returns the digest of the file, and the stat to be cached
+        when it was computed (None otherwise)
+        """
+        st = os.stat(file_path)
+        if self.cache is not None:
+            try:
+                digest = self.cache.get(file_path, st)
+            except sqlite3.Error as error:
+                logger.debug("Digest cache lookup failed for {}: {}".format(file_path, error))
+                digest = None
+            if digest is not None:
+                return digest, None
+
+        return file_digest(file_path), st
+
+    def digests(self, paths):
+        """
+        Digests of several files or directory trees, by path, sharing
+        the same pool for all their files. It also returns the number
+        of bytes which had to be read
+        """
+        trees = {}
+        file_paths = set()
+        for path in paths:
+            if os.path.isdir(path):
+                trees[path] = _tree_entries(path)
+                file_paths.update(entry_path for kind, _, entry_path in trees[path] if kind == 'F')
+            else:
+                file_paths.add(path)
+
+        file_digests = {}
+        new_records = []
+        cached_paths = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="vre-hash") as hash_pool:
+            futures = {
+                hash_pool.submit(self._fileDigest, file_path): file_path
+                for file_path in file_paths
+            }
+            for future in concurrent.futures.as_completed(futures):
+                file_path = futures[future]
+                digest, st = future.result()
+                file_digests[file_path] = digest
+                if st is None:
+                    cached_paths.append(file_path)
+                else:
+                    new_records.append((file_path, st, digest))
+
+        if self.cache is not None:
+            try:
+                self.cache.update(new_records, cached_paths)
+            except sqlite3.Error as error:
+                logger.warning("Unable to update digest cache {}: {}".format(self.cache.db_path, error))
+
+        path_digests = {
+            path: _tree_digest(trees[path], file_digests)  if path in trees  else file_digests[path]
+            for path in paths
+        }
+        return path_digests, sum(st.st_size for _, st, _ in new_records)
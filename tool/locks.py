@@ -0,0 +1,90 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import fcntl
+import os
+
+# ------------------------------------------------------------------------------
+
+class FileLock(object):
+    """
+    Advisory lock based on fcntl.flock over a lock file, which is shared
+    by all the processes in the same host. The lock is automatically
+    released when the process holding it dies.
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lock_fh = None
+        self.shared = None
+
+    def acquire(self, shared=False, blocking=True):
+        """
+        Acquires (or converts) the lock. When it is not blocking, it
+        returns False if the lock could not be obtained. Conversions
+        are not atomic (flock drops the held lock first), so a failed
+        conversion leaves the lock released
+        """
+        if self.lock_fh is None:
+            self.lock_fh = open(self.lock_path, mode="a+")
+
+        flags = fcntl.LOCK_SH  if shared  else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(self.lock_fh.fileno(), flags)
+        except BlockingIOError:
+            self.lock_fh.close()
+            self.lock_fh = None
+            self.shared = None
+            return False
+
+        self.shared = shared
+        return True
+
+    def release(self):
+        if self.lock_fh is not None:
+            try:
+                fcntl.flock(self.lock_fh.fileno(), fcntl.LOCK_UN)
+            finally:
+                self.lock_fh.close()
+                self.lock_fh = None
+                self.shared = None
+
+    @property
+    def locked(self):
+        return self.lock_fh is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def atomic_write(dest_path, content):
+    """
+    Writes the content to a temporary file, which is renamed to its
+    final destination, so readers never see a partially written file
+    """
+    tmp_path = "{}.tmp-{}".format(dest_path, os.getpid())
+    with open(tmp_path, mode="w", encoding="utf-8") as tH:
+        tH.write(content)
+    os.replace(tmp_path, dest_path)
@@ -0,0 +1,199 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+
+from utils import logger
+
+from tool.locks import FileLock, atomic_write
+from tool.cache_index import CacheIndex, tree_size
+from tool.placement import FilePlacer
+from tool.archiver import rebase_archive
+
+# ------------------------------------------------------------------------------
+
+class MemoEntry(object):
+    """
+    The stored outputs of a successful job. Each output is kept under
+    the name of its role (tar_view, metrics, ...), and the report images
+    under their original names. The entry is read under a shared lock,
+    which must be released once it has been published. The archives
+    record the base directory of their entries, so it can be replaced
+    by the one of the job they are published to.
+    """
+
+    OUTPUTS_DIRNAME = 'outputs'
+    IMAGES_DIRNAME = 'images'
+
+    def __init__(self, basedir, key, file_placer):
+        self.key = key
+        self.file_placer = file_placer
+        self.path = os.path.join(basedir, key)
+        self.ready_path = self.path + MemoStore.READY_SUFFIX
+        self.lock = FileLock(self.path + '.lock')
+        self.manifest = None
+
+    def publish(self, role_paths, images_dir, rebases=None):
+        """
+        Places the stored outputs at the paths of their roles, and the
+        report images inside images_dir. rebases maps the roles of the
+        archives to their new base directory and archive setup. It
+        returns the paths of the placed images
+        """
+        stored_bases = self.manifest.get('bases', {})
+        for role, dest_path in role_paths.items():
+            if role in self.manifest['outputs'] and dest_path is not None:
+                stored_path = os.path.join(self.path, self.OUTPUTS_DIRNAME, role)
+                new_base, spec = (rebases or {}).get(role, (None, None))
+                if new_base is not None and stored_bases.get(role) not in (None, new_base):
+                    if os.path.lexists(dest_path):
+                        os.unlink(dest_path)
+                    rebase_archive(stored_path, dest_path, stored_bases[role], new_base, spec)
+                else:
+                    self.file_placer.place(stored_path, dest_path)
+
+        images_file_paths = []
+        for image_name in self.manifest['images']:
+            image_path = os.path.join(images_dir, image_name)
+            self.file_placer.place(os.path.join(self.path, self.IMAGES_DIRNAME, image_name), image_path)
+            images_file_paths.append(image_path)
+
+        return images_file_paths
+
+    def release(self):
+        self.lock.release()
+
+class MemoStore(object):
+    """
+    Store of the outputs of successful jobs, keyed by the workflow commit,
+    the Nextflow version, the normalized parameters and the digests of the
+    inputs, so an identical submission publishes them without running the
+    workflow. The least recently used entries are evicted when the store
+    is larger than max_size. The outputs are never hardlinked, so changes
+    made by a job to its published files do not alter the store.
+    """
+
+    READY_SUFFIX = '.ready'
+
+    def __init__(self, basedir, file_placer, max_size=None):
+        self.basedir = basedir
+        self.file_placer = FilePlacer([strategy for strategy in file_placer.strategies if strategy != 'link'])
+        self.max_size = max_size
+        self.index = CacheIndex(os.path.join(basedir, 'memo-index.json'))
+
+    def lookup(self, key):
+        """
+        It returns the entry (locked in shared mode), or None on misses
+        """
+        entry = MemoEntry(self.basedir, key, self.file_placer)
+        if not os.path.exists(entry.ready_path):
+            return None
+
+        entry.lock.acquire(shared=True)
+        try:
+            # It could have been evicted meanwhile
+            with open(entry.ready_path, mode="r", encoding="utf-8") as rH:
+                entry.manifest = json.load(rH)
+        except (OSError, ValueError):
+            entry.release()
+            return None
+
+        try:
+            self.index.touch(key)
+        except Exception as error:
+            logger.warning("Unable to update memoization index: "+str(error))
+
+        return entry
+
+    def store(self, key, role_paths, images_file_paths=(), bases=None, **info):
+        """
+        Stores the outputs of a job, given the path of each role, its
+        report images and the base directory of each archive role
+        """
+        entry = MemoEntry(self.basedir, key, self.file_placer)
+        os.makedirs(self.basedir, exist_ok=True)
+        entry.lock.acquire()
+        try:
+            if os.path.exists(entry.ready_path):
+                return
+
+            tmp_path = tempfile.mkdtemp(prefix=".tmp-memo-", dir=self.basedir)
+            try:
+                outputs_dir = os.path.join(tmp_path, MemoEntry.OUTPUTS_DIRNAME)
+                images_dir = os.path.join(tmp_path, MemoEntry.IMAGES_DIRNAME)
+                os.mkdir(outputs_dir)
+                os.mkdir(images_dir)
+
+                stored_roles = []
+                for role, src_path in role_paths.items():
+                    if src_path is not None and os.path.isfile(src_path):
+                        self.file_placer.place(src_path, os.path.join(outputs_dir, role), verbose=False)
+                        stored_roles.append(role)
+
+                stored_images = []
+                for image_path in images_file_paths:
+                    image_name = os.path.basename(image_path)
+                    if image_name not in stored_images:
+                        self.file_placer.place(image_path, os.path.join(images_dir, image_name), verbose=False)
+                        stored_images.append(image_name)
+
+                shutil.rmtree(entry.path, True)
+                os.rename(tmp_path, entry.path)
+            except:
+                shutil.rmtree(tmp_path, True)
+                raise
+
+            manifest = {
+                'outputs': stored_roles,
+                'images': stored_images,
+                'bases': bases or {},
+            }
+            manifest.update(info)
+            atomic_write(entry.ready_path, json.dumps(manifest))
+        finally:
+            entry.release()
+
+        logger.info("Memoized outputs of the job as {}".format(key))
+        try:
+            self.index.touch(key, size=tree_size(entry.path), hit=False, **info)
+            self.prune()
+        except Exception as error:
+            logger.warning("Unable to update memoization index: "+str(error))
+
+    def _evict(self, key, entry_info):
+        entry = MemoEntry(self.basedir, key, self.file_placer)
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if os.path.exists(entry.ready_path):
+                os.unlink(entry.ready_path)
+            shutil.rmtree(entry.path, True)
+        finally:
+            entry.release()
+
+        logger.info("Evicted memoized job {} ({})".format(key, entry_info.get('uri')))
+        return True
+
+    def prune(self, max_size=None):
+        if max_size is None:
+            max_size = self.max_size
+
+        return self.index.evict(max_size, self._evict)
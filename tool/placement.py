@@ -0,0 +1,120 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import errno
+import fcntl
+import os
+import shutil
+import threading
+
+from utils import logger
+
+# ------------------------------------------------------------------------------
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+# Strategies, from the cheapest to the most expensive one
+PLACEMENT_STRATEGIES = ('link', 'reflink', 'copy_file_range', 'copy')
+
+def _place_link(src, dest):
+    os.link(src, dest)
+
+def _place_reflink(src, dest):
+    with open(src, mode="rb") as srcH, open(dest, mode="wb") as destH:
+        fcntl.ioctl(destH.fileno(), FICLONE, srcH.fileno())
+
+def _place_copy_file_range(src, dest):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError("copy_file_range is not available")
+
+    with open(src, mode="rb") as srcH, open(dest, mode="wb") as destH:
+        while True:
+            copied = os.copy_file_range(srcH.fileno(), destH.fileno(), 1 << 30)
+            if copied == 0:
+                break
+
+def _place_copy(src, dest):
+    shutil.copyfile(src, dest)
+
+# These errors depend on the pair of filesystems, not on the file
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+}
+
+PLACEMENT_FUNCS = {
+    'link': _place_link,
+    'reflink': _place_reflink,
+    'copy_file_range': _place_copy_file_range,
+    'copy': _place_copy,
+}
+
+class FilePlacer(object):
+    """
+    It places a file in a new location avoiding byte copies when it is
+    possible. Hardlinks are tried first, then reflinks (FICLONE), then
+    in-kernel copies (copy_file_range) and, last, a plain byte copy.
+    The strategies failing between two filesystems are remembered,
+    so they are not tried again.
+    """
+
+    def __init__(self, strategies=PLACEMENT_STRATEGIES):
+        for strategy in strategies:
+            if strategy not in PLACEMENT_FUNCS:
+                raise Exception("ERROR: Unknown placement strategy '{}'. Valid ones are {}".format(strategy, ', '.join(PLACEMENT_STRATEGIES)))
+        self.strategies = tuple(strategies)
+        self.failed = {}
+        self.lock = threading.Lock()
+
+    def place(self, src, dest, verbose=True):
+        """
+        It places src at dest (overwriting it), returning the used strategy
+        """
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        dev_pair = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dest))).st_dev)
+        with self.lock:
+            failed = self.failed.setdefault(dev_pair, set())
+            candidates = [strategy for strategy in self.strategies if strategy not in failed]
+
+        # The last resort is always available
+        if 'copy' not in candidates:
+            candidates.append('copy')
+
+        for strategy in candidates:
+            try:
+                PLACEMENT_FUNCS[strategy](src, dest)
+            except OSError as error:
+                if strategy == 'copy':
+                    raise
+                logger.debug("Placement strategy {} failed for {}: {}".format(strategy, dest, error))
+                if os.path.lexists(dest):
+                    os.unlink(dest)
+                if error.errno is None or error.errno in UNSUPPORTED_ERRNOS:
+                    with self.lock:
+                        failed.add(strategy)
+                continue
+
+            (logger.info  if verbose  else logger.debug)("Placed {} at {} ({})".format(src, dest, strategy))
+            return strategy
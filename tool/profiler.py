@@ -0,0 +1,141 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+
+from tool.locks import atomic_write
+
+# ------------------------------------------------------------------------------
+
+# Number of subprocesses launched by this process, counted through
+# the 'subprocess.Popen' audit event
+_SUBPROCESS_COUNT = 0
+_HOOK_INSTALLED = False
+_HOOK_LOCK = threading.Lock()
+
+def _audit_hook(event, args):
+    global _SUBPROCESS_COUNT
+    if event == 'subprocess.Popen':
+        with _HOOK_LOCK:
+            _SUBPROCESS_COUNT += 1
+
+def _install_hook():
+    global _HOOK_INSTALLED
+    with _HOOK_LOCK:
+        if not _HOOK_INSTALLED:
+            # Audit hooks cannot be removed, so it is installed only once
+            sys.addaudithook(_audit_hook)
+            _HOOK_INSTALLED = True
+
+def subprocess_count():
+    return _SUBPROCESS_COUNT
+
+class PhaseProfiler(object):
+    """
+    Lightweight span recorder for the phases of a job. Each span keeps
+    its monotonic start (relative to the profiler creation) and elapsed
+    time, the bytes it processed (when they are known) and the number of
+    subprocesses launched by the whole process while it was open.
+    """
+
+    def __init__(self):
+        _install_hook()
+        self.t0 = time.monotonic()
+        self.started_at = time.time()
+        self.base_subprocesses = subprocess_count()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def begin(self, name, **info):
+        span = {
+            'name': name,
+            'thread': threading.current_thread().name,
+            'start': time.monotonic() - self.t0,
+            '_subprocesses': subprocess_count(),
+        }
+        span.update(info)
+        return span
+
+    def end(self, span, **info):
+        span['elapsed'] = time.monotonic() - self.t0 - span['start']
+        span['subprocesses'] = subprocess_count() - span.pop('_subprocesses')
+        span.update(info)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **info):
+        """
+        Context manager around a phase. The yielded span can be enriched
+        (for instance, with the processed 'bytes')
+        """
+        span = self.begin(name, **info)
+        try:
+            yield span
+        except BaseException as error:
+            span['error'] = type(error).__name__
+            raise
+        finally:
+            self.end(span)
+
+    def wrap(self, name, func, **info):
+        """
+        It returns a version of func which runs inside a span
+        """
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            with self.span(name, **info):
+                return func(*args, **kwargs)
+        return profiled
+
+    def summary(self):
+        """
+        The recorded spans, plus their aggregation by phase name
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+
+        phases = {}
+        for span in spans:
+            phase = phases.setdefault(span['name'], {
+                'count': 0,
+                'elapsed': 0.0,
+                'bytes': 0,
+                'subprocesses': 0,
+            })
+            phase['count'] += 1
+            phase['elapsed'] += span['elapsed']
+            phase['bytes'] += span.get('bytes', 0) or 0
+            phase['subprocesses'] += span['subprocesses']
+
+        return {
+            'started_at': self.started_at,
+            'elapsed': time.monotonic() - self.t0,
+            'subprocesses': subprocess_count() - self.base_subprocesses,
+            'phases': phases,
+            'spans': spans,
+        }
+
+    def write(self, profile_path):
+        atomic_write(profile_path, json.dumps(self.summary(), indent=1, sort_keys=True))
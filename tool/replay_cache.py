@@ -0,0 +1,181 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+
+from utils import logger
+
+from tool.locks import FileLock, atomic_write
+from tool.cache_index import CacheIndex, tree_size
+from tool.hashing import file_digest
+
+# ------------------------------------------------------------------------------
+
+class ReplayCache(object):
+    """
+    Cache of extracted workflow archives, keyed by the hash of the
+    archive. Each archive is extracted only once, in a read-only
+    location, and each replay gets its own view of it, where files are
+    placed without copies, except the ones which are going to be modified.
+    """
+
+    READY_SUFFIX = '.ready'
+
+    def __init__(self, basedir, file_placer, max_size=None):
+        self.basedir = basedir
+        self.file_placer = file_placer
+        self.max_size = max_size
+        self.index = CacheIndex(os.path.join(basedir, 'replay-index.json'))
+
+    @staticmethod
+    def digestArchive(archive_path):
+        return file_digest(archive_path)
+
+    def _extract(self, archive_path, extract_dir):
+        """
+        Extracts the archive in a temporary directory, which is
+        renamed once it is complete. It returns the relative path
+        of the workflow root
+        """
+        tmp_extract_dir = tempfile.mkdtemp(prefix=".tmp-replay-", dir=self.basedir)
+        try:
+            rel_root = ''
+            with tarfile.open(archive_path, mode='r:*', bufsize=1024*1024) as tar:
+                first_member = tar.next()
+                if first_member is not None:
+                    if first_member.isdir():
+                        rel_root = first_member.name
+                    tar.extractall(path=tmp_extract_dir)
+
+            # Shared files must not be modified through the views
+            for root, dirs, files in os.walk(tmp_extract_dir):
+                for file_name in files:
+                    file_path = os.path.join(root, file_name)
+                    file_stat = os.lstat(file_path)
+                    if stat.S_ISREG(file_stat.st_mode):
+                        os.chmod(file_path, stat.S_IMODE(file_stat.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+            os.rename(tmp_extract_dir, extract_dir)
+        except:
+            shutil.rmtree(tmp_extract_dir, True)
+            raise
+
+        return rel_root
+
+    def materialize(self, archive_path, destdir, private_relpaths=(), digest=None):
+        """
+        It returns the path to the replay view of the archive, created
+        inside destdir. Files in private_relpaths (relative to the
+        workflow root) are copied, so they can be modified. The archive
+        is only hashed when its digest is not provided.
+        """
+        os.makedirs(self.basedir, exist_ok=True)
+        if digest is None:
+            digest = self.digestArchive(archive_path)
+        extract_dir = os.path.join(self.basedir, digest)
+        ready_path = extract_dir + self.READY_SUFFIX
+
+        extract_lock = FileLock(extract_dir + '.lock')
+        extract_lock.acquire(shared=True)
+        try:
+            extracted = False
+            if not os.path.exists(ready_path):
+                extract_lock.acquire(shared=False)
+                if not os.path.exists(ready_path):
+                    if os.path.lexists(extract_dir):
+                        shutil.rmtree(extract_dir, True)
+                    logger.info("Extracting workflow archive {} in replay cache".format(archive_path))
+                    rel_root = self._extract(archive_path, extract_dir)
+                    atomic_write(ready_path, json.dumps({
+                        'archive': archive_path,
+                        'root': rel_root,
+                    }))
+                    extracted = True
+                extract_lock.acquire(shared=True)
+
+            with open(ready_path, mode="r", encoding="utf-8") as rH:
+                rel_root = json.load(rH)['root']
+
+            view_dir = os.path.join(destdir, rel_root)  if rel_root  else destdir
+            self.buildView(os.path.join(extract_dir, rel_root), view_dir, private_relpaths)
+        finally:
+            extract_lock.release()
+
+        try:
+            self.index.touch(digest, size=tree_size(extract_dir)  if extracted  else None, archive=archive_path)
+            if extracted:
+                self.prune()
+        except Exception as error:
+            logger.warning("Unable to update replay cache index: "+str(error))
+
+        return view_dir
+
+    def buildView(self, src_root, view_root, private_relpaths=()):
+        """
+        Mirrors the src_root tree at view_root, placing the files
+        without byte copies when it is possible
+        """
+        private_paths = set(os.path.normpath(os.path.join(view_root, rel_path)) for rel_path in private_relpaths)
+
+        os.makedirs(view_root, exist_ok=True)
+        for root, dirs, files in os.walk(src_root):
+            rel_root = os.path.relpath(root, src_root)
+            view_dir = os.path.normpath(os.path.join(view_root, rel_root))
+            for dir_name in dirs:
+                src_path = os.path.join(root, dir_name)
+                view_path = os.path.join(view_dir, dir_name)
+                if os.path.islink(src_path):
+                    os.symlink(os.readlink(src_path), view_path)
+                else:
+                    os.mkdir(view_path)
+            for file_name in files:
+                src_path = os.path.join(root, file_name)
+                view_path = os.path.join(view_dir, file_name)
+                if os.path.islink(src_path):
+                    os.symlink(os.readlink(src_path), view_path)
+                elif view_path in private_paths:
+                    shutil.copy2(src_path, view_path)
+                    os.chmod(view_path, stat.S_IMODE(os.stat(view_path).st_mode) | stat.S_IWUSR)
+                else:
+                    self.file_placer.place(src_path, view_path, verbose=False)
+
+    def _evict(self, digest, entry):
+        extract_dir = os.path.join(self.basedir, digest)
+        extract_lock = FileLock(extract_dir + '.lock')
+        if not extract_lock.acquire(blocking=False):
+            return False
+        try:
+            if os.path.exists(extract_dir + self.READY_SUFFIX):
+                os.unlink(extract_dir + self.READY_SUFFIX)
+            shutil.rmtree(extract_dir, True)
+        finally:
+            extract_lock.release()
+
+        logger.info("Evicted replay cache entry {} ({})".format(digest, entry.get('archive')))
+        return True
+
+    def prune(self, max_size=None):
+        if max_size is None:
+            max_size = self.max_size
+
+        return self.index.evict(max_size, self._evict)
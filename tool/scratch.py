@@ -0,0 +1,292 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import atexit
+import collections
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from utils import logger
+
+from tool.locks import FileLock
+from tool.cache_index import format_size, parse_size
+
+# ------------------------------------------------------------------------------
+
+JOB_PREFIX = 'vre-'
+JOB_SUFFIX = '-job'
+
+# Freshly created job directories are not locked yet
+REAP_GRACE_PERIOD = 60
+
+# Where the working directories and open files of the processes are found
+PROC_DIR = '/proc'
+
+# The job scratch directories alive in this process
+_ACTIVE_SCRATCHES = set()
+_ACTIVE_LOCK = threading.Lock()
+_HANDLERS_INSTALLED = False
+_PREVIOUS_HANDLERS = {}
+
+# A place where job scratch directories can be created, which must
+# keep at least min_free bytes available
+ScratchTier = collections.namedtuple('ScratchTier', ['path', 'min_free'])
+
+def parse_scratch_tiers(tiers_str):
+    """
+    Parses the declaration of the scratch tiers, one per line, from the
+    most preferred to the least one: the path and, optionally, the free
+    space which has to be kept in it (like 50G)
+    """
+    tiers = []
+    for line in tiers_str.splitlines():
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        tokens = line.split()
+        if len(tokens) > 2:
+            raise Exception("ERROR: Unable to parse scratch tier '{}'".format(line))
+        tiers.append(ScratchTier(
+            path=os.path.abspath(os.path.expanduser(tokens[0])),
+            min_free=(parse_size(tokens[1]) or 0)  if len(tokens) > 1  else 0,
+        ))
+
+    return tiers
+
+def _free_space(path):
+    # The tier directory could not exist yet
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    return shutil.disk_usage(path).free
+
+def choose_scratch_tier(tiers, needed_size=0):
+    """
+    It returns the first tier where the job fits, keeping its minimum
+    free space. When no tier is suitable, the one with the largest
+    free space is returned.
+    """
+    best_tier = None
+    best_free = -1
+    for tier in tiers:
+        try:
+            free = _free_space(tier.path)
+        except OSError as error:
+            logger.warning("Scratch tier {} is not usable: {}".format(tier.path, error))
+            continue
+
+        if free - needed_size >= tier.min_free:
+            logger.debug("Scratch tier {} chosen ({} free, {} estimated)".format(tier.path, format_size(free), format_size(needed_size)))
+            return tier
+
+        if free > best_free:
+            best_tier = tier
+            best_free = free
+
+    if best_tier is None:
+        raise Exception("ERROR: None of the scratch tiers is usable")
+
+    logger.warning("No scratch tier can hold {} keeping its minimum free space. Using {} ({} free)".format(format_size(needed_size), best_tier.path, format_size(best_free)))
+    return best_tier
+
+def _cleanup_active():
+    with _ACTIVE_LOCK:
+        scratches = list(_ACTIVE_SCRATCHES)
+    for scratch in scratches:
+        scratch.cleanup()
+
+def _signal_cleanup(signum, frame):
+    _cleanup_active()
+    # The original behaviour is restored and the signal delivered again
+    previous = _PREVIOUS_HANDLERS.get(signum, signal.SIG_DFL)
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+def _install_handlers():
+    global _HANDLERS_INSTALLED
+    if _HANDLERS_INSTALLED:
+        return
+
+    atexit.register(_cleanup_active)
+    # Signal handlers can only be set from the main thread
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(signum)
+            if previous is signal.SIG_IGN:
+                continue
+            _PREVIOUS_HANDLERS[signum] = previous
+            signal.signal(signum, _signal_cleanup)
+    _HANDLERS_INSTALLED = True
+
+class JobScratch(object):
+    """
+    The scratch directory of a single job, with a fixed layout:
+
+        <scratch root>/vre-<random>-job/
+            .lock        held (flock) while the job is alive
+            workflow/    the workflow view used by the job
+            nf-workdir/  the Nextflow working directory
+
+    It is removed when the job finishes, fails, or the process exits or
+    is terminated. Directories left by crashed jobs are unlocked, so
+    they are removed by reap_scratch.
+    """
+
+    LOCK_FILENAME = '.lock'
+    WORKFLOW_DIRNAME = 'workflow'
+    WORKDIR_DIRNAME = 'nf-workdir'
+
+    def __init__(self, scratch_root):
+        os.makedirs(scratch_root, exist_ok=True)
+        _install_handlers()
+
+        self.path = tempfile.mkdtemp(prefix=JOB_PREFIX, suffix=JOB_SUFFIX, dir=scratch_root)
+        self.lock = FileLock(os.path.join(self.path, self.LOCK_FILENAME))
+        if not self.lock.acquire(blocking=False):
+            shutil.rmtree(self.path, True)
+            raise Exception("ERROR: Unable to lock job scratch directory {}".format(self.path))
+
+        with _ACTIVE_LOCK:
+            _ACTIVE_SCRATCHES.add(self)
+
+        self.workflow_dir = os.path.join(self.path, self.WORKFLOW_DIRNAME)
+        self.workdir = os.path.join(self.path, self.WORKDIR_DIRNAME)
+        os.mkdir(self.workflow_dir)
+        os.mkdir(self.workdir)
+
+    def cleanup(self):
+        """
+        Removes the whole job scratch. It can be called more than once
+        """
+        with _ACTIVE_LOCK:
+            if self not in _ACTIVE_SCRATCHES:
+                return
+            _ACTIVE_SCRATCHES.discard(self)
+
+        # The lock is kept until the directory is gone, so the
+        # reaper does not compete for it
+        shutil.rmtree(self.path, True)
+        self.lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+def _held_job_dirs(scratch_root):
+    """
+    The job directories under scratch_root which are the working directory
+    of a process, or where a process has files open. It returns None when
+    the processes cannot be inspected (no procfs)
+    """
+    if not os.path.isdir(PROC_DIR):
+        return None
+
+    root_prefix = os.path.realpath(scratch_root) + '/'
+    held = set()
+    for pid in os.listdir(PROC_DIR):
+        if not pid.isdigit():
+            continue
+        proc_path = os.path.join(PROC_DIR, pid)
+        try:
+            targets = [ os.readlink(os.path.join(proc_path, 'cwd')) ]
+            fd_dir = os.path.join(proc_path, 'fd')
+            targets.extend(os.readlink(os.path.join(fd_dir, fd)) for fd in os.listdir(fd_dir))
+        except OSError:
+            # Gone, or owned by another user (which cannot enter the
+            # job directories, as they are private)
+            continue
+        for target in targets:
+            if target.startswith(root_prefix):
+                held.add(root_prefix + target[len(root_prefix):].split('/', 1)[0])
+
+    return held
+
+def reap_scratch(scratch_root, legacy_max_age=None, force_legacy=False):
+    """
+    Removes the job scratch directories left by dead jobs, i.e. the
+    ones whose lock can be acquired. Directories without lock (created
+    by older versions of the runner) are only removed when they are older
+    than legacy_max_age seconds and no process is using them. When the
+    processes cannot be inspected, they are only removed with force_legacy
+    (cache prune). It returns the list of removed directories.
+    """
+    reaped = []
+    try:
+        entries = os.listdir(scratch_root)
+    except FileNotFoundError:
+        return reaped
+
+    now = time.time()
+    held_dirs = False
+    for entry_name in entries:
+        if not (entry_name.startswith(JOB_PREFIX) and entry_name.endswith(JOB_SUFFIX)):
+            continue
+
+        job_path = os.path.join(scratch_root, entry_name)
+        try:
+            job_stat = os.lstat(job_path)
+        except FileNotFoundError:
+            continue
+        if not os.path.isdir(job_path) or os.path.islink(job_path):
+            continue
+        if now - job_stat.st_mtime < REAP_GRACE_PERIOD:
+            continue
+
+        lock_path = os.path.join(job_path, JobScratch.LOCK_FILENAME)
+        if os.path.exists(lock_path):
+            job_lock = FileLock(lock_path)
+            try:
+                if not job_lock.acquire(blocking=False):
+                    # Alive job
+                    continue
+            except OSError:
+                continue
+            try:
+                shutil.rmtree(job_path, True)
+            finally:
+                job_lock.release()
+        elif legacy_max_age is not None and now - job_stat.st_mtime >= legacy_max_age:
+            # The processes are only inspected once per reap
+            if held_dirs is False:
+                held_dirs = _held_job_dirs(scratch_root)
+            if held_dirs is None:
+                if not force_legacy:
+                    continue
+            elif os.path.join(os.path.realpath(scratch_root), entry_name) in held_dirs:
+                logger.debug("Legacy job scratch directory {} is in use".format(job_path))
+                continue
+            shutil.rmtree(job_path, True)
+        else:
+            continue
+
+        logger.info("Reaped stale job scratch directory {}".format(job_path))
+        reaped.append(job_path)
+
+    return reaped
@@ -0,0 +1,135 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import concurrent.futures
+import os
+import re
+import stat
+import threading
+
+# ------------------------------------------------------------------------------
+
+# Filesystems where each metadata operation is a network round-trip
+REMOTE_FS_TYPES = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', 'lustre', 'gpfs',
+    'beegfs', 'glusterfs', 'ceph', 'fuse.ceph', 'fuse.sshfs', 'fuse.s3fs',
+    'fuse.glusterfs', '9p',
+}
+
+_REMOTE_MOUNTS = None
+
+# Spaces, tabs, newlines and backslashes in the mount points are octal escaped
+_MOUNT_ESCAPE_PAT = re.compile(r'\\([0-7]{3})')
+
+def _unescape_mount_field(field):
+    return _MOUNT_ESCAPE_PAT.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+def remote_mounts(mounts_path='/proc/self/mounts'):
+    """
+    Mount points of the remote filesystems, from the longest one. They
+    are read only once per process
+    """
+    global _REMOTE_MOUNTS
+    if _REMOTE_MOUNTS is None:
+        mount_points = []
+        try:
+            # Paths are not always valid UTF-8, and they are kept as os.fsdecode does
+            with open(mounts_path, mode="r", encoding="utf-8", errors="surrogateescape") as mH:
+                for line in mH:
+                    fields = line.split()
+                    if len(fields) >= 3 and fields[2] in REMOTE_FS_TYPES:
+                        mount_points.append(_unescape_mount_field(fields[1]))
+        except OSError:
+            pass
+        mount_points.sort(key=len, reverse=True)
+        _REMOTE_MOUNTS = mount_points
+
+    return _REMOTE_MOUNTS
+
+def is_remote_path(path):
+    for mount_point in remote_mounts():
+        if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+            return True
+    return False
+
+class StatCache(object):
+    """
+    Remembers the stat of each path (following symlinks, as
+    os.path.exists does), so each path costs a single metadata
+    round-trip. The paths in remote filesystems are stat'ed in
+    parallel by prefetch.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            st = None
+        with self.lock:
+            self.stats[path] = st
+        return st
+
+    def stat(self, path):
+        """
+        The stat of the path, or None when it does not exist
+        """
+        with self.lock:
+            if path in self.stats:
+                return self.stats[path]
+        return self._stat(path)
+
+    def prefetch(self, paths):
+        """
+        Stats all the paths which are not cached yet
+        """
+        with self.lock:
+            pending = [path for path in set(paths) if path not in self.stats]
+
+        remote_paths = []
+        for path in pending:
+            if is_remote_path(path):
+                remote_paths.append(path)
+            else:
+                self._stat(path)
+
+        if len(remote_paths) > 1 and self.max_workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(remote_paths)), thread_name_prefix="vre-stat") as stat_pool:
+                list(stat_pool.map(self._stat, remote_paths))
+        else:
+            for path in remote_paths:
+                self._stat(path)
+
+    def invalidate(self, path):
+        with self.lock:
+            self.stats.pop(path, None)
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
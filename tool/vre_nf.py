@@ -16,7 +16,7 @@
 """
 from __future__ import print_function
 
-import atexit
+import concurrent.futures
 import sys
 import os
 import re
@@ -29,6 +29,7 @@ import tarfile
 import shutil
 import io
 import datetime
+import time
 
 import hashlib
 
@@ -53,13 +54,27 @@ except ImportError:
 from basic_modules.tool import Tool
 from basic_modules.metadata import Metadata
 
+from tool.locks import FileLock, atomic_write
+from tool.commands import run_command, run_commands, run_sequence
+from tool.cache_index import CacheIndex, format_size, parse_size, tree_size
+from tool.docker_api import DockerEngineClient
+from tool.placement import PLACEMENT_STRATEGIES, FilePlacer
+from tool.replay_cache import ReplayCache
+from tool.failures import FAILURE_DETERMINISTIC, FAILURE_UNKNOWN, classify_failure
+from tool.weblog import WeblogServer
+from tool.profiler import PhaseProfiler
+from tool.broker import ResourceBroker, physical_memory
+from tool.statcache import StatCache
+from tool.hashing import DIGEST_ALGORITHM, DigestCache, Hasher, key_digest
+from tool.workcache import WorkCache
+from tool.memo import MemoStore
+from tool.scratch import JobScratch, ScratchTier, choose_scratch_tier, parse_scratch_tiers, reap_scratch
+from tool.archiver import ARCHIVE_KINDS, OMITTED_MANIFEST, WORKDIR_KEEP_GLOBS, archive_extension, archive_selection_from_config, archive_spec_from_config, harvest_dir, pack_dir
+
 import tempfile
 
 # ------------------------------------------------------------------------------
 
-def copy2_nofollow(src, dest):
-    shutil.copy2(src, dest, follow_symlinks=False)
-
 class WF_RUNNER(Tool):
     CONFIG_DIR_KEY = "__config_dir__"
 
@@ -69,8 +84,24 @@ class WF_RUNNER(Tool):
     DEFAULT_NXF_IMAGE='nextflow/nextflow'
     DEFAULT_NXF_VERSION='19.04.1'
     DEFAULT_WF_BASEDIR='WF-checkouts'
+    WF_MIRROR_DIRNAME='mirror.git'
+    WF_READY_SUFFIX='.ready'
+    WF_CACHE_INDEX='cache-index.json'
+    DIGEST_CACHE_FILE='digests.sqlite'
+    WF_SNAPSHOT_PREFIX='snapshot-'
+    WF_IDENTITY_FILE='.vre-workflow.json'
+    DEFAULT_REPLAY_DIRNAME='replays'
+    DEFAULT_SCRATCH_REAP_AGE=86400
+    DEFAULT_SCRATCH_WORK_SIZE_FACTOR=2.0
     DEFAULT_MAX_RETRIES=5
+    DEFAULT_RETRY_BACKOFF=5
+    DEFAULT_RETRY_BACKOFF_MAX=120
+    DEFAULT_TASK_METRICS_FILE='nf-task-metrics.jsonl'
     DEFAULT_MAX_CPUS=4
+    DEFAULT_MIN_CPUS=1
+    DEFAULT_IMAGE_CACHE_TTL=3600
+    DEFAULT_POST_WORKERS=3
+    DEFAULT_STAT_WORKERS=16
     DEFAULT_WORKFLOW_PROFILE = 'docker'
     
     DEFAULT_DOCKER_CMD='docker'
@@ -87,6 +118,14 @@ class WF_RUNNER(Tool):
         CONFIG_DIR_KEY,
     }
     
+    HEX_SHA1_PAT = re.compile(r"^[0-9a-f]{40}$")
+    
+    # Process wide memoization, so the jobs forked by a batch
+    # inherit what was already checked while warming up
+    _confirmed_images = {}
+    _identified_checkouts = {}
+    _local_configs = {}
+    
     MASKED_OUT_KEYS = { 'metrics', 'tar_view', 'tar_nf_stats', 'tar_other', 'workflow_archive' }
     
     IMG_FILE_TYPES = {
@@ -97,15 +136,11 @@ class WF_RUNNER(Tool):
         'tif'
     }
     
-    def __init__(self, configuration=None):
+    @staticmethod
+    def readLocalConfig():
         """
-        Init function
+        It returns the parsed deployment configuration file, and its path
         """
-        logger.info("OpenEBench VRE Nexflow pipeline runner")
-        super().__init__()
-
-        self.timestamp_str = datetime.datetime.now().replace(microsecond=0).strftime("%Y%m%dT%H%M%S")
-        
         local_config = configparser.ConfigParser()
         local_config_filename = sys.argv[0] + '.ini'
         if not os.path.exists(local_config_filename):
@@ -119,20 +154,144 @@ class WF_RUNNER(Tool):
                 # a different user, so let's go through the default path
                 local_config_filename = local_config_filename_template
         
-        # In any case ... let's try reading
+        # In any case ... let's try reading. Long lived processes
+        # only parse it again when it changes
+        try:
+            config_mtime = os.stat(local_config_filename).st_mtime_ns
+        except OSError:
+            config_mtime = None
+        memo_key = (local_config_filename, config_mtime)
+        if config_mtime is not None and memo_key in WF_RUNNER._local_configs:
+            return WF_RUNNER._local_configs[memo_key], local_config_filename
+        
         local_config.read(local_config_filename)
+        if config_mtime is not None:
+            WF_RUNNER._local_configs = { memo_key: local_config }
+        
+        return local_config, local_config_filename
+    
+    def __init__(self, configuration=None):
+        """
+        Init function
+        """
+        logger.info("OpenEBench VRE Nexflow pipeline runner")
+        super().__init__()
+        
+        # Timings of the different phases of the job
+        self.profiler = PhaseProfiler()
+        config_span = self.profiler.begin('load_config')
+
+        self.timestamp_str = datetime.datetime.now().replace(microsecond=0).strftime("%Y%m%dT%H%M%S")
+        
+        local_config, local_config_filename = self.readLocalConfig()
         
         # Setup parameters
+        self.archive_specs = {
+            kind: archive_spec_from_config(local_config, kind)
+            for kind in (None,) + ARCHIVE_KINDS
+        }
+        # The Nextflow workdir archive skips the bulky task outputs
+        self.workdir_selection = archive_selection_from_config(local_config, 'workdir', keep=WORKDIR_KEEP_GLOBS, parse_size=parse_size)
+        self.post_workers = int(local_config.get('archives','workers'))  if local_config.has_option('archives','workers') else self.DEFAULT_POST_WORKERS
         self.nxf_image = local_config.get('nextflow','docker_image')  if local_config.has_option('nextflow','docker_image') else self.DEFAULT_NXF_IMAGE
         self.nxf_version = local_config.get('nextflow','version')  if local_config.has_option('nextflow','version') else self.DEFAULT_NXF_VERSION
         self.max_retries = int(local_config.get('nextflow','max-retries'))  if local_config.has_option('nextflow','max-retries') else self.DEFAULT_MAX_RETRIES
+        self.retry_backoff = float(local_config.get('nextflow','retry-backoff'))  if local_config.has_option('nextflow','retry-backoff') else self.DEFAULT_RETRY_BACKOFF
+        self.retry_backoff_max = float(local_config.get('nextflow','retry-backoff-max'))  if local_config.has_option('nextflow','retry-backoff-max') else self.DEFAULT_RETRY_BACKOFF_MAX
+        self.retry_unknown = local_config.getboolean('nextflow','retry-unknown')  if local_config.has_option('nextflow','retry-unknown') else True
+        self.weblog_enabled = local_config.getboolean('nextflow','weblog')  if local_config.has_option('nextflow','weblog') else False
+        self.weblog_address = local_config.get('nextflow','weblog_address')  if local_config.has_option('nextflow','weblog_address') else None
+        self.task_metrics_file = local_config.get('nextflow','task_metrics_file')  if local_config.has_option('nextflow','task_metrics_file') else self.DEFAULT_TASK_METRICS_FILE
         self.max_cpus = int(local_config.get('nextflow','max-cpus'))  if local_config.has_option('nextflow','max-cpus') else self.DEFAULT_MAX_CPUS
+        self.max_memory = parse_size(local_config.get('nextflow','max-memory'))  if local_config.has_option('nextflow','max-memory') else None
+        self.batch_concurrency = int(local_config.get('batch','concurrency'))  if local_config.has_option('batch','concurrency') else max(1, (os.cpu_count() or 1) // self.max_cpus)
+        self.daemon_socket = os.path.expanduser(local_config.get('daemon','socket'))  if local_config.has_option('daemon','socket') else None
+        self.daemon_cpu_budget = int(local_config.get('daemon','cpu_budget'))  if local_config.has_option('daemon','cpu_budget') else (os.cpu_count() or 1)
         
         self.wf_basedir = os.path.abspath(os.path.expanduser(local_config.get('workflows','basedir')  if local_config.has_option('workflows','basedir') else self.DEFAULT_WF_BASEDIR))
+        self.wf_cache_max_size = parse_size(local_config.get('workflows','max_size'))  if local_config.has_option('workflows','max_size') else None
+        self.wf_cache_index = CacheIndex(os.path.join(self.wf_basedir, self.WF_CACHE_INDEX))
+        
+        # How the report images and metrics are placed
+        placement = local_config.get('defaults','placement').split()  if local_config.has_option('defaults','placement') else PLACEMENT_STRATEGIES
+        self.file_placer = FilePlacer(placement)
+        
+        # Extracted workflow archives, shared by the replays
+        replay_basedir = os.path.abspath(os.path.expanduser(local_config.get('workflows','replay_basedir')))  if local_config.has_option('workflows','replay_basedir') else os.path.join(self.wf_basedir, self.DEFAULT_REPLAY_DIRNAME)
+        self.replay_cache = ReplayCache(replay_basedir, self.file_placer, max_size=self.wf_cache_max_size)
+        
+        # The Nextflow working directories kept for resumable reruns
+        # (only when the work cache is enabled)
+        self.work_cache = None
+        self.work_cache_entry = None
+        if local_config.has_option('workcache','basedir'):
+            work_cache_max_size = parse_size(local_config.get('workcache','max_size'))  if local_config.has_option('workcache','max_size') else None
+            self.work_cache = WorkCache(os.path.abspath(os.path.expanduser(local_config.get('workcache','basedir'))), max_size=work_cache_max_size)
+        
+        # The outputs of successful jobs, published again on identical
+        # submissions (only when the store is enabled)
+        self.memo_store = None
+        self.memo_key = None
+        self.memo_hit = None
+        if local_config.has_option('memo','basedir'):
+            memo_max_size = parse_size(local_config.get('memo','max_size'))  if local_config.has_option('memo','max_size') else None
+            self.memo_store = MemoStore(os.path.abspath(os.path.expanduser(local_config.get('memo','basedir'))), self.file_placer, max_size=memo_max_size)
+        
+        # Digests of the inputs, computed once per job. The ones of
+        # unchanged files are remembered in the digest cache
+        self.input_digests = {}
+        self.input_provenance = None
+        self.hasher = None
+        self.hash_workers = int(local_config.get('hashing','workers'))  if local_config.has_option('hashing','workers') else 0
+        self.hash_provenance = local_config.getboolean('hashing','provenance')  if local_config.has_option('hashing','provenance') else False
+        self.digest_cache_file = os.path.expanduser(local_config.get('hashing','cache_file'))  if local_config.has_option('hashing','cache_file') else os.path.join(self.wf_basedir, self.DIGEST_CACHE_FILE)
+        
+        # Where the job scratch directories are created. The tiers are
+        # tried in order, and basedir is the last resort
+        self.scratch_basedir = os.path.abspath(os.path.expanduser(local_config.get('scratch','basedir')))  if local_config.has_option('scratch','basedir') else tempfile.gettempdir()
+        self.scratch_tiers = parse_scratch_tiers(local_config.get('scratch','tiers'))  if local_config.has_option('scratch','tiers') else []
+        if self.scratch_basedir not in [tier.path for tier in self.scratch_tiers]:
+            self.scratch_tiers.append(ScratchTier(path=self.scratch_basedir, min_free=0))
+        self.scratch_work_size_factor = float(local_config.get('scratch','work_size_factor'))  if local_config.has_option('scratch','work_size_factor') else self.DEFAULT_SCRATCH_WORK_SIZE_FACTOR
+        self.scratch_reap_age = int(local_config.get('scratch','reap_age'))  if local_config.has_option('scratch','reap_age') else self.DEFAULT_SCRATCH_REAP_AGE
+        
+        # The host resources are shared with the other jobs through
+        # the broker ledger, when its state directory is set
+        self.resource_broker = None
+        self.resource_reservation = None
+        if local_config.has_option('resources','state_dir'):
+            total_cpus = int(local_config.get('resources','cpus'))  if local_config.has_option('resources','cpus') else (os.cpu_count() or 1)
+            total_memory = parse_size(local_config.get('resources','memory'))  if local_config.has_option('resources','memory') else physical_memory()
+            min_cpus = int(local_config.get('resources','min_cpus'))  if local_config.has_option('resources','min_cpus') else self.DEFAULT_MIN_CPUS
+            min_memory = parse_size(local_config.get('resources','min_memory'))  if local_config.has_option('resources','min_memory') else 0
+            self.resource_broker = ResourceBroker(os.path.abspath(os.path.expanduser(local_config.get('resources','state_dir'))), total_cpus, total_memory, min_cpus=min_cpus, min_memory=min_memory)
+            self.resource_wait_timeout = float(local_config.get('resources','wait_timeout'))  if local_config.has_option('resources','wait_timeout') else None
+            # Without an explicit request, the memory slice is
+            # proportional to the requested cpus
+            if self.max_memory is None and total_memory is not None:
+                self.max_memory = total_memory * min(self.max_cpus, total_cpus) // total_cpus
 
         # Where the external commands should be located
         self.docker_cmd = local_config.get('defaults','docker_cmd')  if local_config.has_option('defaults','docker_cmd') else self.DEFAULT_DOCKER_CMD
         self.git_cmd = local_config.get('defaults','git_cmd')  if local_config.has_option('defaults','git_cmd') else self.DEFAULT_GIT_CMD
+        # Max seconds the git and docker query commands can take
+        self.command_timeout = float(local_config.get('defaults','command_timeout'))  if local_config.has_option('defaults','command_timeout') else None
+        
+        # Each input and output path is stat'ed only once
+        stat_workers = int(local_config.get('defaults','stat_workers'))  if local_config.has_option('defaults','stat_workers') else self.DEFAULT_STAT_WORKERS
+        self.stat_cache = StatCache(stat_workers)
+        
+        # Image queries can be answered by the Docker Engine API
+        docker_socket = local_config.get('defaults','docker_socket')  if local_config.has_option('defaults','docker_socket') else None
+        self.docker_api = DockerEngineClient(docker_socket)  if docker_socket  else None
+        
+        # The image presence cache lives next to the configuration file
+        self.image_cache_file = local_config_filename.replace('.template', '') + '.images.json'
+        self.image_cache_ttl = int(local_config.get('nextflow','image_cache_ttl'))  if local_config.has_option('nextflow','image_cache_ttl') else self.DEFAULT_IMAGE_CACHE_TTL
+        
+        # Where the job profile is saved (if any)
+        self.profile_file = local_config.get('defaults','profile_file')  if local_config.has_option('defaults','profile_file') else None
+        self.profiler.end(config_span)
         
         if configuration is None:
             configuration = {}
@@ -147,55 +306,225 @@ class WF_RUNNER(Tool):
                 self.configuration[k] = ' '.join(v)
         
         self.populable_outputs = {}
+        
+        # Locks held over the used workflow cache entries
+        self.wf_cache_leases = []
+        
+        # Independent startup steps (like pulling the engine image)
+        # are run in background
+        self.prefetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="vre-prefetch")
+        self.nxf_image_futures = {}
 
-    def fetchNextflow(self,nextflow_version):
-        # Now, we have to assure the nextflow image is already here
-        docker_tag = self.nxf_image+':'+nextflow_version
+    def _lookupImage(self, docker_tag):
+        """
+        It returns the id of the image, or None if it is not available
+        """
+        if self.docker_api is not None:
+            return self.docker_api.inspectImage(docker_tag)
+        
         checkimage_params = [
             self.docker_cmd,"images","--format","{{.ID}}\t{{.Tag}}",docker_tag
         ]
         
-        with tempfile.NamedTemporaryFile() as checkimage_stdout:
-            with tempfile.NamedTemporaryFile() as checkimage_stderr:
-                retval = subprocess.call(checkimage_params,stdout=checkimage_stdout,stderr=checkimage_stderr)
-
-                if retval != 0:
-                    # Reading the output and error for the report
-                    with open(checkimage_stdout.name,"r") as c_stF:
-                        checkimage_stdout_v = c_stF.read()
-                    with open(checkimage_stderr.name,"r") as c_stF:
-                        checkimage_stderr_v = c_stF.read()
-                    
-                    errstr = "ERROR: VRE Nextflow Runner failed while checking Nextflow image (retval {}). Tag: {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(retval,docker_tag,checkimage_stdout_v,checkimage_stderr_v)
-                    logger.fatal(errstr)
-                    raise Exception(errstr)
+        checkimage = run_command(checkimage_params, timeout=self.command_timeout)
+        if checkimage.retval != 0:
+            errstr = "ERROR: VRE Nextflow Runner failed while checking Nextflow image (retval {}). Tag: {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(checkimage.retval,docker_tag,checkimage.stdout,checkimage.stderr)
+            logger.fatal(errstr)
+            raise Exception(errstr)
+        
+        checkimage_line = checkimage.stdout.partition("\n")[0].strip()
+        return checkimage_line.split("\t")[0]  if len(checkimage_line) > 0  else None
+    
+    def _lookupBridgeGateway(self):
+        """
+        It returns the address of the host in the default docker bridge
+        network, which the containers reach without any extra setup
+        """
+        if self.docker_api is not None:
+            gateway = self.docker_api.networkGateway('bridge')
+        else:
+            gateway_params = [
+                self.docker_cmd,"network","inspect","bridge","--format","{{range .IPAM.Config}}{{.Gateway}} {{end}}"
+            ]
+            gateway_result = run_command(gateway_params, timeout=self.command_timeout)
+            if gateway_result.retval != 0:
+                errstr = "ERROR: VRE Nextflow Runner failed while inspecting the docker bridge network (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(gateway_result.retval,gateway_result.stdout,gateway_result.stderr)
+                raise Exception(errstr)
             
-            do_pull_image = os.path.getsize(checkimage_stdout.name) == 0
-                    
+            # Only IPv4 gateways
+            gateway = None
+            for address in gateway_result.stdout.split():
+                if ':' not in address:
+                    gateway = address
+                    break
+        
+        if gateway is None:
+            raise Exception("ERROR: The docker bridge network has no IPv4 gateway")
         
-        if do_pull_image:
+        return gateway
+    
+    def _pullImage(self, docker_tag):
+        if self.docker_api is not None:
+            try:
+                self.docker_api.pullImage(docker_tag)
+            except Exception as error:
+                logger.fatal(str(error))
+                raise
+            return
+        
+        pullimage_params = [
+            self.docker_cmd,"pull",docker_tag
+        ]
+        # Pulls can take long, so they have no timeout
+        pullimage = run_command(pullimage_params)
+        if pullimage.retval != 0:
+            # It failed!
+            errstr = "ERROR: VRE Nextflow Runner failed while pulling Nextflow image (retval {}). Tag: {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(pullimage.retval,docker_tag,pullimage.stdout,pullimage.stderr)
+            logger.fatal(errstr)
+            raise Exception(errstr)
+    
+    def _readImageCache(self):
+        try:
+            with open(self.image_cache_file, mode="r", encoding="utf-8") as icH:
+                return json.load(icH)
+        except (IOError, ValueError):
+            return {}
+    
+    def _writeImageCache(self, image_cache):
+        try:
+            atomic_write(self.image_cache_file, json.dumps(image_cache, indent=1, sort_keys=True))
+        except Exception as error:
+            # It is only an optimization
+            logger.debug("Unable to update image cache {}: {}".format(self.image_cache_file, error))
+    
+    def fetchNextflow(self,nextflow_version):
+        # Now, we have to assure the nextflow image is already here
+        docker_tag = self.nxf_image+':'+nextflow_version
+        now = datetime.datetime.now().timestamp()
+        if (now - self._confirmed_images.get(docker_tag, 0)) < self.image_cache_ttl:
+            return docker_tag
+        
+        # Images confirmed recently are not checked again, as
+        # docker run would pull them anyway if they were removed
+        image_cache = self._readImageCache()
+        cached_image = image_cache.get(docker_tag)
+        if cached_image is not None and (now - cached_image.get('checked', 0)) < self.image_cache_ttl:
+            logger.debug("Nextflow image {} ({}) was recently confirmed".format(docker_tag, cached_image.get('id')))
+            WF_RUNNER._confirmed_images[docker_tag] = cached_image.get('checked', 0)
+            return docker_tag
+        
+        image_id = self._lookupImage(docker_tag)
+        if image_id is None:
             # The image is not here yet
-            pullimage_params = [
-                self.docker_cmd,"pull",docker_tag
-            ]
-            with tempfile.NamedTemporaryFile() as pullimage_stdout:
-                with tempfile.NamedTemporaryFile() as pullimage_stderr:
-                    retval = subprocess.call(pullimage_params,stdout=pullimage_stdout,stderr=pullimage_stderr)
-                    if retval != 0:
-                        # Reading the output and error for the report
-                        with open(pullimage_stdout.name,"r") as c_stF:
-                            pullimage_stdout_v = c_stF.read()
-                        with open(pullimage_stderr.name,"r") as c_stF:
-                            pullimage_stderr_v = c_stF.read()
-                        
-                        # It failed!
-                        errstr = "ERROR: VRE Nextflow Runner failed while pulling Nextflow image (retval {}). Tag: {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(retval,docker_tag,pullimage_stdout_v,pullimage_stderr_v)
-                        logger.fatal(errstr)
-                        raise Exception(errstr)
-
+            self._pullImage(docker_tag)
+            image_id = self._lookupImage(docker_tag)
+        
+        if image_id is not None:
+            # Re-reading, as other jobs could have updated it meanwhile
+            image_cache = self._readImageCache()
+            image_cache[docker_tag] = {
+                'id': image_id,
+                'checked': now,
+            }
+            self._writeImageCache(image_cache)
+            WF_RUNNER._confirmed_images[docker_tag] = now
+        
         return docker_tag
 
+    def _callGitSequence(self, git_cmds, git_uri, git_tag, error_label):
+        """
+        Runs a sequence of git commands (pairs of parameters and working
+        directory), stopping on the first failure, which is reported.
+        They are clones, fetches and checkouts, whose length depends on
+        the repository size, so they are not bounded by command_timeout
+        """
+        git_results = run_sequence(git_cmds)
+        
+        # Proper error handling
+        retval = git_results[-1].retval  if len(git_results) > 0  else 0
+        if retval != 0:
+            git_stdout_v = "".join(git_result.stdout for git_result in git_results)
+            git_stderr_v = "".join(git_result.stderr for git_result in git_results)
+            errstr = "ERROR: VRE Nextflow Runner could not {} '{}' (tag '{}'). Retval {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(error_label,git_uri,git_tag,retval,git_stdout_v,git_stderr_v)
+            raise Exception(errstr)
+    
+    def _isTagInMirror(self, mirror_dir, git_tag):
+        gitverify_params = [
+            self.git_cmd,'rev-parse','--verify','--quiet',git_tag+'^{commit}'
+        ]
+        return run_command(gitverify_params, cwd=mirror_dir, timeout=self.command_timeout).retval == 0
+    
+    def _isImmutableTagInMirror(self, mirror_dir, git_tag):
+        """
+        Full commit hashes and tags always point to the same commit, so
+        the mirror does not need to be fetched when it already has them.
+        Branches (and abbreviated hashes) can move.
+        """
+        if re.fullmatch(r'[0-9a-fA-F]{40}|[0-9a-fA-F]{64}', git_tag):
+            return self._isTagInMirror(mirror_dir, git_tag)
+        
+        tag_ref = git_tag  if git_tag.startswith('refs/tags/')  else 'refs/tags/' + git_tag
+        gittag_params = [
+            self.git_cmd,'show-ref','--verify','--quiet',tag_ref
+        ]
+        return run_command(gittag_params, cwd=mirror_dir, timeout=self.command_timeout).retval == 0
+    
+    def doMaterializeMirror(self, git_uri, git_tag, repo_destdir):
+        """
+        It assures there is a bare mirror of the repository, which
+        knows about the requested tag. The mirror is (incrementally)
+        fetched unless the tag is a full commit hash or a tag already
+        known, so branches are always checked out at their latest commit.
+        
+        The caller must hold the mirror lock.
+        """
+        mirror_dir = os.path.join(repo_destdir, self.WF_MIRROR_DIRNAME)
+        if not os.path.exists(mirror_dir):
+            # The mirror is cloned in a temporary directory, and then
+            # renamed, so it is published only when it is complete.
+            # Branches are mapped to local heads, so they can be
+            # used as tags when the worktrees are created
+            tmp_mirror_dir = tempfile.mkdtemp(prefix=".tmp-mirror-", dir=repo_destdir)
+            try:
+                self._callGitSequence([
+                    ([self.git_cmd,'clone','--bare',git_uri,tmp_mirror_dir], None),
+                    ([self.git_cmd,'config','remote.origin.fetch','+refs/heads/*:refs/heads/*'], tmp_mirror_dir),
+                ], git_uri, git_tag, 'mirror')
+                os.rename(tmp_mirror_dir, mirror_dir)
+            except:
+                shutil.rmtree(tmp_mirror_dir, True)
+                raise
+        elif not self._isImmutableTagInMirror(mirror_dir, git_tag):
+            logger.info("Updating workflow mirror of {} in order to resolve tag {}".format(git_uri, git_tag))
+            self._callGitSequence([
+                ([self.git_cmd,'fetch','--prune','--tags','origin'], mirror_dir),
+            ], git_uri, git_tag, 'update mirror of')
+            
+            # Last resort, the tag could be a commit not reachable
+            # from either a branch or a tag
+            if not self._isTagInMirror(mirror_dir, git_tag):
+                self._callGitSequence([
+                    ([self.git_cmd,'fetch','origin',git_tag], mirror_dir),
+                ], git_uri, git_tag, 'fetch')
+        
+        return mirror_dir
+    
+    def _isRepoTagReady(self, repo_tag_destdir):
+        """
+        A worktree is only valid once its stamp was published.
+        Directories from older cache layouts hold a full clone.
+        """
+        if os.path.exists(repo_tag_destdir + self.WF_READY_SUFFIX):
+            return os.path.isdir(repo_tag_destdir)
+        
+        return os.path.isdir(os.path.join(repo_tag_destdir, '.git'))
+    
     def doMaterializeRepo(self, git_uri, git_tag):
+        """
+        It returns the path to the checkout of the repository at the
+        requested tag. A shared lock is kept over the checkout until
+        releaseRepos is called, so it is not altered while it is used.
+        """
         repo_hashed_id = hashlib.sha1(git_uri.encode('utf-8')).hexdigest()
         repo_hashed_tag_id = hashlib.sha1(git_tag.encode('utf-8')).hexdigest()
         
@@ -203,52 +532,250 @@ class WF_RUNNER(Tool):
         repo_destdir = os.path.join(self.wf_basedir,repo_hashed_id)
         if not os.path.exists(repo_destdir):
             try:
-                os.makedirs(repo_destdir)
+                os.makedirs(repo_destdir, exist_ok=True)
             except IOError as error:
                 errstr = "ERROR: Unable to create intermediate directories for repo {}. ".format(git_uri,);
                 raise Exception(errstr)
         
         repo_tag_destdir = os.path.join(repo_destdir,repo_hashed_tag_id)
-        # We are assuming that, if the directory does exist, it contains the repo
-        if not os.path.exists(repo_tag_destdir):
-            # Try cloing the repository without initial checkout
-            gitclone_params = [
-                self.git_cmd,'clone','-n','--recurse-submodules',git_uri,repo_tag_destdir
-            ]
+        
+        # Fast path, the checkout is already there
+        tag_lock = FileLock(repo_tag_destdir + '.lock')
+        tag_lock.acquire(shared=True)
+        materialized = False
+        if not self._isRepoTagReady(repo_tag_destdir):
+            # Only one process at once can materialize the checkout,
+            # and the other ones are waiting for it
+            tag_lock.acquire(shared=False)
+            try:
+                if not self._isRepoTagReady(repo_tag_destdir):
+                    self._doMaterializeWorktree(git_uri, git_tag, repo_destdir, repo_tag_destdir)
+                    materialized = True
+            except:
+                tag_lock.release()
+                raise
+            
+            tag_lock.acquire(shared=True)
+        
+        self.wf_cache_leases.append(tag_lock)
+        
+        # Usage accounting, so the least recently used entries
+        # are the first ones to be evicted
+        try:
+            mirror_dir = os.path.join(repo_destdir, self.WF_MIRROR_DIRNAME)
+            self.wf_cache_index.touch(
+                repo_hashed_id + '/' + self.WF_MIRROR_DIRNAME,
+                size=tree_size(mirror_dir)  if materialized  else None,
+                hit=False,
+                uri=git_uri
+            )
+            self.wf_cache_index.touch(
+                repo_hashed_id + '/' + repo_hashed_tag_id,
+                size=tree_size(repo_tag_destdir)  if materialized  else None,
+                uri=git_uri,
+                tag=git_tag
+            )
             
-            # Now, checkout the specific commit
-            gitcheckout_params = [
-                self.git_cmd,'checkout',git_tag
+            if materialized:
+                self.pruneWorkflowCache()
+        except Exception as error:
+            logger.warning("Unable to update workflow cache index: "+str(error))
+        
+        return repo_tag_destdir
+    
+    def _doMaterializeWorktree(self, git_uri, git_tag, repo_destdir, repo_tag_destdir):
+        """
+        The caller must hold the exclusive lock of the tag
+        """
+        mirror_lock = FileLock(os.path.join(repo_destdir, self.WF_MIRROR_DIRNAME + '.lock'))
+        with mirror_lock:
+            # All the tags from the same repository share the objects
+            # of a single bare mirror, which is incrementally fetched
+            mirror_dir = self.doMaterializeMirror(git_uri, git_tag, repo_destdir)
+            
+            # Leftovers from a crashed materialization are discarded
+            if os.path.lexists(repo_tag_destdir):
+                logger.warning("Removing incomplete workflow checkout {}".format(repo_tag_destdir))
+                shutil.rmtree(repo_tag_destdir, True)
+            
+            # Worktrees whose directories were removed
+            # would block the creation of the new one
+            gitprune_params = [
+                self.git_cmd,'worktree','prune'
             ]
             
-            # Last, initialize submodules
-            gitsubmodule_params = [
-                self.git_cmd,'submodule','update','--init'
+            # Now, checkout the specific commit in its own worktree
+            gitworktree_params = [
+                self.git_cmd,'worktree','add','--detach',repo_tag_destdir,git_tag
             ]
             
-            with tempfile.NamedTemporaryFile() as git_stdout:
-                with tempfile.NamedTemporaryFile() as git_stderr:
-                    # First, bare clone
-                    retval = subprocess.call(gitclone_params,stdout=git_stdout,stderr=git_stderr)
-                    # Then, checkout
-                    if retval == 0:
-                        retval = subprocess.Popen(gitcheckout_params,stdout=git_stdout,stderr=git_stderr,cwd=repo_tag_destdir).wait()
-                    # Last, submodule preparation
-                    if retval == 0:
-                        retval = subprocess.Popen(gitsubmodule_params,stdout=git_stdout,stderr=git_stderr,cwd=repo_tag_destdir).wait()
-                    
-                    # Proper error handling
-                    if retval != 0:
-                        # Reading the output and error for the report
-                        with open(git_stdout.name,"r") as c_stF:
-                            git_stdout_v = c_stF.read()
-                        with open(git_stderr.name,"r") as c_stF:
-                            git_stderr_v = c_stF.read()
-                        
-                        errstr = "ERROR: VRE Nextflow Runner could not pull '{}' (tag '{}'). Retval {}\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(git_uri,git_tag,retval,git_stdout_v,git_stderr_v)
-                        raise Exception(errstr)
-	 
-        return repo_tag_destdir
+            self._callGitSequence([
+                (gitprune_params, mirror_dir),
+                (gitworktree_params, mirror_dir),
+            ], git_uri, git_tag, 'checkout')
+        
+        # Last, initialize submodules, which are kept per worktree
+        gitsubmodule_params = [
+            self.git_cmd,'submodule','update','--init','--recursive'
+        ]
+        
+        # and validate the checkout
+        gitrevparse_params = [
+            self.git_cmd,'rev-parse','--verify','HEAD'
+        ]
+        
+        self._callGitSequence([
+            (gitsubmodule_params, repo_tag_destdir),
+            (gitrevparse_params, repo_tag_destdir),
+        ], git_uri, git_tag, 'checkout')
+        
+        # The checkout is published
+        atomic_write(repo_tag_destdir + self.WF_READY_SUFFIX, json.dumps({
+            'uri': git_uri,
+            'tag': git_tag,
+        }))
+    
+    def _evictWorkflowCacheEntry(self, entry_id, entry):
+        """
+        Removes a worktree or a mirror from the workflow cache, unless
+        it is being used. Mirrors are only removed once all their
+        worktrees are gone. It is called holding the cache index lock,
+        so it never waits for other locks.
+        """
+        repo_hashed_id, entry_name = entry_id.split('/')
+        repo_destdir = os.path.join(self.wf_basedir, repo_hashed_id)
+        mirror_dir = os.path.join(repo_destdir, self.WF_MIRROR_DIRNAME)
+        mirror_lock = FileLock(mirror_dir + '.lock')
+        
+        if entry_name.startswith(self.WF_SNAPSHOT_PREFIX):
+            snapshot_path = os.path.join(repo_destdir, entry_name)
+            snapshot_lock = FileLock(snapshot_path + '.lock')
+            if not snapshot_lock.acquire(blocking=False):
+                return False
+            try:
+                if os.path.exists(snapshot_path):
+                    os.unlink(snapshot_path)
+            finally:
+                snapshot_lock.release()
+        elif entry_name == self.WF_MIRROR_DIRNAME:
+            if len(self._listWorkflowCacheTags(repo_destdir)) > 0:
+                return False
+            if not mirror_lock.acquire(blocking=False):
+                return False
+            try:
+                shutil.rmtree(mirror_dir, True)
+            finally:
+                mirror_lock.release()
+        else:
+            repo_tag_destdir = os.path.join(repo_destdir, entry_name)
+            tag_lock = FileLock(repo_tag_destdir + '.lock')
+            if not tag_lock.acquire(blocking=False):
+                logger.debug("Workflow cache entry {} is in use".format(entry_id))
+                return False
+            try:
+                # First, the checkout is unpublished
+                if os.path.exists(repo_tag_destdir + self.WF_READY_SUFFIX):
+                    os.unlink(repo_tag_destdir + self.WF_READY_SUFFIX)
+                shutil.rmtree(repo_tag_destdir, True)
+            finally:
+                tag_lock.release()
+        
+        logger.info("Evicted workflow cache entry {} ({} {})".format(entry_id, entry.get('uri'), entry.get('tag', '')))
+        return True
+    
+    def _listWorkflowCacheTags(self, repo_destdir):
+        return [
+            entry_name
+            for entry_name in os.listdir(repo_destdir)
+            if self.HEX_SHA1_PAT.match(entry_name) and os.path.isdir(os.path.join(repo_destdir, entry_name))
+        ]
+    
+    def scanWorkflowCache(self):
+        """
+        Reconciles the workflow cache index with the contents of the
+        cache directory, and it returns the up to date index
+        """
+        if not os.path.isdir(self.wf_basedir):
+            return {}
+        
+        entries = self.wf_cache_index.entries()
+        found_ids = set()
+        new_entries = {}
+        for repo_hashed_id in os.listdir(self.wf_basedir):
+            repo_destdir = os.path.join(self.wf_basedir, repo_hashed_id)
+            if not self.HEX_SHA1_PAT.match(repo_hashed_id) or not os.path.isdir(repo_destdir):
+                continue
+            
+            entry_names = self._listWorkflowCacheTags(repo_destdir)
+            if os.path.isdir(os.path.join(repo_destdir, self.WF_MIRROR_DIRNAME)):
+                entry_names.append(self.WF_MIRROR_DIRNAME)
+            entry_names.extend(
+                entry_name
+                for entry_name in os.listdir(repo_destdir)
+                if entry_name.startswith(self.WF_SNAPSHOT_PREFIX) and entry_name.endswith('.tar.gz')
+            )
+            
+            for entry_name in entry_names:
+                entry_id = repo_hashed_id + '/' + entry_name
+                found_ids.add(entry_id)
+                if entry_id not in entries:
+                    entry_path = os.path.join(repo_destdir, entry_name)
+                    entry_mtime = os.path.getmtime(entry_path)
+                    new_entries[entry_id] = {
+                        'created': entry_mtime,
+                        'last_used': entry_mtime,
+                        'hits': 0,
+                        'size': tree_size(entry_path),
+                    }
+        
+        self.wf_cache_index.update(new_entries, removed_ids=set(entries.keys()) - found_ids)
+        
+        return self.wf_cache_index.entries()
+    
+    def pruneWorkflowCache(self, max_size=None):
+        """
+        Evicts the least recently used workflow checkouts which are not
+        in use, until the cache fits in its size budget
+        """
+        if max_size is None:
+            max_size = self.wf_cache_max_size
+        
+        evicted = self.wf_cache_index.evict(max_size, self._evictWorkflowCacheEntry)
+        self._pruneMirrorWorktrees(evicted)
+        
+        return evicted
+    
+    def _pruneMirrorWorktrees(self, evicted_ids):
+        """
+        The mirrors forget the evicted worktrees once the cache index
+        is released. Busy mirrors are skipped, as the worktrees are also
+        pruned before a new one is added
+        """
+        mirror_dirs = set()
+        for entry_id in evicted_ids:
+            repo_hashed_id, entry_name = entry_id.split('/')
+            if self.HEX_SHA1_PAT.match(entry_name):
+                mirror_dirs.add(os.path.join(self.wf_basedir, repo_hashed_id, self.WF_MIRROR_DIRNAME))
+        
+        for mirror_dir in sorted(mirror_dirs):
+            mirror_lock = FileLock(mirror_dir + '.lock')
+            if not os.path.isdir(mirror_dir) or not mirror_lock.acquire(blocking=False):
+                continue
+            try:
+                if os.path.isdir(mirror_dir):
+                    gitprune = run_command([self.git_cmd,'worktree','prune'], cwd=mirror_dir)
+                    if gitprune.retval != 0:
+                        logger.warning("Unable to prune the worktrees of mirror {} (retval {}): {}".format(mirror_dir, gitprune.retval, gitprune.stderr))
+            finally:
+                mirror_lock.release()
+    
+    def releaseRepos(self):
+        """
+        Releases the locks held over the used workflow checkouts
+        """
+        for tag_lock in self.wf_cache_leases:
+            tag_lock.release()
+        self.wf_cache_leases = []
 
     def guessNextflowVersion(self,repo_tag_destdir):
         # Now, let's guess the repo and nextflow version
@@ -276,74 +803,45 @@ class WF_RUNNER(Tool):
         remote_sha = None
         is_tainted = None
 
-        # These commands must be run using repo_dir as working directory
+        # These commands must be run using repo_dir as working directory,
+        # and as they are independent, they are run at once
         gitremote_params = [
             self.git_cmd, "remote", "get-url", "origin"
         ]
-
-        with tempfile.SpooledTemporaryFile(mode='w+t') as git_stdout, tempfile.SpooledTemporaryFile(mode='w+t') as git_stderr:
-            # First, call git
-            retval = subprocess.call(gitremote_params,stdout=git_stdout,stderr=git_stderr,cwd=repo_dir)
-            # Then, get the value
-            git_stdout.seek(0)
-            if retval == 0:
-                remote_url = git_stdout.readline().strip()
-            else:
-                # Reading the output and error for the report
-                gitremote_stdout_v = git_stdout.read()
-                git_stderr.seek(0)
-                gitremote_stderr_v = git_stderr.read()
-                
-                errstr = "VRE Nextflow Runner failed while checking workflow remote (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(retval,gitremote_stdout_v,gitremote_stderr_v)
-                logger.warning(errstr)
-        
-
         gitrevparse_params = [
             self.git_cmd, "rev-parse","HEAD"
         ]
-
-        with tempfile.SpooledTemporaryFile(mode='w+t') as git_stdout, tempfile.SpooledTemporaryFile(mode='w+t') as git_stderr:
-            # First, call git
-            retval = subprocess.call(gitrevparse_params,stdout=git_stdout,stderr=git_stderr,cwd=repo_dir)
-            # Then, get the value
-            git_stdout.seek(0)
-            if retval == 0:
-                remote_sha = git_stdout.readline().strip()
-            else:
-                # Reading the output and error for the report
-                gitrevparse_stdout_v = git_stdout.read()
-                git_stderr.seek(0)
-                gitrevparse_stderr_v = git_stderr.read()
-                
-                errstr = "VRE Nextflow Runner failed while checking workflow HEAD (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(retval,gitrevparse_stdout_v,gitrevparse_stderr_v)
-                logger.warning(errstr)
-
-        
         gitstatus_params = [
             self.git_cmd, "status","--porcelain"
         ]
-
-        with tempfile.SpooledTemporaryFile(mode='w+t') as git_stdout, tempfile.SpooledTemporaryFile(mode='w+t') as git_stderr:
-            # First, call git
-            retval = subprocess.call(gitstatus_params,stdout=git_stdout,stderr=git_stderr,cwd=repo_dir)
-            # Then, get the value
-            git_stdout.seek(0)
-            if retval == 0:
-                statusmsg = git_stdout.read()
-                if len(statusmsg) > 0:
-                    is_tainted = statusmsg
-            else:
-                # Reading the output and error for the report
-                gitstatus_stdout_v = git_stdout.read()
-                git_stderr.seek(0)
-                gitstatus_stderr_v = git_stderr.read()
-                
-                errstr = "VRE Nextflow Runner failed while checking workflow taint state (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(retval,gitstatus_stdout_v,gitstatus_stderr_v)
-                logger.warning(errstr)
+        gitremote, gitrevparse, gitstatus = run_commands([
+            (gitremote_params, repo_dir),
+            (gitrevparse_params, repo_dir),
+            (gitstatus_params, repo_dir),
+        ], timeout=self.command_timeout)
+        
+        if gitremote.retval == 0:
+            remote_url = gitremote.stdout.partition("\n")[0].strip()
+        else:
+            errstr = "VRE Nextflow Runner failed while checking workflow remote (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(gitremote.retval,gitremote.stdout,gitremote.stderr)
+            logger.warning(errstr)
+        
+        if gitrevparse.retval == 0:
+            remote_sha = gitrevparse.stdout.partition("\n")[0].strip()
+        else:
+            errstr = "VRE Nextflow Runner failed while checking workflow HEAD (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(gitrevparse.retval,gitrevparse.stdout,gitrevparse.stderr)
+            logger.warning(errstr)
+        
+        if gitstatus.retval == 0:
+            if len(gitstatus.stdout) > 0:
+                is_tainted = gitstatus.stdout
+        else:
+            errstr = "VRE Nextflow Runner failed while checking workflow taint state (retval {})\n======\nSTDOUT\n======\n{}\n======\nSTDERR\n======\n{}".format(gitstatus.retval,gitstatus.stdout,gitstatus.stderr)
+            logger.warning(errstr)
 
         return remote_url, remote_sha , is_tainted
     
-    def packDir(self, resultsDir, destTarFile, basePackdir='data'):
+    def packDir(self, resultsDir, destTarFile, basePackdir='data', kind=None, selection=None):
         # This is only needed when a manifest must be generated
         
         #for metrics_file in os.listdir(resultsDir):
@@ -357,11 +855,19 @@ class WF_RUNNER(Tool):
         #        jdata = json.dumps(metricsArray, sort_keys=True, indent=4, separators=(',', ': '))
         #        f.write(unicode(jdata,"utf-8"))
         
-        # And create the MuG/VRE tar file
-        #with tarfile.open(destTarFile,mode='w:gz',bufsize=25*1024*1024) as tar:
-        #    tar.add(resultsDir,arcname=basePackdir,recursive=True)
-
-        subprocess.run(["tar", "--transform", "s#{0}#{1}#".format(resultsDir.lstrip('/'), basePackdir), "-c","-z","-f", destTarFile,resultsDir], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # And create the MuG/VRE tar file, using the archiver
+        # declared for this kind of archive
+        spec = self.archive_specs.get(kind, self.archive_specs[None])
+        with self.profiler.span('pack_' + (kind or 'dir'), format=spec.format) as span:
+            if selection is None:
+                pack_dir(resultsDir, destTarFile, basePackdir, spec)
+            else:
+                omitted = harvest_dir(resultsDir, destTarFile, basePackdir, spec, selection=selection)
+                if len(omitted) > 0:
+                    omitted_bytes = sum(entry['size'] for entry in omitted)
+                    logger.info("{} files ({}) were left out of {}, listed in {}".format(len(omitted), format_size(omitted_bytes), destTarFile, OMITTED_MANIFEST))
+                    span['omitted_bytes'] = omitted_bytes
+            span['bytes'] = os.path.getsize(destTarFile)
 
     # Unpacks an archive to a given directory, and it returns the
     # composed path of the first entry, if it is a directory, or
@@ -377,26 +883,400 @@ class WF_RUNNER(Tool):
 
         return retval
         
+    def prefetchNextflow(self, nextflow_version):
+        """
+        It starts fetching the Nextflow engine image in background,
+        returning the future which provides the docker tag
+        """
+        nxf_image_future = self.nxf_image_futures.get(nextflow_version)
+        if nxf_image_future is None:
+            logger.debug("Prefetching Nextflow engine "+nextflow_version)
+            nxf_image_future = self.prefetch_pool.submit(self.profiler.wrap('fetch_nextflow', self.fetchNextflow, version=nextflow_version), nextflow_version)
+            self.nxf_image_futures[nextflow_version] = nxf_image_future
+        
+        return nxf_image_future
+    
+    def packCheckout(self, repo_dir, destTarFile, basePackdir, identity):
+        """
+        Workflow checkouts are archived without their git metadata, as
+        the ones from the workflows cache only point to the shared
+        mirror. The identity of the checkout is archived instead, so
+        replays do not depend on the workflows cache
+        """
+        repo_uri , repo_sha , is_tainted = identity
+        identity_contents = json.dumps({
+            'uri': repo_uri,
+            'sha': repo_sha,
+            'tainted': is_tainted,
+        }).encode('utf-8')
+        
+        spec = self.archive_specs['workflow']
+        with self.profiler.span('pack_workflow', format=spec.format) as span:
+            harvest_dir(repo_dir, destTarFile, basePackdir, spec, skip_names=('.git',), extra_files={ self.WF_IDENTITY_FILE: identity_contents })
+            span['bytes'] = os.path.getsize(destTarFile)
+    
+    def identifyWorkflow(self, workflow_root_dir):
+        """
+        It returns the uri, commit and taint report of a workflow view,
+        from the identity archived with it. Directories and archives
+        without it are identified through their own git metadata
+        """
+        identity_file = os.path.join(workflow_root_dir, self.WF_IDENTITY_FILE)
+        if not os.path.exists(identity_file):
+            return self.identifyRepo(workflow_root_dir)
+        
+        with open(identity_file, mode="r", encoding="utf-8") as iH:
+            identity = json.load(iH)
+        
+        return identity.get('uri'), identity.get('sha'), identity.get('tainted')
+    
+    def _packWorkflow(self, repo_dir, dest_workflow_archive, nextflow_repo_tag):
+        """
+        It places the workflow archive, returning the path of the file
+        whose contents are the same (the shared snapshot, if any), as its
+        digest is usually already cached
+        """
+        try:
+            with self.profiler.span('place_workflow') as span:
+                base_packdir = 'workflow-'+nextflow_repo_tag
+                identity = self._identifyCheckout(repo_dir)
+                repo_uri , repo_sha , is_tainted = identity
+                if repo_uri is None or repo_sha is None:
+                    raise Exception("ERROR: Unable to identify the workflow checkout {} of {} (tag '{}')".format(repo_dir, self.configuration.get('nextflow_repo_uri'), nextflow_repo_tag))
+                
+                if is_tainted:
+                    # Modified checkouts cannot be shared
+                    self.packCheckout(repo_dir, dest_workflow_archive, base_packdir, identity)
+                    archive_path = dest_workflow_archive
+                else:
+                    archive_path = self._placeWorkflowSnapshot(repo_dir, identity, base_packdir, dest_workflow_archive)
+                span['bytes'] = os.path.getsize(dest_workflow_archive)
+            
+            return archive_path
+        finally:
+            # The cached checkout is not needed any more
+            self.releaseRepos()
+    
+    def _identifyCheckout(self, repo_dir):
+        """
+        identifyRepo, memoized for the published checkouts of the workflows cache
+        """
+        try:
+            stamp_mtime = os.stat(repo_dir + self.WF_READY_SUFFIX).st_mtime_ns
+        except OSError:
+            return self.identifyRepo(repo_dir)
+        
+        memo_key = (repo_dir, stamp_mtime)
+        identity = self._identified_checkouts.get(memo_key)
+        if identity is None:
+            identity = self.identifyRepo(repo_dir)
+            WF_RUNNER._identified_checkouts[memo_key] = identity
+        
+        return identity
+    
+    def getNextflowHomeDir(self, nextflow_version):
+        # Each Nextflow version keeps its own assets
+        return os.path.join(os.path.expanduser("~"), "NXF_HOMES", nextflow_version, ".nextflow")
+    
+    def warmUp(self, workflows):
+        """
+        Materializes in advance the workflows, given as (uri, tag, reldir)
+        tuples, and their Nextflow engine images, so the jobs using them
+        find everything ready
+        """
+        for git_uri, git_tag, reldir in workflows:
+            try:
+                repo_dir = self.doMaterializeRepo(git_uri, git_tag)
+                try:
+                    self._identifyCheckout(repo_dir)
+                    version_dir = os.path.join(repo_dir, reldir)  if reldir  else repo_dir
+                    nextflow_version = self.guessNextflowVersion(version_dir)
+                    self.prefetchNextflow(nextflow_version).result()
+                    os.makedirs(self.getNextflowHomeDir(nextflow_version), exist_ok=True)
+                finally:
+                    self.releaseRepos()
+                logger.info("Warmed up workflow {} ({}) with Nextflow {}".format(git_uri, git_tag, nextflow_version))
+            except Exception as error:
+                logger.warning("Unable to warm up workflow {} ({}): {}: {}".format(git_uri, git_tag, type(error).__name__, str(error)))
+    
+    def _placeWorkflowSnapshot(self, repo_dir, identity, base_packdir, dest_workflow_archive):
+        """
+        Workflow snapshots are content addressed by the commit, so
+        each one of them is built only once, and shared by all the jobs
+        """
+        _ , repo_sha , _ = identity
+        repo_destdir = os.path.dirname(repo_dir)
+        snapshot_name = "{}{}-{}.tar.gz".format(self.WF_SNAPSHOT_PREFIX, repo_sha, hashlib.sha1(base_packdir.encode('utf-8')).hexdigest())
+        snapshot_path = os.path.join(repo_destdir, snapshot_name)
+        
+        snapshot_lock = FileLock(snapshot_path + '.lock')
+        snapshot_lock.acquire(shared=True)
+        try:
+            built = False
+            if not os.path.exists(snapshot_path):
+                snapshot_lock.acquire(shared=False)
+                if not os.path.exists(snapshot_path):
+                    # Atomic publication of the snapshot
+                    tmp_snapshot_path = snapshot_path + '.tmp-' + str(os.getpid())
+                    try:
+                        self.packCheckout(repo_dir, tmp_snapshot_path, base_packdir, identity)
+                        os.rename(tmp_snapshot_path, snapshot_path)
+                    except:
+                        if os.path.exists(tmp_snapshot_path):
+                            os.unlink(tmp_snapshot_path)
+                        raise
+                    built = True
+                snapshot_lock.acquire(shared=True)
+            
+            self._placeFile(snapshot_path, dest_workflow_archive)
+        finally:
+            snapshot_lock.release()
+        
+        try:
+            self.wf_cache_index.touch(
+                os.path.basename(repo_destdir) + '/' + snapshot_name,
+                size=os.path.getsize(snapshot_path)  if built  else None,
+                sha=repo_sha
+            )
+        except Exception as error:
+            logger.warning("Unable to update workflow cache index: "+str(error))
+        
+        return snapshot_path
+    
     INPUT_KEY = 'input'
     
+    def getProjectPath(self):
+        # A relative project path is resolved against config dirname
+        project_path = self.configuration.get('project','.')
+        if not os.path.isabs(project_path):
+            project_path = os.path.normpath(os.path.join(self.config_dir, project_path))
+        
+        return project_path
+    
+    def resolveInputs(self, inputs_locs):
+        """
+        It resolves the input paths against the project path, returning
+        tuples of parameter name, path and resolved path. All of them
+        are stat'ed at once
+        """
+        project_path = self.getProjectPath()
+        resolved_inputs = []
+        for key_name, val_path in inputs_locs.items():
+            if os.path.isabs(val_path):
+                abs_val_path = val_path
+            else:
+                abs_val_path = os.path.normpath(os.path.join(project_path, val_path))
+            resolved_inputs.append((key_name, val_path, abs_val_path))
+        
+        self.stat_cache.prefetch([abs_val_path for _, _, abs_val_path in resolved_inputs])
+        return resolved_inputs
+    
+    def _inputsSize(self, inputs_locs):
+        """
+        Estimated size of the inputs. The size of the directories is
+        taken from the digest cache, and they are only walked when
+        none of their files was hashed before
+        """
+        digest_cache = self.getHasher().cache
+        inputs_size = 0
+        for _, _, abs_val_path in self.resolveInputs(inputs_locs):
+            if self.stat_cache.isdir(abs_val_path):
+                dir_size = None
+                if digest_cache is not None:
+                    try:
+                        dir_size = digest_cache.treeSize(abs_val_path)
+                    except Exception as error:
+                        logger.debug("Digest cache lookup failed for {}: {}".format(abs_val_path, error))
+                inputs_size += dir_size  if dir_size is not None  else tree_size(abs_val_path)
+            elif self.stat_cache.exists(abs_val_path):
+                inputs_size += self.stat_cache.stat(abs_val_path).st_size
+        
+        return inputs_size
+    
+    def reapScratch(self, force_legacy=False):
+        """
+        Removes the scratch directories left by crashed jobs in all the tiers
+        """
+        reaped = []
+        for tier in self.scratch_tiers:
+            try:
+                reaped.extend(reap_scratch(tier.path, self.scratch_reap_age, force_legacy=force_legacy))
+            except Exception as error:
+                logger.warning("Unable to reap stale job scratch directories from {}: {}".format(tier.path, error))
+        
+        return reaped
+    
     # TODO: fix or remove annotation below
     @task(returns=bool, inputs_locs=FILE_IN, goldstandard_dir_loc=FILE_IN, assess_dir_loc=FILE_IN, public_ref_dir_loc=FILE_IN, results_loc=FILE_OUT, stats_loc=FILE_OUT, other_loc=FILE_OUT, dest_workflow_archive=FILE_OUT, isModifier=False)
     def validate_and_assess(self, inputs_locs, results_loc, stats_loc, other_loc, dest_workflow_archive):  # pylint: disable=no-self-use
-        # Temporary directory is removed at the end
-        # being compressed to an archive
+        # Leftovers from crashed jobs are removed before adding a new one
+        self.reapScratch()
+        
+        # The job scratch is removed at the end (the Nextflow workdir
+        # being compressed to an archive), even on failures
         try:
-            workdir = tempfile.mkdtemp(prefix="vre-",suffix="-job")
+            # The Nextflow tasks usually write several times the size
+            # of the inputs. It only matters when there is a choice
+            needed_size = 0
+            if len(self.scratch_tiers) > 1:
+                needed_size = int(self._inputsSize(inputs_locs) * self.scratch_work_size_factor)
+            scratch_tier = choose_scratch_tier(self.scratch_tiers, needed_size)
+            scratch = JobScratch(scratch_tier.path)
+            logger.info("Job scratch directory: "+scratch.path)
         except Exception as error:
-            logger.fatal("ERROR: Unable to create instantiation working directory. Error: "+str(error))
+            logger.fatal("ERROR: Unable to create job scratch directory. Error: "+str(error))
             return False
         
+        job_span = self.profiler.begin('validate_and_assess')
+        try:
+            return self._validateAndAssess(scratch, inputs_locs, results_loc, stats_loc, other_loc, dest_workflow_archive)
+        finally:
+            self.releaseResources()
+            self.releaseWorkCache()
+            scratch.cleanup()
+            self.profiler.end(job_span)
+    
+    def reserveResources(self):
+        """
+        It reserves the share of the host resources for the Nextflow
+        run, waiting for the other jobs if needed. It returns the
+        granted cpus and memory (None when unbounded)
+        """
+        if self.resource_broker is None:
+            return self.max_cpus, self.max_memory
+        
+        with self.profiler.span('reserve_resources', cpus=self.max_cpus) as span:
+            self.resource_reservation = self.resource_broker.reserve(self.max_cpus, self.max_memory, timeout=self.resource_wait_timeout)
+            span['granted_cpus'] = self.resource_reservation.cpus
+        
+        return self.resource_reservation.cpus, self.resource_reservation.memory
+    
+    def releaseResources(self):
+        if self.resource_reservation is not None:
+            self.resource_reservation.release()
+            self.resource_reservation = None
+    
+    def workflowArchiveDigest(self, dest_workflow_archive, digest_path=None):
+        """
+        Digest of the workflow archive, taken from the digest cache
+        when the archive (or the snapshot in digest_path, which has the
+        same contents) was already hashed. It returns None on failures
+        """
+        for archive_path in (digest_path, dest_workflow_archive):
+            if archive_path is None:
+                continue
+            try:
+                with self.profiler.span('hash_workflow') as span:
+                    path_digests, span['bytes'] = self.getHasher().digests([archive_path])
+                return path_digests[archive_path]
+            except Exception as error:
+                logger.debug("Unable to hash workflow archive {}: {}".format(archive_path, error))
+        
+        return None
+    
+    def _buildWorkflowView(self, dest_workflow_archive, view_parent_dir, private_relpaths, archive_digest=None):
+        """
+        It builds the view of the workflow (either an archive or a
+        directory) inside view_parent_dir, and it returns its path
+        """
+        if os.path.isfile(dest_workflow_archive):
+            # Archives are extracted only once, and each job gets its own view
+            try:
+                return self.replay_cache.materialize(dest_workflow_archive, view_parent_dir, private_relpaths, digest=archive_digest)
+            except Exception as error:
+                logger.warning("Replay cache failed ({}: {}). Unpacking the workflow archive".format(type(error).__name__, str(error)))
+                shutil.rmtree(view_parent_dir, True)
+                return self.unpackDir(dest_workflow_archive, view_parent_dir)
+        
+        if os.path.isdir(dest_workflow_archive):
+            repo_dir = os.path.join(view_parent_dir, os.path.basename(os.path.normpath(dest_workflow_archive)))
+            self.replay_cache.buildView(dest_workflow_archive, repo_dir, private_relpaths)
+            return repo_dir
+        
+        return None
+    
+    def getHasher(self):
+        """
+        The digest cache is opened on first use, so it is never shared
+        with forked processes
+        """
+        if self.hasher is None:
+            digest_cache = None
+            if self.digest_cache_file:
+                # Without the cache, every input is hashed
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.digest_cache_file)), exist_ok=True)
+                    digest_cache = DigestCache(self.digest_cache_file)
+                except Exception as error:
+                    logger.warning("Unable to open digest cache {}, so it is not used: {}".format(self.digest_cache_file, error))
+            self.hasher = Hasher(digest_cache, workers=self.hash_workers)
+        
+        return self.hasher
+    
+    def inputDigests(self, variable_infile_params):
+        """
+        Content digests of the inputs, by parameter name
+        """
+        pending_paths = [abs_val_path for _, abs_val_path in variable_infile_params if abs_val_path not in self.input_digests]
+        if len(pending_paths) > 0:
+            with self.profiler.span('hash_inputs') as span:
+                path_digests, span['bytes'] = self.getHasher().digests(pending_paths)
+                self.input_digests.update(path_digests)
+        
+        return {
+            key_name: self.input_digests[abs_val_path]
+            for key_name, abs_val_path in variable_infile_params
+        }
+    
+    def memoKey(self, repo_uri, repo_sha, repo_reldir, repo_profile, nextflow_version, execution_path, variable_infile_params):
+        """
+        Key of the outputs of this job in the memoization store. The
+        parameters are normalized, so the key does not depend on where
+        the inputs are or where the job is run
+        """
+        params = {
+            conf_key: conf_val
+            for conf_key, conf_val in self.configuration.items()
+            if conf_key not in self.MASKED_KEYS
+        }
+        outputs = {
+            out_key: os.path.relpath(out_path, execution_path)
+            for out_key, out_path in self.populable_outputs.items()
+        }
+        return key_digest(
+            uri=repo_uri,
+            sha=repo_sha,
+            reldir=repo_reldir or '',
+            profile=repo_profile or '',
+            nextflow=nextflow_version,
+            params=params,
+            outputs=outputs,
+            inputs=self.inputDigests(variable_infile_params),
+        )
+    
+    def acquireWorkCache(self, repo_uri, repo_sha, repo_reldir, participant_id, variable_infile_params):
+        """
+        It returns the locked work cache entry of this job, or None
+        when the work cache is disabled or it cannot be used
+        """
+        if self.work_cache is None:
+            return None
+        
+        work_cache_key = WorkCache.cacheKey(repo_uri, repo_sha, repo_reldir, participant_id, self.inputDigests(variable_infile_params))
+        self.work_cache_entry = self.work_cache.acquire(work_cache_key, uri=repo_uri, sha=repo_sha, participant=participant_id)
+        return self.work_cache_entry
+    
+    def releaseWorkCache(self):
+        if self.work_cache_entry is not None:
+            self.work_cache.release(self.work_cache_entry)
+            self.work_cache_entry = None
+    
+    def _validateAndAssess(self, scratch, inputs_locs, results_loc, stats_loc, other_loc, dest_workflow_archive):
         # These paths are badly needed
         # This one should be used to resolve relative inputs
         # (a relative project path is resolved against config dirname)
         do_docker_unconfined = self.configuration.get("docker_unconfined", False)
-        project_path = self.configuration.get('project','.')
-        if not os.path.isabs(project_path):
-            project_path = os.path.normpath(os.path.join(self.config_dir, project_path))
+        project_path = self.getProjectPath()
         # This one should be used to resolve relative outputs
         # (a relative execution path is resolved against working directory)
         execution_path = os.path.abspath(self.configuration.get('execution', '.'))
@@ -410,36 +1290,89 @@ class WF_RUNNER(Tool):
             return False
         
         replay_workflow = os.path.exists(dest_workflow_archive)
+        pack_future = None
         if not replay_workflow:
             # First, we need to materialize the workflow
             # checking out the repo to be used
             try:
-                repo_dir = self.doMaterializeRepo(nextflow_repo_uri,nextflow_repo_tag)
+                repo_dir = self.profiler.wrap('materialize_repo', self.doMaterializeRepo)(nextflow_repo_uri,nextflow_repo_tag)
                 logger.info("Fetched workflow: "+nextflow_repo_uri+" ("+nextflow_repo_tag+")")
-                self.packDir(repo_dir, dest_workflow_archive, basePackdir='workflow-'+nextflow_repo_tag)
             except Exception as error:
+                self.releaseRepos()
                 logger.fatal("While materializing repo: "+type(error).__name__ + ': '+str(error))
                 return False
+            
+            # As soon as the checkout is available, the engine image
+            # can be pulled, while the workflow archive is built
+            prefetch_repo_dir = repo_dir
+            if (nextflow_repo_reldir is not None) and len(nextflow_repo_reldir) > 0:
+                prefetch_repo_dir = os.path.join(prefetch_repo_dir, nextflow_repo_reldir)
+            self.prefetchNextflow(self.guessNextflowVersion(prefetch_repo_dir))
+            pack_future = self.prefetch_pool.submit(self._packWorkflow, repo_dir, dest_workflow_archive, nextflow_repo_tag)
+        
+        # Meanwhile, the inputs are validated
+        inputs_span = self.profiler.begin('validate_inputs')
+        variable_infile_params = []
+        
+        failed_parameters = []
+        for key_name, val_path, abs_val_path in self.resolveInputs(inputs_locs):
+            if not self.stat_cache.exists(abs_val_path):
+                    logger.fatal("Parameter {0} uses file {1} (resolved as {2}), but it is not available".format(key_name, val_path, abs_val_path))
+                    failed_parameters.append("{0} ({1})".format(key_name, abs_val_path))
+            variable_infile_params.append((key_name, abs_val_path))
+        self.profiler.end(inputs_span, inputs=len(variable_infile_params))
 
+        if len(failed_parameters) > 0:
+            errmsg = "Files for parameters " + ", ".join(failed_parameters) + " were not found"
+            logger.fatal(errmsg)
+            raise Exception(errmsg)
+        
+        # The fingerprint of what the job consumes is computed while
+        # the workflow and the engine are being fetched
+        if self.hash_provenance:
+            try:
+                self.input_provenance = self.inputDigests(variable_infile_params)
+            except Exception as error:
+                logger.warning("Unable to hash the inputs: "+type(error).__name__ + ': '+str(error))
+        
+        archive_digest_path = None
+        if pack_future is not None:
+            try:
+                archive_digest_path = self.profiler.wrap('wait_workflow', pack_future.result)()
+            except Exception as error:
+                logger.fatal("While materializing repo: "+type(error).__name__ + ': '+str(error))
+                return False
+
+        # The runner appends its setup to this file, so it cannot be shared
+        private_relpaths = [ os.path.join(nextflow_repo_reldir or '', 'nextflow.config') ]
+        
         # If the workflow archive already exists, override all the
         # logic, as we are re-running a previous instance
-        if os.path.isfile(dest_workflow_archive):
-            repo_dir = self.unpackDir(dest_workflow_archive, workdir)
-            workflow_dir = repo_dir
-        elif os.path.isdir(dest_workflow_archive):
-            repo_dir = os.path.join(workdir, ".tmp-wf-{0}_{1}".format(datetime.datetime.now().timestamp(), os.path.basename(dest_workflow_archive)))
-            atexit.register(shutil.rmtree, repo_dir)
-            shutil.copytree(dest_workflow_archive, repo_dir, copy_function=copy2_nofollow)
-            workflow_dir = repo_dir
-        else:
+        view_span = self.profiler.begin('workflow_view')
+        archive_digest = self.workflowArchiveDigest(dest_workflow_archive, archive_digest_path)  if os.path.isfile(dest_workflow_archive)  else None
+        workflow_dir = self._buildWorkflowView(dest_workflow_archive, scratch.workflow_dir, private_relpaths, archive_digest)
+        if workflow_dir is None:
             logger.fatal("FATAL ERROR: {0} workflow path is of an unexpected kind".format(dest_workflow_archive))
             return False
+        self.profiler.end(view_span)
+        
+        # These two values are populated from the workflow checkout info
+        try:
+            new_nextflow_repo_uri , new_nextflow_repo_tag , is_tainted = self.profiler.wrap('identify_repo', self.identifyWorkflow)(workflow_dir)
+        except Exception as error:
+            logger.fatal("While identifying workflow: "+type(error).__name__ + ': '+str(error))
+            return False
+        if new_nextflow_repo_uri is None or new_nextflow_repo_tag is None:
+            logger.fatal("FATAL ERROR: Unable to identify the workflow from {0}".format(dest_workflow_archive))
+            return False
         
         if (nextflow_repo_reldir is not None) and len(nextflow_repo_reldir) > 0:
             workflow_dir = os.path.join(workflow_dir, nextflow_repo_reldir)
+        
+        # On replays, this is the first chance to start fetching the engine
+        if replay_workflow:
+            self.prefetchNextflow(self.guessNextflowVersion(workflow_dir))
 
-        # These two values are populated from the workflow checkout info
-        new_nextflow_repo_uri , new_nextflow_repo_tag , is_tainted = self.identifyRepo(workflow_dir)
         logger.info("Cached workflow: "+new_nextflow_repo_uri+" ("+new_nextflow_repo_tag+")")
 
         if new_nextflow_repo_uri!=nextflow_repo_uri or new_nextflow_repo_tag!=nextflow_repo_tag:
@@ -456,14 +1389,52 @@ class WF_RUNNER(Tool):
         nextflow_version = self.guessNextflowVersion(workflow_dir)
         logger.info("Nextflow engine to be used: "+nextflow_version)
         
+        # Identical submissions publish the outputs of a previous run,
+        # and only workflows identified by their commit are memoized
+        workflow_identified = not is_tainted and self.HEX_SHA1_PAT.match(nextflow_repo_tag or '') is not None
+        if self.memo_store is not None and workflow_identified:
+            try:
+                with self.profiler.span('memo_lookup') as span:
+                    self.memo_key = self.memoKey(nextflow_repo_uri, nextflow_repo_tag, nextflow_repo_reldir, nextflow_repo_profile, nextflow_version, execution_path, variable_infile_params)
+                    self.memo_hit = self.memo_store.lookup(self.memo_key)
+                    span['hit'] = self.memo_hit is not None
+            except Exception as error:
+                logger.warning("Unable to look up the memoized outputs: "+type(error).__name__ + ': '+str(error))
+                self.memo_key = None
+            
+            if self.memo_hit is not None:
+                logger.info("An identical job was already run (memoized as {}). Its outputs are published".format(self.memo_key))
+                # As it happens on successful runs
+                if not replay_workflow and os.path.exists(dest_workflow_archive):
+                    os.unlink(dest_workflow_archive)
+                return True
+        
+        # Reruns of the same job use the same workflow and working
+        # directory paths, so the previous session can be resumed.
+        # Tainted checkouts are not identified by their commit
+        work_cache_entry = None
+        if workflow_identified:
+            try:
+                work_cache_entry = self.acquireWorkCache(nextflow_repo_uri, nextflow_repo_tag, nextflow_repo_reldir, self.configuration['participant_id'], variable_infile_params)
+                if work_cache_entry is not None:
+                    workflow_dir = self._buildWorkflowView(dest_workflow_archive, work_cache_entry.workflow_dir, private_relpaths, archive_digest)
+                    if (nextflow_repo_reldir is not None) and len(nextflow_repo_reldir) > 0:
+                        workflow_dir = os.path.join(workflow_dir, nextflow_repo_reldir)
+                    logger.info("Using work cache entry {} (resumable: {})".format(work_cache_entry.key, work_cache_entry.resumable))
+            except Exception as error:
+                logger.warning("Unable to use the work cache: "+type(error).__name__ + ': '+str(error))
+                self.releaseWorkCache()
+                work_cache_entry = None
+        
         nextflow_version_tuple = tuple(nextflow_version.split("."))
         
         # It is needed at least with version 20.07.1
         do_workdir_include_vol = nextflow_version_tuple < ("20", "07","1")
         
-        # With the version, fetch the engine
+        # With the version, fetch the engine (usually, it is already
+        # being pulled in background)
         try:
-            nxf_image_tag = self.fetchNextflow(nextflow_version)
+            nxf_image_tag = self.profiler.wrap('wait_nextflow', self.prefetchNextflow(nextflow_version).result)()
         except Exception as error:
             logger.fatal("While materializing Nextflow engine "+nextflow_version+": "+type(error).__name__ + ': '+str(error))
             return False
@@ -480,6 +1451,7 @@ class WF_RUNNER(Tool):
         # inputBasename = os.path.basename(input_loc)
         
         # Value needed to compose the Nextflow docker call
+        assemble_span = self.profiler.begin('assemble_params')
         uid = str(os.getuid())
         gid = str(os.getgid())
 
@@ -491,19 +1463,13 @@ class WF_RUNNER(Tool):
             # The default for the worst case
             tzstring = 'Europe/Madrid'
         
-        # Temporary directory is removed at the end
-        # being compressed to an archive
-        try:
-            workdir = tempfile.mkdtemp(prefix="vre-",suffix="-job")
-        except Exception as error:
-            logger.fatal("ERROR: Unable to create nextflow working directory. Error: "+str(error))
-            return False
+        workdir = work_cache_entry.workdir  if work_cache_entry is not None  else scratch.workdir
         
-        dest_workdir_archive = os.path.join(execution_path, 'nf-workdir.tar.gz')
+        dest_workdir_archive = os.path.join(execution_path, 'nf-workdir' + archive_extension(self.archive_specs['workdir']))
         
         # Directories required by Nextflow in a Docker
         homedir = os.path.expanduser("~")
-        nxf_home_dir = os.path.join(homedir, "NXF_HOMES", nextflow_version, ".nextflow")
+        nxf_home_dir = self.getNextflowHomeDir(nextflow_version)
         if not os.path.exists(nxf_home_dir):
             try:
                 os.makedirs(nxf_home_dir, exist_ok=True)
@@ -536,10 +1502,26 @@ class WF_RUNNER(Tool):
             "run", workflow_dir,
         ]
         
+        # The local executor limits come from the granted share
+        granted_cpus, granted_memory = self.reserveResources()
         setup_options: "MutableMapping[str, str]" = {
             "docker.enabled": "true",
-            "executor.$local.cpus": str(self.max_cpus),
+            "executor.$local.cpus": str(granted_cpus),
         }
+        if granted_memory is not None:
+            setup_options["executor.$local.memory"] = "{} MB".format(max(1, granted_memory // (1024 * 1024)))
+        
+        # The task events are received while the workflow runs
+        weblog_server = None
+        if self.weblog_enabled:
+            try:
+                # It only listens where the Nextflow container can reach it
+                weblog_address = self.weblog_address  if self.weblog_address  else self._lookupBridgeGateway()
+                weblog_server = WeblogServer(os.path.join(execution_path, self.task_metrics_file), weblog_address)
+                setup_options["weblog.enabled"] = "true"
+                setup_options["weblog.url"] = weblog_server.url()
+            except Exception as error:
+                logger.warning("Unable to set up the Nextflow weblog endpoint: "+str(error))
         with open(vre_wf_setup_file, mode="w", encoding="utf-8") as vF:
             if do_workdir_include_vol:
                 workdir_vol = "-v {0}:{0}:rw,rprivate,z ".format(workdir)
@@ -553,7 +1535,7 @@ class WF_RUNNER(Tool):
             runOptions = " -u {0}:{1} -e HOME={2} -e TZ={3} {4} {5}".format(uid, gid, homedir, tzstring, workdir_vol, unconfined_docker)
             setup_options["docker.runOptions"] = runOptions
             for key, val in setup_options.items():
-                pval = '"' + val + '"' if " " in val else val
+                pval = '"' + val + '"' if (" " in val) or ("://" in val) else val
                 print(key + " = " + pval, file=vF)
 
             if False:
@@ -605,24 +1587,7 @@ class WF_RUNNER(Tool):
             if conf_key not in self.MASKED_KEYS:
                 variable_params.append((conf_key,self.configuration[conf_key]))
         
-        
-        variable_infile_params = []
-        
-        failed_parameters = []
-        for key_name, val_path in inputs_locs.items():
-            if os.path.isabs(val_path):
-                abs_val_path = val_path
-            else:
-                abs_val_path = os.path.normpath(os.path.join(project_path, val_path))
-            if not os.path.exists(abs_val_path):
-                    logger.fatal("Parameter {0} uses file {1} (resolved as {2}), but it is not available".format(key_name, val_path, abs_val_path))
-                    failed_parameters.append(key_name)
-            variable_infile_params.append((key_name, abs_val_path))
 
-        if len(failed_parameters) > 0:
-            errmsg = "Files for parameters " + " ".join(failed_parameters) + " were not found"
-            logger.fatal(errmsg)
-            raise Exception(errmsg)
         
         variable_outfile_params = [
             ('statsdir',stats_loc+'/'),
@@ -637,22 +1602,23 @@ class WF_RUNNER(Tool):
         
         # Preparing the RO volumes
         for ro_loc_id,ro_loc_val in variable_infile_params:
-            if os.path.exists(ro_loc_val):
-                if ro_loc_val.endswith('/') and os.path.isfile(ro_loc_val):
+            if self.stat_cache.exists(ro_loc_val):
+                if ro_loc_val.endswith('/') and self.stat_cache.isfile(ro_loc_val):
                     ro_loc_val = ro_loc_val[:-1]
-                elif not ro_loc_val.endswith('/') and os.path.isdir(ro_loc_val):
+                elif not ro_loc_val.endswith('/') and self.stat_cache.isdir(ro_loc_val):
                     ro_loc_val += '/'
             volumes.append((ro_loc_val,"ro,rprivate,z"))
             variable_params.append((ro_loc_id,ro_loc_val))
         
         # Preparing the RW volumes
+        self.stat_cache.prefetch([rw_loc_val for _, rw_loc_val in variable_outfile_params if os.path.commonprefix([os.path.normpath(rw_loc_val), execution_path]) != execution_path])
         for rw_loc_id,rw_loc_val in variable_outfile_params:
             # We can skip integrating subpaths of execution_path
             if os.path.commonprefix([os.path.normpath(rw_loc_val), execution_path]) != execution_path:
-                if os.path.exists(rw_loc_val):
-                    if rw_loc_val.endswith('/') and os.path.isfile(rw_loc_val):
+                if self.stat_cache.exists(rw_loc_val):
+                    if rw_loc_val.endswith('/') and self.stat_cache.isfile(rw_loc_val):
                         rw_loc_val = rw_loc_val[:-1]
-                    elif not rw_loc_val.endswith('/') and os.path.isdir(rw_loc_val):
+                    elif not rw_loc_val.endswith('/') and self.stat_cache.isdir(rw_loc_val):
                         rw_loc_val += '/'
                 elif rw_loc_val.endswith('/'):
                     # Forcing the creation of the directory
@@ -666,6 +1632,7 @@ class WF_RUNNER(Tool):
                     with open(rw_loc_val,mode="a") as pop_output_h:
                         logger.debug("Pre-created empty output file (ownership purposes) "+rw_loc_val)
                         pass
+                self.stat_cache.invalidate(rw_loc_val)
                 
                 volumes.append((rw_loc_val,"rprivate,z"))
 
@@ -713,44 +1680,133 @@ class WF_RUNNER(Tool):
         validation_params.extend(validation_params_flags)
         validation_params_resume.extend(validation_params_flags)
         
+        self.profiler.end(assemble_span)
+        
         # Retries system was introduced because an insidious
         # bug happens sometimes
         # https://forums.docker.com/t/any-known-problems-with-symlinks-on-bind-mounts/32138
+        # Only the failures which can vanish by themselves are retried
         retries = self.max_retries
         retval = -1
+        backoff = self.retry_backoff
         validation_params_cmd = validation_params
-        while retries > 0 and retval != 0:
-            logger.debug('"'+'" "'.join(validation_params_cmd)+'"')
-            sys.stdout.flush()
-            sys.stderr.flush()
-            
-            retval = subprocess.call(validation_params_cmd,stdout=sys.stdout,stderr=sys.stderr)
-            if retval != 0:
-                retries -= 1
-                logger.debug("\nFailed with {} , left {} tries\n".format(retval,retries))
-                validation_params_cmd = validation_params_resume
+        if work_cache_entry is not None and work_cache_entry.resumable:
+            validation_params_cmd = validation_params_resume
+        if weblog_server is not None:
+            weblog_server.start()
+        try:
+            while retries > 0 and retval != 0:
+                logger.debug('"'+'" "'.join(validation_params_cmd)+'"')
+                sys.stdout.flush()
+                sys.stderr.flush()
+                
+                run_span = self.profiler.begin('nextflow_run', attempt=self.max_retries - retries + 1)
+                retval = subprocess.call(validation_params_cmd,stdout=sys.stdout,stderr=sys.stderr)
+                self.profiler.end(run_span, retval=retval)
+                if retval != 0:
+                    retries -= 1
+                    failure_class, failure_reason = classify_failure(retval, os.path.join(workdir, '.nextflow.log'))
+                    if failure_class == FAILURE_DETERMINISTIC or (failure_class == FAILURE_UNKNOWN and not self.retry_unknown):
+                        logger.info("\nFailed with {} ({} failure: {}), not retrying\n".format(retval, failure_class, failure_reason))
+                        break
+                
+                    logger.debug("\nFailed with {} ({} failure: {}), left {} tries\n".format(retval, failure_class, failure_reason, retries))
+                    if retries > 0 and backoff > 0:
+                        logger.debug("Waiting {} seconds before retrying".format(backoff))
+                        time.sleep(backoff)
+                        backoff = min(backoff * 2, self.retry_backoff_max)
+                    validation_params_cmd = validation_params_resume
+        finally:
+            # The archives do not need the reserved share
+            self.releaseResources()
+            if weblog_server is not None:
+                weblog_server.stop()
+                logger.info("Metrics from {} tasks written to {}".format(weblog_server.num_tasks, weblog_server.metrics_path))
 
         
         try:
             if retval == 0:
-                # These state files are not needed when it has worked
-                shutil.rmtree(os.path.join(workdir,'work'),True)
+                # These state files are not needed when it has worked,
+                # unless they are kept for the reruns
+                if work_cache_entry is None:
+                    shutil.rmtree(os.path.join(workdir,'work'),True)
                 # The workflow snapshot is removed
                 if not replay_workflow:
                     os.unlink(dest_workflow_archive)
             else:
                 logger.fatal("ERROR: VRE NF evaluation failed. Exit value: "+str(retval))
 
-            # Nextflow workdir is saved for further analysis
-            self.packDir(workdir,dest_workdir_archive,basePackdir='nextflow-workdir')
-                
-            shutil.rmtree(workdir,True)
+            # Nextflow workdir is saved for further analysis, but
+            # the bulky task outputs are left out
+            self.packDir(workdir,dest_workdir_archive,basePackdir='nextflow-workdir',kind='workdir',selection=self.workdir_selection)
         except:
             if retval == 0:
                 retval = 127
         
         return retval == 0
 
+    def harvestDir(self, resultsDir, destTarFile, basePackdir='data', kind=None, visitor=None):
+        """
+        Single pass archiving, where the visitor receives each archived file
+        """
+        spec = self.archive_specs.get(kind, self.archive_specs[None])
+        with self.profiler.span('harvest_' + (kind or 'dir'), format=spec.format) as span:
+            harvest_dir(resultsDir, destTarFile, basePackdir, spec, visitor=visitor)
+            span['bytes'] = os.path.getsize(destTarFile)
+    
+    def _placeFile(self, orig_file_path, new_file_path):
+        # Both paths are usually in the same filesystem,
+        # so no byte copy should be needed
+        return self.file_placer.place(orig_file_path, new_file_path)
+    
+    def _harvestResults(self, results_path, tar_view_path, unique_results_dir, participant_id, metrics_path):
+        found_metrics = []
+        def metrics_visitor(rel_path, orig_file_path):
+            # Redoing metrics path
+            if len(found_metrics) == 0 and os.path.dirname(rel_path) == '':
+                if rel_path.startswith(participant_id) and rel_path.endswith(".json"):
+                    self._placeFile(orig_file_path, metrics_path)
+                    found_metrics.append(orig_file_path)
+        
+        self.harvestDir(results_path, tar_view_path, unique_results_dir, kind='results', visitor=metrics_visitor)
+    
+    def _harvestOther(self, other_path, tar_other_path, unique_other_dir, execution_path, images_file_paths):
+        def images_visitor(rel_path, orig_file_path):
+            # Searching for image-like files
+            other_file = os.path.basename(rel_path)
+            theFileType = other_file.rpartition(".")[2].lower()
+            if theFileType in self.IMG_FILE_TYPES and os.path.isfile(orig_file_path):
+                new_file_path = os.path.join(execution_path, other_file)
+                self._placeFile(orig_file_path, new_file_path)
+                
+                # Populating
+                images_file_paths.append(new_file_path)
+        
+        self.harvestDir(other_path, tar_other_path, unique_other_dir, kind='other', visitor=images_visitor)
+    
+    def _runPostTasks(self, post_tasks):
+        """
+        Runs the post-processing tasks in a bounded pool, gathering
+        all the errors, which are reported together
+        """
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.post_workers, thread_name_prefix="vre-post") as post_pool:
+            futures = [
+                (task_label, post_pool.submit(self.profiler.wrap('post_task', task_func, label=task_label), *task_args, **task_kwargs))
+                for task_label, task_func, task_args, task_kwargs in post_tasks
+            ]
+            for task_label, future in futures:
+                try:
+                    future.result()
+                except Exception as error:
+                    logger.error("While preparing {}: {}: {}".format(task_label, type(error).__name__, str(error)))
+                    errors.append(task_label)
+        
+        if len(errors) > 0:
+            errstr = "VRE NF RUNNER failed while preparing " + ", ".join(errors) + ". See logs"
+            logger.fatal(errstr)
+            raise Exception(errstr)
+    
     def run(self, input_files, input_metadata, output_files, output_metadata):
         """
         The main function to run the compute_metrics tool
@@ -780,9 +1836,7 @@ class WF_RUNNER(Tool):
 
         # This one should be used to resolve relative inputs
         # (a relative project path is resolved against config dirname)
-        project_path = self.configuration.get('project','.')
-        if not os.path.isabs(project_path):
-            project_path = os.path.normpath(os.path.join(self.config_dir, project_path))
+        project_path = self.getProjectPath()
         # This one should be used to resolve relative outputs
         # (a relative execution path is resolved against working directory)
         execution_path = os.path.abspath(self.configuration.get('execution', '.'))
@@ -865,20 +1919,6 @@ class WF_RUNNER(Tool):
             raise Exception("VRE NF RUNNER pipeline failed. See logs")
             return {}, {}
        
-        # Preparing the tar files
-        if os.path.exists(results_path):
-            self.packDir(results_path,tar_view_path,unique_results_dir)
-            # Redoing metrics path
-            for metrics_file in os.listdir(results_path):
-                if metrics_file.startswith(participant_id) and metrics_file.endswith(".json"):
-                    orig_metrics_path = os.path.join(results_path,metrics_file)
-                    shutil.copyfile(orig_metrics_path,metrics_path)
-                    break
-        
-        # Preparing the expected outputs
-        if os.path.exists(stats_path):
-            self.packDir(stats_path,tar_nf_stats_path,'nextflow-stats')
-       
         input_sources: "MutableSequence[Metadata]" = []
         
         for key in input_metadata.keys():
@@ -911,19 +1951,63 @@ class WF_RUNNER(Tool):
         }
         output_files['report_images'] = images_file_paths
         
+        # Preparing the tar files and the expected outputs.
+        # As they are independent, they are run concurrently
+        post_tasks = []
+        # Each output tree is read only once, placing the metrics and
+        # the report images while the archive is written
+        if os.path.exists(results_path):
+            post_tasks.append(("results archive", self._harvestResults, (results_path,tar_view_path,unique_results_dir,participant_id,metrics_path), {}))
+        
+        if os.path.exists(stats_path):
+            post_tasks.append(("stats archive", self.packDir, (stats_path,tar_nf_stats_path,'nextflow-stats'), {'kind': 'stats'}))
+        
         if os.path.exists(other_path):
-            self.packDir(other_path,tar_other_path,'other_'+unique_results_dir)
-            # Searching for image-like files
-            for other_root, other_dirs, other_files in os.walk(other_path):
-                for other_file in other_files:
-                    theFileType = other_file[other_file.rindex(".")+1:].lower()
-                    if theFileType in self.IMG_FILE_TYPES:
-                        orig_file_path = os.path.join(other_root, other_file)
-                        new_file_path = os.path.join(execution_path, other_file)
-                        shutil.copyfile(orig_file_path, new_file_path)
-                        
-                        # Populating
-                        images_file_paths.append(new_file_path)
+            post_tasks.append(("other files archive", self._harvestOther, (other_path,tar_other_path,'other_'+unique_results_dir,execution_path,images_file_paths), {}))
+        
+        # The outputs of each role, as they are memoized
+        role_paths = {
+            'metrics': metrics_path,
+            'tar_view': tar_view_path,
+            'tar_nf_stats': tar_nf_stats_path,
+            'tar_other': tar_other_path,
+        }
+        for out_key, out_path in self.populable_outputs.items():
+            role_paths['output-' + out_key] = out_path
+        
+        if self.memo_hit is not None:
+            # The archives, metrics and images of the identical job
+            # are published as they are
+            try:
+                with self.profiler.span('memo_publish'):
+                    images_file_paths.extend(self.memo_hit.publish(role_paths, execution_path, rebases={
+                        'tar_view': (unique_results_dir, self.archive_specs['results']),
+                        'tar_other': ('other_'+unique_results_dir, self.archive_specs['other']),
+                    }))
+            except Exception as error:
+                errstr = "VRE NF RUNNER failed while publishing memoized outputs {}: {}: {}".format(self.memo_key, type(error).__name__, str(error))
+                logger.fatal(errstr)
+                raise Exception(errstr)
+            finally:
+                self.memo_hit.release()
+        else:
+            self._runPostTasks(post_tasks)
+            
+            if self.memo_key is not None:
+                try:
+                    with self.profiler.span('memo_store'):
+                        self.memo_store.store(self.memo_key, role_paths, images_file_paths, bases={'tar_view': unique_results_dir, 'tar_other': 'other_'+unique_results_dir}, uri=self.configuration.get('nextflow_repo_uri'), participant=participant_id)
+                except Exception as error:
+                    logger.warning("Unable to memoize the job outputs: "+type(error).__name__ + ': '+str(error))
+        
+        # The profile of the job travels with the workflow stats
+        profile = self.profiler.summary()
+        if self.profile_file is not None:
+            profile_path = self.profile_file  if os.path.isabs(self.profile_file)  else os.path.join(execution_path, self.profile_file)
+            try:
+                self.profiler.write(profile_path)
+            except Exception as error:
+                logger.warning("Unable to write job profile {}: {}".format(profile_path, error))
         
         # BEWARE: Order DOES MATTER when there is a dependency from one output on another
         output_metadata_ret = {
@@ -960,7 +2044,12 @@ class WF_RUNNER(Tool):
                 # Reference and golden data set paths should also be here
                 sources=input_sources,
                 meta_data={
-                    "runner": "VRE_NF_RUNNER"
+                    "runner": "VRE_NF_RUNNER",
+                    "profile": {
+                        "elapsed": profile['elapsed'],
+                        "subprocesses": profile['subprocesses'],
+                        "phases": profile['phases'],
+                    }
                 }
             ),
             "tar_other": Metadata(
@@ -1002,4 +2091,12 @@ class WF_RUNNER(Tool):
                 }
             )
         
+        # The fingerprint of the consumed inputs travels with the outputs
+        if self.input_provenance is not None:
+            for output_metadata_entry in output_metadata_ret.values():
+                output_metadata_entry.meta_data["input_digests"] = {
+                    "algorithm": DIGEST_ALGORITHM,
+                    "inputs": self.input_provenance,
+                }
+        
         return (output_files, output_metadata_ret)
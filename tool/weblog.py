@@ -0,0 +1,173 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import hmac
+import http.server
+import json
+import threading
+import uuid
+
+from utils import logger
+
+# ------------------------------------------------------------------------------
+
+# Nextflow events are small JSON documents. Larger requests are
+# rejected without reading them
+MAX_EVENT_SIZE = 1024 * 1024
+
+# Weblog events which close a task
+TASK_END_EVENTS = ('process_completed', 'process_failed')
+
+def _delta(trace, end_key, start_key):
+    end = trace.get(end_key)
+    start = trace.get(start_key)
+    if isinstance(end, (int, float)) and isinstance(start, (int, float)) and end > 0 and start > 0:
+        return end - start
+    return None
+
+def task_metrics(event):
+    """
+    Summarizes the trace of a finished task. Times are in milliseconds
+    and sizes in bytes, as Nextflow reports them
+    """
+    trace = event.get('trace', {})
+    return {
+        'run_name': event.get('runName'),
+        'event': event.get('event'),
+        'task_id': trace.get('task_id'),
+        'process': trace.get('process'),
+        'name': trace.get('name'),
+        'status': trace.get('status'),
+        'exit': trace.get('exit'),
+        'submit': trace.get('submit'),
+        'queue_ms': _delta(trace, 'start', 'submit'),
+        'run_ms': trace.get('realtime'),
+        'duration_ms': trace.get('duration'),
+        'cpu_pct': trace.get('%cpu'),
+        'peak_rss': trace.get('peak_rss'),
+        'peak_vmem': trace.get('peak_vmem'),
+        'rchar': trace.get('rchar'),
+        'wchar': trace.get('wchar'),
+        'read_bytes': trace.get('read_bytes'),
+        'write_bytes': trace.get('write_bytes'),
+    }
+
+class _WeblogHandler(http.server.BaseHTTPRequestHandler):
+    # Stalled clients do not hold the handler threads forever
+    timeout = 30
+
+    def _reject(self, status):
+        # The body is not read, so the connection cannot be reused
+        self.close_connection = True
+        self.send_response(status)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def do_POST(self):
+        # Only the job which knows the token is listened to, and
+        # nothing is read before checking it
+        if not hmac.compare_digest(self.path.rstrip('/'), '/' + self.server.token):
+            self._reject(404)
+            return
+
+        try:
+            content_length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._reject(411)
+            return
+        if content_length < 0 or content_length > MAX_EVENT_SIZE:
+            self._reject(413)
+            return
+
+        payload = self.rfile.read(content_length)
+        self.send_response(200)
+        self.end_headers()
+        try:
+            event = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return
+        self.server.weblog.consume(event)
+
+    def log_message(self, format, *args):
+        # Requests are not worth logging
+        pass
+
+class WeblogServer(object):
+    """
+    HTTP endpoint for the Nextflow weblog. The events are received while
+    the workflow runs, and the metrics of each finished task are appended
+    as a JSON line to metrics_path. It only listens on bind_address,
+    which must be reachable from the Nextflow container
+    """
+
+    def __init__(self, metrics_path, bind_address, port=0):
+        self.metrics_path = metrics_path
+        self.metrics_lock = threading.Lock()
+        self.metrics_fh = None
+        self.num_tasks = 0
+        self.httpd = http.server.ThreadingHTTPServer((bind_address, port), _WeblogHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.token = uuid.uuid4().hex
+        self.httpd.weblog = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def url(self):
+        host = self.httpd.server_address[0]
+        if ':' in host:
+            host = '[' + host + ']'
+        return "http://{}:{}/{}".format(host, self.port, self.httpd.token)
+
+    def start(self):
+        self.metrics_fh = open(self.metrics_path, mode="a", encoding="utf-8")
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="vre-weblog", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+        with self.metrics_lock:
+            if self.metrics_fh is not None:
+                self.metrics_fh.close()
+                self.metrics_fh = None
+
+    def consume(self, event):
+        event_name = event.get('event')
+        if event_name in TASK_END_EVENTS:
+            metrics = task_metrics(event)
+            with self.metrics_lock:
+                if self.metrics_fh is None:
+                    return
+                print(json.dumps(metrics), file=self.metrics_fh, flush=True)
+                self.num_tasks += 1
+            logger.info("Task {} ({}) finished with status {} in {} ms".format(metrics['name'], metrics['task_id'], metrics['status'], metrics['run_ms']))
+        elif event_name in ('started', 'completed', 'error'):
+            logger.info("Nextflow run {} {}".format(event.get('runName'), event_name))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,132 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+
+from utils import logger
+
+from tool.locks import FileLock
+from tool.cache_index import CacheIndex, tree_size
+from tool.hashing import key_digest
+
+# ------------------------------------------------------------------------------
+
+class WorkCacheEntry(object):
+    """
+    A persistent Nextflow working directory, with a fixed layout:
+
+        <work cache basedir>/<key>/
+            workflow/    the workflow view, always at the same path
+            nf-workdir/  the Nextflow launch directory, with the session
+                         history (.nextflow) and the task directories (work)
+
+    It is locked (flock on <key>.lock) by the job using it.
+    """
+
+    WORKFLOW_DIRNAME = 'workflow'
+    WORKDIR_DIRNAME = 'nf-workdir'
+
+    def __init__(self, basedir, key, **info):
+        self.key = key
+        self.info = info
+        self.path = os.path.join(basedir, key)
+        self.workflow_dir = os.path.join(self.path, self.WORKFLOW_DIRNAME)
+        self.workdir = os.path.join(self.path, self.WORKDIR_DIRNAME)
+        self.lock = FileLock(self.path + '.lock')
+
+    @property
+    def resumable(self):
+        """
+        Whether a previous Nextflow session can be resumed
+        """
+        return os.path.exists(os.path.join(self.workdir, '.nextflow', 'history'))
+
+class WorkCache(object):
+    """
+    Cache of Nextflow working directories, keyed by the workflow commit,
+    the participant and the digests of the inputs, so a rerun of the
+    same job can resume the previous session, skipping the unchanged
+    tasks. The least recently used entries are evicted when the cache
+    is larger than max_size.
+    """
+
+    def __init__(self, basedir, max_size=None):
+        self.basedir = basedir
+        self.max_size = max_size
+        self.index = CacheIndex(os.path.join(basedir, 'work-index.json'))
+
+    @staticmethod
+    def cacheKey(repo_uri, repo_sha, repo_reldir, participant_id, input_digests):
+        return key_digest(
+            uri=repo_uri,
+            sha=repo_sha,
+            reldir=repo_reldir or '',
+            participant=participant_id,
+            inputs=input_digests,
+        )
+
+    def acquire(self, key, **info):
+        """
+        It returns the locked entry, or None when another job is using
+        it. The info is recorded in the index when it is released
+        """
+        os.makedirs(self.basedir, exist_ok=True)
+        entry = WorkCacheEntry(self.basedir, key, **info)
+        if not entry.lock.acquire(blocking=False):
+            logger.warning("Work cache entry {} is being used by another job".format(key))
+            return None
+
+        # The workflow view is rebuilt on each run, as the runner
+        # modifies its nextflow.config
+        shutil.rmtree(entry.workflow_dir, True)
+        os.makedirs(entry.workflow_dir)
+        os.makedirs(entry.workdir, exist_ok=True)
+
+        return entry
+
+    def release(self, entry):
+        try:
+            self.index.touch(entry.key, size=tree_size(entry.path), **entry.info)
+        except Exception as error:
+            logger.warning("Unable to update work cache index: "+str(error))
+        finally:
+            entry.lock.release()
+
+        try:
+            self.prune()
+        except Exception as error:
+            logger.warning("Unable to prune work cache: "+str(error))
+
+    def _evict(self, key, entry_info):
+        entry = WorkCacheEntry(self.basedir, key)
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            shutil.rmtree(entry.path, True)
+        finally:
+            entry.lock.release()
+
+        logger.info("Evicted work cache entry {} ({})".format(key, entry_info.get('uri')))
+        return True
+
+    def prune(self, max_size=None):
+        if max_size is None:
+            max_size = self.max_size
+
+        return self.index.evict(max_size, self._evict)